@@ -1,16 +1,15 @@
 import os
+import threading
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-from ultralytics import YOLO
 from collections import Counter
-import torch
-import torch.nn as nn
-from torchvision import transforms, models
-from PIL import Image
 import io
 import base64
-import numpy as np
+
+# NOTE: ultralytics, torch, torchvision and PIL are imported lazily inside the
+# functions that need them so the server (and its container) starts fast.
+# Run `python bench_startup.py` to check the import-time budget.
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
@@ -31,12 +30,31 @@ BCCD_CLASS_NAMES = {
 # MALARIA MODEL CONFIGURATION
 # ============================================================================
 
-MALARIA_MODEL_PATH = r'malaria_model/best_malaria_model_finetuned.pt'
+MALARIA_MODEL_PATH = os.environ.get('MALARIA_MODEL_PATH', r'malaria_model/best_malaria_model_finetuned.pt')
 IMG_SIZE = 224
-DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+# Classifier architecture of the checkpoint above (see classifier_arch.py).
+# Set to 'mobilenet_v3_small' or 'resnet18' to serve a distilled student from
+# distill_classifier.py instead of the EfficientNet-B0 teacher.
+MALARIA_MODEL_ARCH = os.environ.get('MALARIA_MODEL_ARCH', 'efficientnet_b0')
 
 MALARIA_CLASS_NAMES = ['Parasitized', 'Uninfected']
 
+# Optional load-time optimization pass (see classifier_optim.py):
+# BatchNorm + input-normalization folding, channels_last, optional torch.compile
+MALARIA_OPTIMIZE = os.environ.get('MALARIA_OPTIMIZE', '0') == '1'
+MALARIA_COMPILE = os.environ.get('MALARIA_COMPILE', '0') == '1'
+
+# Optional early-exit cascade (see malaria_cascade.py): a tiny screening CNN
+# scores every image and only probabilities inside [LOW, HIGH] reach EfficientNet
+MALARIA_CASCADE = os.environ.get('MALARIA_CASCADE', '0') == '1'
+MALARIA_SCREEN_MODEL_PATH = os.environ.get('MALARIA_SCREEN_MODEL_PATH', r'malaria_model/malaria_screen_tiny.pt')
+MALARIA_CASCADE_LOW = float(os.environ.get('MALARIA_CASCADE_LOW', '0.1'))
+MALARIA_CASCADE_HIGH = float(os.environ.get('MALARIA_CASCADE_HIGH', '0.9'))
+
+# Set PRELOAD_MODELS=1 to load both models at startup instead of on first use
+PRELOAD_MODELS = os.environ.get('PRELOAD_MODELS', '0') == '1'
+
 # ============================================================================
 # UPLOAD CONFIGURATION
 # ============================================================================
@@ -51,42 +69,58 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
 # ============================================================================
-# LOAD MODELS
+# LOAD MODELS (lazily, on first use)
 # ============================================================================
 
 print("="*80)
 print("COMBINED MEDICAL IMAGE ANALYSIS API - FLASK SERVER")
 print("="*80)
-print(f"Device: {DEVICE}")
 
-# Load BCCD Model
-print("\nLoading BCCD model...")
-bccd_model = YOLO(BCCD_MODEL_PATH)
-print("✓ BCCD model loaded successfully!")
+_model_lock = threading.Lock()
+_device = None
+bccd_model = None
+malaria_model = None
+malaria_raw_input = False  # True once the normalization is folded into the model
+malaria_cascade = None
+
+def get_device():
+    """Return the torch device, importing torch on first call"""
+    global _device
+    if _device is None:
+        import torch
+        _device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    return _device
+
+def get_bccd_model():
+    """Load the BCCD YOLO model on first use and return it"""
+    global bccd_model
+    if bccd_model is None:
+        with _model_lock:
+            if bccd_model is None:
+                from ultralytics import YOLO
+                print("\nLoading BCCD model...")
+                bccd_model = YOLO(BCCD_MODEL_PATH)
+                print("✓ BCCD model loaded successfully!")
+    return bccd_model
 
-# Load Malaria Model
-print("\nLoading Malaria model...")
 def load_malaria_model():
-    """Load the fine-tuned EfficientNet-B0 model"""
-    # Create model architecture
-    model = models.efficientnet_b0(weights=None)
-    
-    # Recreate classifier
-    num_features = model.classifier[1].in_features
-    model.classifier = nn.Sequential(
-        nn.Dropout(0.3),
-        nn.Linear(num_features, 128),
-        nn.ReLU(),
-        nn.BatchNorm1d(128),
-        nn.Dropout(0.3),
-        nn.Linear(128, 1),
-        nn.Sigmoid()
-    )
+    """Load the fine-tuned EfficientNet-B0 model (or a distilled student)"""
+    import torch
+    from classifier_arch import build_malaria_classifier
+
+    device = get_device()
+    print(f"\nLoading Malaria model ({MALARIA_MODEL_ARCH}) on {device}...")
+
+    # Create model architecture (EfficientNet-B0 + custom classifier by default)
+    model = build_malaria_classifier(MALARIA_MODEL_ARCH)
     
     # Load weights
-    checkpoint = torch.load(MALARIA_MODEL_PATH, map_location=DEVICE)
+    checkpoint = torch.load(MALARIA_MODEL_PATH, map_location=device)
+    if checkpoint.get('arch', MALARIA_MODEL_ARCH) != MALARIA_MODEL_ARCH:
+        raise ValueError(f"Checkpoint {MALARIA_MODEL_PATH} is a '{checkpoint['arch']}' model "
+                         f"but MALARIA_MODEL_ARCH is '{MALARIA_MODEL_ARCH}'")
     model.load_state_dict(checkpoint['model_state_dict'])
-    model = model.to(DEVICE)
+    model = model.to(device)
     model.eval()
     
     print(f"✓ Malaria model loaded successfully!")
@@ -94,11 +128,50 @@ def load_malaria_model():
     
     return model
 
-malaria_model = load_malaria_model()
-
-print("\n" + "="*80)
-print("All models loaded successfully!")
-print("="*80 + "\n")
+def get_malaria_model():
+    """Load the malaria classifier on first use and return it"""
+    global malaria_model, malaria_raw_input
+    if malaria_model is None:
+        with _model_lock:
+            if malaria_model is None:
+                model = load_malaria_model()
+                if MALARIA_OPTIMIZE:
+                    from classifier_optim import optimize_classifier
+                    try:
+                        model = optimize_classifier(model, IMG_SIZE, get_device(),
+                                                    compile_model=MALARIA_COMPILE)
+                        malaria_raw_input = True
+                    except Exception as e:
+                        print(f"✗ Optimization pass failed, using eager model: {e}")
+                malaria_model = model
+    return malaria_model
+
+def get_malaria_cascade():
+    """Build the screening cascade on first use (only when MALARIA_CASCADE=1)"""
+    global malaria_cascade
+    if malaria_cascade is None:
+        full_model = get_malaria_model()
+        with _model_lock:
+            if malaria_cascade is None:
+                from malaria_cascade import MalariaCascade, load_screen_model
+                print("\nLoading Malaria screening model...")
+                screen_model = load_screen_model(MALARIA_SCREEN_MODEL_PATH, get_device())
+                malaria_cascade = MalariaCascade(
+                    screen_model, full_model, preprocess_image, get_device(),
+                    band=(MALARIA_CASCADE_LOW, MALARIA_CASCADE_HIGH)
+                )
+    return malaria_cascade
+
+if PRELOAD_MODELS:
+    get_bccd_model()
+    get_malaria_model()
+    if MALARIA_CASCADE:
+        get_malaria_cascade()
+    print("\n" + "="*80)
+    print("All models loaded successfully!")
+    print("="*80 + "\n")
+else:
+    print("Models will be loaded on first request (set PRELOAD_MODELS=1 to preload)\n")
 
 # ============================================================================
 # HELPER FUNCTIONS
@@ -117,7 +190,7 @@ def get_bccd_prediction_counts(image_path):
     Returns a dictionary with class names as keys and counts as values.
     """
     # Run inference
-    results = bccd_model(image_path, verbose=False)
+    results = get_bccd_model()(image_path, verbose=False)
     
     # Count predictions by class
     pred_counts = Counter()
@@ -136,31 +209,57 @@ def get_bccd_prediction_counts(image_path):
 
 # --- Malaria Helper Functions ---
 
+def open_image(image_bytes):
+    """Open uploaded image bytes with PIL"""
+    from PIL import Image
+    return Image.open(io.BytesIO(image_bytes))
+
 def preprocess_image(image):
     """Preprocess image for malaria model input"""
+    import torch
+    from torchvision import transforms
+
+    # Convert to RGB if needed
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    if malaria_raw_input:
+        # Normalization is folded into the stem conv: plain uint8 -> float cast.
+        # HWC -> CHW permute of a contiguous array is already channels_last.
+        import numpy as np
+        image = transforms.functional.resize(image, [IMG_SIZE, IMG_SIZE])
+        pixels = torch.from_numpy(np.array(image, dtype=np.uint8))
+        image_tensor = pixels.permute(2, 0, 1).unsqueeze(0).float()
+        return image_tensor.to(get_device())
+
     transform = transforms.Compose([
         transforms.Resize((IMG_SIZE, IMG_SIZE)),
         transforms.ToTensor(),
         transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
     ])
     
-    # Convert to RGB if needed
-    if image.mode != 'RGB':
-        image = image.convert('RGB')
-    
     # Apply transforms
     image_tensor = transform(image).unsqueeze(0)  # Add batch dimension
-    return image_tensor.to(DEVICE)
+    return image_tensor.to(get_device())
 
 def predict_malaria(image):
     """Run inference on the image for malaria detection"""
-    # Preprocess
-    input_tensor = preprocess_image(image)
-    
-    # Predict
-    with torch.no_grad():
-        output = malaria_model(input_tensor)
-        probability = output.item()
+    import torch
+
+    if MALARIA_CASCADE:
+        # Screening model first; only uncertain images reach EfficientNet
+        probability, stage = get_malaria_cascade().predict_probability(image)
+    else:
+        model = get_malaria_model()
+
+        # Preprocess (after the model is loaded, which decides the input format)
+        input_tensor = preprocess_image(image)
+        
+        # Predict
+        with torch.no_grad():
+            output = model(input_tensor)
+            probability = output.item()
+        stage = 'full'
     
     # Get prediction (threshold at 0.5)
     predicted_class = 1 if probability > 0.5 else 0
@@ -176,7 +275,8 @@ def predict_malaria(image):
             'Parasitized': float(1 - probability),
             'Uninfected': float(probability)
         },
-        'is_infected': predicted_class == 0  # Parasitized is class 0
+        'is_infected': predicted_class == 0,  # Parasitized is class 0
+        'decided_by': stage  # 'screen' or 'full' model
     }
 
 # ============================================================================
@@ -205,9 +305,10 @@ def health_check():
         'status': 'healthy',
         'bccd_model_loaded': bccd_model is not None,
         'malaria_model_loaded': malaria_model is not None,
-        'device': str(DEVICE),
+        'device': str(_device) if _device is not None else None,
         'bccd_model_path': BCCD_MODEL_PATH,
-        'malaria_model_path': MALARIA_MODEL_PATH
+        'malaria_model_path': MALARIA_MODEL_PATH,
+        'malaria_model_arch': MALARIA_MODEL_ARCH
     }), 200
 
 # ============================================================================
@@ -306,6 +407,7 @@ def analyse_malaria():
                 "Uninfected": 0.95
             },
             "is_infected": false,
+            "decided_by": "screen" or "full",
             "message": "Analysis completed successfully"
         }
     """
@@ -338,7 +440,7 @@ def analyse_malaria():
             
             # Read image
             image_bytes = file.read()
-            image = Image.open(io.BytesIO(image_bytes))
+            image = open_image(image_bytes)
         
         # Load image from base64
         elif 'image' in request.json:
@@ -348,7 +450,7 @@ def analyse_malaria():
                 if ',' in image_base64:
                     image_base64 = image_base64.split(',')[1]
                 image_bytes = base64.b64decode(image_base64)
-                image = Image.open(io.BytesIO(image_bytes))
+                image = open_image(image_bytes)
             except Exception as e:
                 return jsonify({
                     'success': False,
@@ -375,6 +477,7 @@ def analyse_malaria():
                 'Uninfected': round(result['probabilities']['Uninfected'] * 100, 2)
             },
             'is_infected': result['is_infected'],
+            'decided_by': result['decided_by'],
             'image_info': image_info,
             'message': 'Analysis completed successfully'
         }), 200
@@ -430,7 +533,7 @@ def batch_analyse():
             try:
                 # Read image
                 image_bytes = file.read()
-                image = Image.open(io.BytesIO(image_bytes))
+                image = open_image(image_bytes)
                 
                 # Predict
                 result = predict_malaria(image)
@@ -445,7 +548,8 @@ def batch_analyse():
                     'filename': file.filename,
                     'prediction': result['prediction'],
                     'confidence': round(result['confidence'] * 100, 2),
-                    'is_infected': result['is_infected']
+                    'is_infected': result['is_infected'],
+                    'decided_by': result['decided_by']
                 })
             
             except Exception as e:
@@ -1,5 +1,4 @@
 import os
-from ultralytics import YOLO
 from collections import Counter
 
 # --- Configuration -----------------------------------------------------------
@@ -30,6 +29,7 @@ def count_cells(model_path, image_path, class_names):
     """
     # 1. Load your custom-trained model
     try:
+        from ultralytics import YOLO
         model = YOLO(model_path)
     except Exception as e:
         print(f"Error loading model from {model_path}")
@@ -1,8 +1,12 @@
 import os
-import json
-import numpy as np  # New import
-from ultralytics import YOLO
-from collections import Counter
+import sys
+import time
+from pathlib import Path
+
+# pred_cache.py / detection_eval.py live one level up, next to app.py
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from detection_eval import evaluate_folder, print_detection_metrics
+from pred_cache import CONF_FLOOR, PredictionCache
 
 # --- Configuration -----------------------------------------------------------
 
@@ -22,53 +26,67 @@ CLASS_NAMES = {
     2: 'WBC'
 }
 
+# 5. Images per detector call, and how many decoded batches the background
+#    reader may keep ready ahead of the detector
+BATCH_SIZE = 16
+PREFETCH_BATCHES = 2
+
+# 6. Detection thresholds (Ultralytics predict defaults). Raw predictions are
+#    cached per model in PRED_CACHE_DIR (relative to the weights folder), so
+#    changing CONF_THRESHOLD or the metrics reruns no inference.
+#    Set PRED_CACHE_DIR = None to keep predictions in memory only.
+CONF_THRESHOLD = 0.25
+NMS_IOU = 0.7
+PRED_CACHE_DIR = 'pred_cache'
+
 # --- Functions -------------------------------------------------------------
 
-def get_prediction_counts(model, image_path):
-    """
-    Runs the YOLO model on a single image and returns a Counter object.
-    'model' is the already-loaded YOLO model.
+def read_label_counts(label_path, num_classes):
     """
-    # verbose=False suppresses the per-image print-out
-    results = model(image_path, verbose=False)
-    
-    pred_counts = Counter()
-    if results:
-        class_ids = results[0].boxes.cls.cpu().numpy().astype(int)
-        for cls_id in class_ids:
-            pred_counts[cls_id] += 1
-    return pred_counts
-
-def get_ground_truth_counts(image_path, label_dir):
-    """
-    Reads the corresponding YOLO .txt file and returns a Counter of the actual classes.
+    Per-class object counts of one YOLO .txt label file as an int array.
+    A missing file means no objects; returns None if the file is corrupt.
     """
-    img_filename = os.path.basename(image_path)
-    label_basename, _ = os.path.splitext(img_filename)
-    label_path = os.path.join(label_dir, label_basename + '.txt')
+    import numpy as np
 
     if not os.path.exists(label_path):
         # This is expected if an image has no labels
-        return Counter() 
-
-    truth_counts = Counter()
+        return np.zeros(num_classes, dtype=np.int64)
     try:
         with open(label_path, 'r') as f:
-            for line in f:
-                parts = line.split()
-                if parts:
-                    class_id = int(parts[0])
-                    truth_counts[class_id] += 1
+            class_ids = [int(line.split(maxsplit=1)[0]) for line in f if line.strip()]
+        return np.bincount(np.asarray(class_ids, dtype=np.int64), minlength=num_classes)[:num_classes]
     except Exception as e:
         print(f"Error reading label file {label_path}: {e}")
         return None
-            
-    return truth_counts
+
+def evaluate_counts(cache, image_paths, label_dir, num_classes, conf=CONF_THRESHOLD):
+    """
+    Counts from the prediction cache (filtered at `conf`) against the label
+    files. Returns (image_paths kept, pred counts (N, C), truth counts (N, C)).
+    Images without cached predictions (unreadable) or with a corrupt label
+    file are skipped.
+    """
+    import numpy as np
+
+    kept, preds, truths = [], [], []
+    for image_path in image_paths:
+        det = cache.get(image_path)
+        label_basename, _ = os.path.splitext(os.path.basename(image_path))
+        truth = read_label_counts(os.path.join(label_dir, label_basename + '.txt'), num_classes)
+        if det is None or truth is None:
+            continue  # Skip if the image could not be read or the label file was corrupt
+        preds.append(det.counts(num_classes, conf))
+        truths.append(truth)
+        kept.append(image_path)
+    empty = np.zeros((0, num_classes), dtype=np.int64)
+    return kept, np.stack(preds) if preds else empty, np.stack(truths) if truths else empty
 
 def print_final_metrics(stats, class_names):
     """
     Calculates and prints the final aggregate metrics for all classes.
     """
+    import numpy as np
+
     print("\n" + "="*40)
     print("--- FINAL TEST SET COUNTING METRICS ---")
     print("="*40)
@@ -113,43 +131,52 @@ if __name__ == "__main__":
     if not all(os.path.exists(p) for p in [MODEL_PATH, IMAGE_DIR, LABEL_DIR]):
         print("Error: One or more files/directories specified in the config were not found.")
     else:
-        # 2. Load the model ONCE
-        print("Loading model...")
-        model = YOLO(MODEL_PATH)
-        print("Model loaded.")
-
-        # 3. Get list of all images in the test directory
+        # 2. Get list of all images in the test directory
         image_files = [f for f in os.listdir(IMAGE_DIR) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
         if not image_files:
             print(f"Error: No images found in {IMAGE_DIR}")
             exit()
-            
-        print(f"Found {len(image_files)} images to process...")
 
-        # 4. Initialize storage for our counts
-        # We will store a list of counts, one for each image
-        stats = {
-            0: {'pred': [], 'truth': []}, # Platelets
-            1: {'pred': [], 'truth': []}, # RBC
-            2: {'pred': [], 'truth': []}  # WBC
-        }
-        
-        # 5. Loop through all images and get counts
-        for i, img_file in enumerate(image_files):
-            print(f"  Processing image {i+1}/{len(image_files)}: {img_file}", end='\r')
-            image_path = os.path.join(IMAGE_DIR, img_file)
-            
-            pred_counts = get_prediction_counts(model, image_path)
-            truth_counts = get_ground_truth_counts(image_path, LABEL_DIR)
-
-            if truth_counts is None:
-                continue # Skip if label file was corrupt
-
-            # Store the results for each class
-            for cls_id in stats.keys():
-                stats[cls_id]['pred'].append(pred_counts.get(cls_id, 0))
-                stats[cls_id]['truth'].append(truth_counts.get(cls_id, 0))
+        print(f"Found {len(image_files)} images to process...")
+        image_paths = [os.path.join(IMAGE_DIR, f) for f in image_files]
+
+        # 3. Only images without cached predictions go through the model
+        #    (loaded ONCE, and only if there is anything to predict)
+        cache = PredictionCache(MODEL_PATH, PRED_CACHE_DIR, iou=NMS_IOU,
+                                conf=CONF_THRESHOLD if PRED_CACHE_DIR is None else CONF_FLOOR)
+        missing = cache.missing(image_paths)
+        print(f"{len(image_paths) - len(missing)} images already in the prediction cache, {len(missing)} to predict")
+        if missing:
+            print("Loading model...")
+            from ultralytics import YOLO
+            model = YOLO(MODEL_PATH)
+            print("Model loaded.")
+
+            # Stream the images through the model in batches
+            done = [0]
+            def progress(paths, images, dets):
+                done[0] += len(paths)
+                print(f"  Processed {done[0]}/{len(missing)} images", end='\r')
+            t0 = time.perf_counter()
+            cache.update(model, missing, BATCH_SIZE, PREFETCH_BATCHES, on_batch=progress)
+            elapsed = time.perf_counter() - t0
+            print(f"\n{done[0]} images in {elapsed:.1f}s ({done[0] / max(elapsed, 1e-9):.1f} images/sec, batch {BATCH_SIZE})")
+            if cache.path:
+                print(f"Predictions cached in {cache.path}")
+
+        # 4. Per-image counts as (images x classes) arrays
+        num_classes = max(CLASS_NAMES) + 1
+        kept, pred, truth = evaluate_counts(cache, image_paths, LABEL_DIR, num_classes, CONF_THRESHOLD)
+
+        # 5. One column per class, same layout print_final_metrics expects
+        stats = {cls_id: {'pred': pred[:, cls_id], 'truth': truth[:, cls_id]} for cls_id in CLASS_NAMES}
 
         # 6. Print the final report
-        print("\nProcessing complete.")
-        print_final_metrics(stats, CLASS_NAMES)
\ No newline at end of file
+        print(f"\nProcessing complete: {len(kept)} images evaluated at conf > {CONF_THRESHOLD}")
+        print_final_metrics(stats, CLASS_NAMES)
+
+        # 7. Where the boxes are: match them to the labelled boxes (needs the
+        #    low-confidence predictions for AP, so only with the cache)
+        if PRED_CACHE_DIR is not None:
+            ev = evaluate_folder(cache, kept, LABEL_DIR, num_classes, CONF_THRESHOLD)
+            print_detection_metrics(ev.summary(), CLASS_NAMES, CONF_THRESHOLD)
@@ -0,0 +1,101 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+IMG_EXTS = {".png", ".jpg", ".jpeg"}
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Benchmark the malaria screening cascade against the full EfficientNet model")
+    ap.add_argument("--val-dir", type=str, required=True,
+                    help="Validation images (recursive). Parasitized/ and Uninfected/ subfolders enable accuracy")
+    ap.add_argument("--screen", type=str, default=None, help="Screening checkpoint (default: app.MALARIA_SCREEN_MODEL_PATH)")
+    ap.add_argument("--low", type=float, default=None, help="Lower edge of the uncertainty band")
+    ap.add_argument("--high", type=float, default=None, help="Upper edge of the uncertainty band")
+    ap.add_argument("--limit", type=int, default=None, help="Only use the first N images")
+    return ap.parse_args()
+
+def label_from_path(p: Path):
+    """1 = Uninfected, 0 = Parasitized, None if the folder doesn't say"""
+    for parent in p.parents:
+        name = parent.name.lower()
+        if name == "uninfected":
+            return 1
+        if name == "parasitized":
+            return 0
+    return None
+
+def main():
+    args = parse_args()
+    from PIL import Image
+    import app
+    from malaria_cascade import MalariaCascade, load_screen_model, needs_escalation
+
+    images = sorted(p for p in Path(args.val_dir).rglob("*") if p.suffix.lower() in IMG_EXTS)
+    if args.limit:
+        images = images[:args.limit]
+    if not images:
+        print(f"[Error] No images found in {args.val_dir}", file=sys.stderr)
+        return 1
+
+    device = app.get_device()
+    band = (args.low if args.low is not None else app.MALARIA_CASCADE_LOW,
+            args.high if args.high is not None else app.MALARIA_CASCADE_HIGH)
+    full_model = app.get_malaria_model()
+    screen_model = load_screen_model(args.screen or app.MALARIA_SCREEN_MODEL_PATH, device)
+    cascade = MalariaCascade(screen_model, full_model, app.preprocess_image, device, band=band)
+
+    # Warm up both stages so one-off allocations are not timed
+    with Image.open(images[0]) as im:
+        warm = im.convert("RGB")
+    for _ in range(3):
+        cascade.screen_probability(warm)
+        cascade.full_probability(warm)
+
+    screen_p, full_p, screen_t, full_t, labels = [], [], [], [], []
+    for i, path in enumerate(images):
+        print(f"  Processing image {i+1}/{len(images)}: {path.name}", end='\r')
+        with Image.open(path) as im:
+            image = im.convert("RGB")
+        t0 = time.perf_counter()
+        screen_p.append(cascade.screen_probability(image))
+        t1 = time.perf_counter()
+        full_p.append(cascade.full_probability(image))
+        t2 = time.perf_counter()
+        screen_t.append(t1 - t0)
+        full_t.append(t2 - t1)
+        labels.append(label_from_path(path))
+    print()
+
+    # The cascade's cost per image is the screen pass plus the full pass when escalated
+    escalated = [needs_escalation(p, band) for p in screen_p]
+    cascade_p = [f if esc else s for s, f, esc in zip(screen_p, full_p, escalated)]
+    full_time = sum(full_t)
+    cascade_time = sum(screen_t) + sum(t for t, esc in zip(full_t, escalated) if esc)
+
+    n = len(images)
+    full_dec = [p > 0.5 for p in full_p]
+    cascade_dec = [p > 0.5 for p in cascade_p]
+    agreement = sum(a == b for a, b in zip(full_dec, cascade_dec)) / n
+
+    print("\n" + "="*50)
+    print("--- MALARIA CASCADE BENCHMARK ---")
+    print("="*50)
+    print(f"  Images:                 {n}")
+    print(f"  Uncertainty band:       [{band[0]:.2f}, {band[1]:.2f}]")
+    print(f"  Escalation rate:        {sum(escalated)/n*100:.1f}% ({sum(escalated)}/{n})")
+    print(f"  Full model throughput:  {n/full_time:.1f} img/s")
+    print(f"  Cascade throughput:     {n/cascade_time:.1f} img/s")
+    print(f"  Throughput gain:        {full_time/cascade_time:.2f}x")
+    print(f"  Agreement with full:    {agreement*100:.2f}%")
+
+    known = [(y, f, c) for y, f, c in zip(labels, full_dec, cascade_dec) if y is not None]
+    if known:
+        full_acc = sum(int(f) == y for y, f, _ in known) / len(known)
+        cascade_acc = sum(int(c) == y for y, _, c in known) / len(known)
+        print(f"  Full model accuracy:    {full_acc*100:.2f}% ({len(known)} labelled)")
+        print(f"  Cascade accuracy:       {cascade_acc*100:.2f}%")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
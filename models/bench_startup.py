@@ -0,0 +1,96 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# --- Configuration -----------------------------------------------------------
+
+# Module to time (imported exactly as gunicorn / `python app.py` would)
+DEFAULT_MODULE = "app"
+
+# Total startup budget in milliseconds; the benchmark fails above this
+DEFAULT_BUDGET_MS = 1500.0
+
+# Heavy modules that must NOT be imported at startup
+HEAVY_MODULES = ["ultralytics", "torch", "torchvision", "PIL", "numpy", "cv2"]
+
+# --- Functions -------------------------------------------------------------
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Measure per-module import time of the Flask service and enforce a startup budget")
+    ap.add_argument("--module", type=str, default=DEFAULT_MODULE, help="Module to import (default: app)")
+    ap.add_argument("--budget-ms", type=float, default=float(os.environ.get("STARTUP_BUDGET_MS", DEFAULT_BUDGET_MS)),
+                    help="Fail if total startup time exceeds this many milliseconds")
+    ap.add_argument("--repeat", type=int, default=3, help="Number of cold starts to run; the best one is reported")
+    ap.add_argument("--top", type=int, default=15, help="How many of the slowest modules to print")
+    return ap.parse_args()
+
+def run_once(module, cwd):
+    """
+    Imports `module` in a fresh interpreter with `-X importtime`.
+    Returns (wall_ms, {top_level_module: cumulative_ms}, set_of_all_imported).
+    """
+    code = f"import {module}"
+    env = dict(os.environ, PRELOAD_MODELS="0", PYTHONDONTWRITEBYTECODE="1")
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          cwd=cwd, env=env, capture_output=True, text=True)
+    wall_ms = (time.perf_counter() - t0) * 1000.0
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr)
+        raise SystemExit(f"[Error] `import {module}` failed with exit code {proc.returncode}")
+
+    # Lines look like: "import time:       123 |       4567 |   package.sub"
+    per_module = {}
+    imported = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = [c.strip() for c in line[len("import time:"):].split("|")]
+        if not cumulative.isdigit():
+            continue  # header row
+        imported.add(name.strip())
+        # Only top-level entries (no extra indent) carry a full cumulative cost
+        raw_name = line.rsplit("|", 1)[1]
+        if raw_name[1:].startswith("  "):
+            continue
+        per_module[name] = per_module.get(name, 0.0) + int(cumulative) / 1000.0
+    return wall_ms, per_module, imported
+
+def main():
+    args = parse_args()
+    cwd = os.path.dirname(os.path.abspath(__file__))
+
+    best = None
+    for _ in range(max(1, args.repeat)):
+        run = run_once(args.module, cwd)
+        if best is None or run[0] < best[0]:
+            best = run
+    wall_ms, per_module, imported = best
+
+    print("="*60)
+    print(f"STARTUP IMPORT TIME: import {args.module}")
+    print("="*60)
+    for name, ms in sorted(per_module.items(), key=lambda kv: -kv[1])[:args.top]:
+        print(f"  {ms:9.1f} ms  {name}")
+    print("-"*60)
+    print(f"  Sum of top-level imports: {sum(per_module.values()):.1f} ms")
+    print(f"  Total startup (wall):     {wall_ms:.1f} ms   (budget {args.budget_ms:.0f} ms)")
+
+    failures = []
+    eager_heavy = sorted(m for m in HEAVY_MODULES if m in imported)
+    if eager_heavy:
+        failures.append(f"heavy modules imported at startup: {', '.join(eager_heavy)}")
+    if wall_ms > args.budget_ms:
+        failures.append(f"startup took {wall_ms:.1f} ms > budget {args.budget_ms:.0f} ms")
+
+    if failures:
+        for f in failures:
+            print(f"❌ FAIL: {f}")
+        return 1
+    print("✅ Startup within budget.")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,360 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+IMG_SIZE = 224  # must match app.py
+IMG_EXTS = {".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp"}
+SHARD_SIZE = 4096  # images per shard file (4096 x 3 x 224 x 224 uint8 = ~590 MB)
+META_NAME = "meta.json"
+
+# ============================================================================
+# PRE-DECODED CELL IMAGE SHARDS
+# ============================================================================
+
+# Each split of an ImageFolder tree (train/Parasitized/..., train/Uninfected/...)
+# is decoded and resized ONCE into uint8 arrays of shape (n, 3, IMG_SIZE, IMG_SIZE)
+# stored as .npy shards, plus labels.npy and meta.json:
+#
+#   <out>/train/shard_00000.npy  shard_00001.npy  labels.npy  meta.json
+#
+# ShardDataset memory-maps them, so reading a sample is a page-cache lookup
+# instead of a JPEG decode + resize. The resize is the one transforms.Resize
+# does on PIL images (bilinear), so pixels match the ImageFolder pipeline.
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Decode malaria cell images once into memory-mapped uint8 shards")
+    ap.add_argument("--data", type=str, required=True,
+                    help="Folder with train/ and val/ subfolders, each holding Parasitized/ and Uninfected/")
+    ap.add_argument("--out", type=str, required=True, help="Shard root (one subfolder per split)")
+    ap.add_argument("--splits", nargs="+", default=["train", "val"])
+    ap.add_argument("--img-size", type=int, default=IMG_SIZE)
+    ap.add_argument("--shard-size", type=int, default=SHARD_SIZE)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--force", action="store_true", help="Rebuild even if the source files are unchanged")
+    ap.add_argument("--bench", action="store_true", help="Time one epoch of ImageFolder vs. shard loading afterwards")
+    ap.add_argument("--batch", type=int, default=64, help="Batch size for --bench")
+    return ap.parse_args()
+
+def list_image_folder(split_dir):
+    """(paths, labels, classes) in ImageFolder order: sorted classes, sorted files"""
+    split_dir = Path(split_dir)
+    classes = sorted(d.name for d in split_dir.iterdir() if d.is_dir())
+    paths, labels = [], []
+    for idx, cls in enumerate(classes):
+        files = sorted(p for p in (split_dir / cls).rglob("*") if p.suffix.lower() in IMG_EXTS)
+        paths += [str(p) for p in files]
+        labels += [idx] * len(files)
+    return paths, np.asarray(labels, dtype=np.int64), classes
+
+def decode_cell(path, img_size):
+    """(3, img_size, img_size) uint8, same pixels as Resize((s, s)) + ToTensor() before scaling"""
+    from PIL import Image
+    with Image.open(path) as im:
+        im = im.convert("RGB").resize((img_size, img_size), Image.BILINEAR)
+        return np.asarray(im, dtype=np.uint8).transpose(2, 0, 1)
+
+def _fill_chunk(task):
+    """Worker: decode a run of images into rows [start, start + n) of one shard"""
+    shard_path, start, paths, img_size = task
+    shard = np.load(shard_path, mmap_mode="r+")
+    for i, p in enumerate(paths):
+        shard[start + i] = decode_cell(p, img_size)
+    shard.flush()
+    del shard
+    return len(paths)
+
+def _source_signature(paths):
+    """Cheap fingerprint of a file list: count, total size and newest mtime"""
+    total = newest = 0
+    for p in paths:
+        st = os.stat(p)
+        total += st.st_size
+        newest = max(newest, st.st_mtime_ns)
+    return [len(paths), total, newest]
+
+def build_split(split_dir, out_dir, img_size=IMG_SIZE, shard_size=SHARD_SIZE, workers=1, force=False):
+    """
+    Decodes one ImageFolder split into shards under out_dir. Skipped when
+    meta.json shows the same files, sizes and settings. Returns the meta dict.
+    """
+    from tqdm import tqdm
+
+    out_dir = Path(out_dir)
+    paths, labels, classes = list_image_folder(split_dir)
+    if not paths:
+        raise FileNotFoundError(f"No images found under {split_dir}")
+    meta = {"img_size": img_size, "classes": classes, "count": len(paths),
+            "signature": _source_signature(paths), "files": [os.path.relpath(p, split_dir) for p in paths]}
+    old = read_meta(out_dir)
+    if not force and old and all(old.get(k) == meta[k] for k in ("img_size", "classes", "signature", "files")):
+        print(f"✓ {out_dir}: {old['count']} images already decoded, skipping")
+        return old
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for stale in out_dir.glob("shard_*.npy"):
+        stale.unlink()
+    if (out_dir / META_NAME).exists():
+        (out_dir / META_NAME).unlink()  # an interrupted rebuild must not look complete
+
+    shards, tasks, chunk = [], [], 256
+    for s, start in enumerate(range(0, len(paths), shard_size)):
+        n = min(shard_size, len(paths) - start)
+        shard_path = out_dir / f"shard_{s:05d}.npy"
+        np.lib.format.open_memmap(shard_path, mode="w+", dtype=np.uint8, shape=(n, 3, img_size, img_size)).flush()
+        shards.append({"file": shard_path.name, "count": n})
+        tasks += [(str(shard_path), off, paths[start + off:start + min(off + chunk, n)], img_size)
+                  for off in range(0, n, chunk)]
+
+    bar = tqdm(total=len(paths), desc=f"Decoding {Path(split_dir).name}")
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for n in pool.map(_fill_chunk, tasks):
+                bar.update(n)
+    else:
+        for t in tasks:
+            bar.update(_fill_chunk(t))
+    bar.close()
+
+    np.save(out_dir / "labels.npy", labels)
+    meta["shards"] = shards
+    tmp = out_dir / (META_NAME + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp, out_dir / META_NAME)  # written last: marks the split complete
+    return meta
+
+def read_meta(shard_dir):
+    try:
+        with open(Path(shard_dir) / META_NAME, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# ============================================================================
+# DATASET
+# ============================================================================
+
+class ShardDataset:
+    """
+    Map-style dataset over one split's shards. Items are (uint8 tensor
+    (3, H, W), label) views of the memory-mapped shard - no decode and no
+    copy. Normalization/augmentation happen per batch (see normalize_batch,
+    augment_batch), which is much cheaper than per-sample PIL transforms.
+
+    Works with torch.utils.data.DataLoader; with workers each process maps
+    the files itself (the page cache is shared, the arrays are not pickled).
+    """
+
+    def __init__(self, shard_dir):
+        self.shard_dir = Path(shard_dir)
+        self.meta = read_meta(shard_dir)
+        if self.meta is None:
+            raise FileNotFoundError(f"No complete shard set in {shard_dir} (run cell_shards.py first)")
+        self.classes = self.meta["classes"]
+        self.class_to_idx = {c: i for i, c in enumerate(self.classes)}
+        self.labels = np.load(self.shard_dir / "labels.npy")
+        counts = [s["count"] for s in self.meta["shards"]]
+        self._ends = np.cumsum(counts)
+        self._starts = self._ends - counts
+        self._arrays = None
+
+    def _shards(self):
+        # Opened lazily so each DataLoader worker gets its own mapping
+        if self._arrays is None:
+            # copy-on-write mapping: writable for torch.from_numpy, the file is never modified
+            self._arrays = [np.load(self.shard_dir / s["file"], mmap_mode="c") for s in self.meta["shards"]]
+        return self._arrays
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_arrays"] = None
+        return state
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, idx):
+        import torch
+        s = int(np.searchsorted(self._ends, idx, side="right"))
+        x = self._shards()[s][idx - self._starts[s]]
+        return torch.from_numpy(x), int(self.labels[idx])
+
+    def batches(self, batch_size, shuffle=False, seed=0, epoch=0):
+        """
+        Yields (uint8 (B, 3, H, W) tensor, int64 labels) without a DataLoader:
+        one fancy-indexed read per shard and batch, no per-sample collate.
+        The order only depends on (seed, epoch), so runs are reproducible.
+        """
+        import torch
+        order = np.arange(len(self))
+        if shuffle:
+            order = np.random.default_rng([seed, epoch]).permutation(len(self))
+        arrays = self._shards()
+        for b in range(0, len(order), batch_size):
+            idx = order[b:b + batch_size]
+            shard_of = np.searchsorted(self._ends, idx, side="right")
+            x = np.empty((len(idx),) + arrays[0].shape[1:], dtype=np.uint8)
+            for s in np.unique(shard_of):
+                sel = shard_of == s
+                rows = idx[sel] - self._starts[s]
+                sort = np.argsort(rows)  # sequential reads within the shard
+                x[np.flatnonzero(sel)[sort]] = arrays[s][rows[sort]]
+            yield torch.from_numpy(x), torch.from_numpy(self.labels[idx])
+
+def normalize_batch(x, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225), dtype=None):
+    """uint8 (N, 3, H, W) batch -> ImageNet-normalized float, same values as ToTensor() + Normalize()"""
+    import torch
+    dtype = dtype or torch.float32
+    mean = torch.tensor(mean, device=x.device, dtype=dtype).view(1, -1, 1, 1)
+    std = torch.tensor(std, device=x.device, dtype=dtype).view(1, -1, 1, 1)
+    return x.to(dtype).div_(255.0).sub_(mean).div_(std)  # in place: one allocation per batch
+
+def _perspective_matrices(n, distortion, apply, generator):
+    """
+    (n, 3, 3) homographies in normalized coordinates that map the corners
+    of a RandomPerspective output back to the image corners; identity where
+    apply is False. Corners move inwards by up to `distortion` half-sizes.
+    """
+    import torch
+    start = torch.tensor([[-1., -1.], [1., -1.], [1., 1.], [-1., 1.]], dtype=torch.float64)
+    inward = torch.tensor([[1., 1.], [-1., 1.], [-1., -1.], [1., -1.]], dtype=torch.float64)
+    shift = torch.rand(n, 4, 2, generator=generator, dtype=torch.float64) * distortion * apply[:, None, None]
+    end = start + inward * shift
+    x, y = end[..., 0], end[..., 1]
+    X, Y = start[:, 0].expand(n, 4), start[:, 1].expand(n, 4)
+    one, zero = torch.ones_like(x), torch.zeros_like(x)
+    rows_x = torch.stack([x, y, one, zero, zero, zero, -X * x, -X * y], -1)
+    rows_y = torch.stack([zero, zero, zero, x, y, one, -Y * x, -Y * y], -1)
+    a = torch.cat([rows_x, rows_y], 1)                      # (n, 8, 8)
+    coef = torch.linalg.solve(a, torch.cat([X, Y], 1))      # (n, 8)
+    return torch.cat([coef, torch.ones(n, 1, dtype=torch.float64)], 1).view(n, 3, 3)
+
+def augment_batch(x, generator=None, degrees=0.0, hflip=0.0, vflip=0.0, translate=0.0,
+                  brightness=0.0, contrast=0.0, saturation=0.0, perspective=0.0, perspective_p=0.5):
+    """
+    The torchvision training augmentations (RandomRotation, Random*Flip,
+    RandomAffine translate, RandomPerspective, ColorJitter) for a whole
+    uint8 (N, 3, H, W) batch on its device, with per-sample parameters.
+    All geometric steps are composed into one bilinear warp with black fill,
+    then brightness, contrast and saturation are jittered in that order.
+    Returns float values in [0, 255] for normalize_batch(). Parameters are
+    drawn from `generator` (CPU), so runs are reproducible.
+    """
+    import torch
+    import torch.nn.functional as F
+    n, _, h, w = x.shape
+    f64 = torch.float64
+
+    def uniform(lo, hi):
+        return lo + (hi - lo) * torch.rand(n, generator=generator, dtype=f64)
+
+    def chance(p):
+        return torch.rand(n, generator=generator) < p
+
+    def eye():
+        return torch.eye(3, dtype=f64).repeat(n, 1, 1)
+
+    # Output -> input sampling matrix in normalized [-1, 1] coordinates,
+    # composed backwards through rotate, flip, translate, perspective
+    m = _perspective_matrices(n, perspective, chance(perspective_p), generator) if perspective > 0 else eye()
+    if translate > 0:
+        t = eye()  # whole pixels, as RandomAffine
+        t[:, 0, 2] = -torch.round(uniform(-translate * w, translate * w)) * 2 / w
+        t[:, 1, 2] = -torch.round(uniform(-translate * h, translate * h)) * 2 / h
+        m = t @ m
+    flip = eye()
+    flip[:, 0, 0] = torch.where(chance(hflip), -1.0, 1.0)
+    flip[:, 1, 1] = torch.where(chance(vflip), -1.0, 1.0)
+    m = flip @ m
+    if degrees > 0:
+        angle = torch.deg2rad(uniform(-degrees, degrees))
+        cos, sin = angle.cos(), angle.sin()
+        r = eye()  # rotation in pixels, so non-square images are not sheared
+        r[:, 0, 0], r[:, 0, 1] = cos, -sin * h / w
+        r[:, 1, 0], r[:, 1, 1] = sin * w / h, cos
+        m = r @ m
+
+    ys = (torch.arange(h, dtype=f64) + 0.5) * 2 / h - 1
+    xs = (torch.arange(w, dtype=f64) + 0.5) * 2 / w - 1
+    gy, gx = torch.meshgrid(ys, xs, indexing="ij")
+    pts = torch.stack([gx, gy, torch.ones_like(gx)], -1).view(1, h * w, 3)
+    src = pts @ m.transpose(1, 2)                                # (n, h*w, 3)
+    grid = (src[..., :2] / src[..., 2:]).view(n, h, w, 2).to(device=x.device, dtype=torch.float32)
+    out = F.grid_sample(x.float(), grid, mode="bilinear", padding_mode="zeros", align_corners=False)
+
+    def per_sample(v):
+        return v.to(device=x.device, dtype=out.dtype).view(n, 1, 1, 1)
+
+    if brightness > 0:
+        out = (out * per_sample(uniform(1 - brightness, 1 + brightness))).clamp_(0, 255)
+    gray_w = torch.tensor([0.299, 0.587, 0.114], device=x.device).view(1, 3, 1, 1)
+    if contrast > 0:
+        mean = (out * gray_w).sum(1, keepdim=True).mean((2, 3), keepdim=True)
+        c = per_sample(uniform(1 - contrast, 1 + contrast))
+        out = (out * c + mean * (1 - c)).clamp_(0, 255)
+    if saturation > 0:
+        gray = (out * gray_w).sum(1, keepdim=True)
+        sat = per_sample(uniform(1 - saturation, 1 + saturation))
+        out = (out * sat + gray * (1 - sat)).clamp_(0, 255)
+    return out
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def bench_epoch(loader):
+    t0 = time.perf_counter()
+    n = 0
+    for x, _ in loader:
+        n += x.shape[0]
+    dt = time.perf_counter() - t0
+    return dt, n / max(dt, 1e-9)
+
+def main():
+    args = parse_args()
+    out = Path(args.out)
+    for split in args.splits:
+        meta = build_split(Path(args.data) / split, out / split, args.img_size, args.shard_size, args.workers, args.force)
+        print(f"✓ {split}: {meta['count']} images in {len(meta['shards'])} shards, classes {meta['classes']}")
+
+    if args.bench:
+        import torch
+        from torch.utils.data import DataLoader
+        from torchvision import datasets, transforms
+
+        split = args.splits[0]
+        tf = transforms.Compose([transforms.Resize((args.img_size, args.img_size)), transforms.ToTensor(),
+                                 transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])])
+        folder = DataLoader(datasets.ImageFolder(Path(args.data) / split, transform=tf), batch_size=args.batch)
+        shard_ds = ShardDataset(out / split)
+        shards = DataLoader(shard_ds, batch_size=args.batch)
+        t_folder, r_folder = bench_epoch(folder)
+        t_loader, r_loader = bench_epoch((normalize_batch(x), y) for x, y in shards)
+        t_shard, r_shard = bench_epoch((normalize_batch(x), y) for x, y in shard_ds.batches(args.batch))
+
+        # Same tensors as the ImageFolder pipeline
+        x_ref, _ = next(iter(folder))
+        x_new, _ = next(iter(shards))
+        diff = (normalize_batch(x_new) - x_ref).abs().max().item()
+
+        print("\n" + "="*60)
+        print("--- EPOCH LOADING BENCHMARK ---")
+        print("="*60)
+        print(f"  {'ImageFolder + transforms':<28}{t_folder:>9.2f}s  {r_folder:>10.0f} img/s")
+        print(f"  {'Shards via DataLoader':<28}{t_loader:>9.2f}s  {r_loader:>10.0f} img/s")
+        print(f"  {'Shards .batches()':<28}{t_shard:>9.2f}s  {r_shard:>10.0f} img/s")
+        t_raw, _ = bench_epoch(shard_ds.batches(args.batch))
+        print(f"  {'  of which reading (uint8)':<28}{t_raw:>9.2f}s")
+        print(f"  Speedup: {t_folder / max(t_shard, 1e-9):.1f}x   max |diff| vs ImageFolder: {diff:.2e}")
+
+if __name__ == "__main__":
+    main()
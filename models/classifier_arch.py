@@ -0,0 +1,61 @@
+import copy
+
+import torch.nn as nn
+
+# ============================================================================
+# MALARIA CLASSIFIER ARCHITECTURES
+# ============================================================================
+
+# All architectures output sigmoid P(Uninfected) with shape (N, 1) and take the
+# same 224px ImageNet-normalized input, so checkpoints are interchangeable in
+# load_malaria_model(). Checkpoints are saved as
+# {'model_state_dict', 'val_acc'} (+ 'arch' for distilled students).
+MALARIA_ARCHS = ('efficientnet_b0', 'mobilenet_v3_small', 'resnet18')
+
+def build_malaria_classifier(arch='efficientnet_b0', pretrained=False):
+    """Create an (untrained) malaria classifier for the given architecture"""
+    from torchvision import models
+
+    if arch == 'efficientnet_b0':
+        model = models.efficientnet_b0(weights='DEFAULT' if pretrained else None)
+
+        # Same head as the fine-tuned model from the notebook
+        num_features = model.classifier[1].in_features
+        model.classifier = nn.Sequential(
+            nn.Dropout(0.3),
+            nn.Linear(num_features, 128),
+            nn.ReLU(),
+            nn.BatchNorm1d(128),
+            nn.Dropout(0.3),
+            nn.Linear(128, 1),
+            nn.Sigmoid()
+        )
+    elif arch == 'mobilenet_v3_small':
+        model = models.mobilenet_v3_small(weights='DEFAULT' if pretrained else None)
+        num_features = model.classifier[-1].in_features
+        model.classifier[-1] = nn.Linear(num_features, 1)
+        model.classifier.append(nn.Sigmoid())
+    elif arch == 'resnet18':
+        model = models.resnet18(weights='DEFAULT' if pretrained else None)
+        model.fc = nn.Sequential(
+            nn.Linear(model.fc.in_features, 1),
+            nn.Sigmoid()
+        )
+    else:
+        raise ValueError(f"Unknown malaria classifier architecture '{arch}'. Choose from: {', '.join(MALARIA_ARCHS)}")
+    return model
+
+def without_sigmoid(model):
+    """
+    The same classifier (shared parameters, same state_dict keys) with the
+    final Sigmoid of its head removed, i.e. returning logits. Losses should
+    use these: a saturated Sigmoid output has no gradient left.
+    """
+    view = copy.copy(model)
+    view._modules = model._modules.copy()  # copy.copy alone would share the submodule dict
+    for name in ('classifier', 'fc'):
+        head = view._modules.get(name)
+        if isinstance(head, nn.Sequential) and isinstance(head[-1], nn.Sigmoid):
+            view._modules[name] = head[:-1]
+            return view
+    raise ValueError("Model has no Sequential head ending in a Sigmoid")
@@ -0,0 +1,198 @@
+import copy
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+# ImageNet statistics used by preprocess_image() in app.py
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+# Max |eager - optimized| allowed on the sigmoid output
+PARITY_ATOL = 1e-4
+PARITY_SAMPLES = 4
+
+# ============================================================================
+# BATCHNORM FOLDING
+# ============================================================================
+
+def _bn_scale_shift(bn):
+    """Per-channel (scale, shift) so that bn(x) == x * scale + shift in eval mode"""
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    shift = bn.bias - bn.running_mean * scale
+    return scale, shift
+
+def _ensure_bias(layer):
+    if layer.bias is None:
+        layer.bias = nn.Parameter(torch.zeros(layer.weight.shape[0], device=layer.weight.device, dtype=layer.weight.dtype))
+
+@torch.no_grad()
+def _fold_bn_into_previous(layer, bn):
+    """layer -> bn  ==>  layer' (Conv2d or Linear)"""
+    scale, shift = _bn_scale_shift(bn)
+    _ensure_bias(layer)
+    view = [-1] + [1] * (layer.weight.dim() - 1)
+    layer.weight.mul_(scale.view(view))
+    layer.bias.mul_(scale).add_(shift)
+
+@torch.no_grad()
+def _fold_bn_into_next(bn, linear):
+    """bn -> (dropout) -> linear  ==>  linear'"""
+    scale, shift = _bn_scale_shift(bn)
+    _ensure_bias(linear)
+    linear.bias.add_(linear.weight @ shift)
+    linear.weight.mul_(scale.view(1, -1))
+
+def fold_batchnorms(module):
+    """
+    Folds every eval-mode BatchNorm into an adjacent Conv2d/Linear inside
+    nn.Sequential containers (and ResNet-style convN/bnN attribute pairs) and
+    replaces it (and any Dropout) with Identity.
+    Returns the number of BatchNorm layers removed.
+    """
+    folded = 0
+    for child in module.children():
+        folded += fold_batchnorms(child)
+    if not isinstance(module, nn.Sequential):
+        for name, child in list(module.named_children()):
+            conv = getattr(module, 'conv' + name[2:], None) if name.startswith('bn') else None
+            if isinstance(child, nn.BatchNorm2d) and isinstance(conv, nn.Conv2d):
+                _fold_bn_into_previous(conv, child)
+                setattr(module, name, nn.Identity())
+                folded += 1
+        return folded
+
+    for i in range(len(module)):
+        layer = module[i]
+        prev = module[i - 1] if i > 0 else None
+        if isinstance(layer, nn.BatchNorm2d) and isinstance(prev, nn.Conv2d):
+            _fold_bn_into_previous(prev, layer)
+            module[i] = nn.Identity()
+            folded += 1
+        elif isinstance(layer, nn.BatchNorm1d):
+            if isinstance(prev, nn.Linear):
+                _fold_bn_into_previous(prev, layer)
+                module[i] = nn.Identity()
+                folded += 1
+                continue
+            # Custom head is Linear -> ReLU -> BatchNorm1d -> Dropout -> Linear,
+            # so the BatchNorm goes forward into the next Linear instead
+            j = i + 1
+            while j < len(module) and isinstance(module[j], (nn.Dropout, nn.Identity)):
+                j += 1
+            if j < len(module) and isinstance(module[j], nn.Linear):
+                _fold_bn_into_next(layer, module[j])
+                module[i] = nn.Identity()
+                folded += 1
+
+    for i in range(len(module)):
+        if isinstance(module[i], nn.Dropout):
+            module[i] = nn.Identity()
+    return folded
+
+# ============================================================================
+# INPUT NORMALIZATION FOLDING
+# ============================================================================
+
+class FoldedStem(nn.Module):
+    """
+    Stem convolution that takes raw 0-255 pixels.
+
+    The 1/(255*std) scale lives in the conv weights. The -mean/std shift is
+    folded into a per-position bias map instead of a scalar bias, which keeps
+    the zero-padded borders exact (the padding of the normalized input is 0,
+    not -mean/std). The map is built for a fixed input size.
+    """
+
+    def __init__(self, conv, bias_map):
+        super().__init__()
+        self.conv = conv
+        self.register_buffer('bias_map', bias_map)
+
+    def forward(self, x):
+        return self.conv(x) + self.bias_map
+
+@torch.no_grad()
+def fold_input_normalization(stem_conv, img_size, mean=IMAGENET_MEAN, std=IMAGENET_STD):
+    """Returns a FoldedStem equivalent to stem_conv(Normalize(ToTensor(x)))"""
+    device, dtype = stem_conv.weight.device, stem_conv.weight.dtype
+    mean = torch.tensor(mean, device=device, dtype=dtype)
+    std = torch.tensor(std, device=device, dtype=dtype)
+
+    # Constant image holding the shift each pixel gets from normalization
+    shift_img = (-mean / std).view(1, -1, 1, 1).expand(1, -1, img_size, img_size)
+    bias_map = F.conv2d(shift_img, stem_conv.weight, stem_conv.bias, stem_conv.stride,
+                        stem_conv.padding, stem_conv.dilation, stem_conv.groups)
+
+    conv = copy.deepcopy(stem_conv)
+    conv.bias = None
+    conv.weight.mul_((1.0 / (255.0 * std)).view(1, -1, 1, 1))
+    return FoldedStem(conv, bias_map)
+
+# ============================================================================
+# OPTIMIZATION PASS
+# ============================================================================
+
+def raw_to_normalized(x):
+    """Reference preprocessing: raw 0-255 float tensor -> ImageNet-normalized"""
+    mean = torch.tensor(IMAGENET_MEAN, device=x.device, dtype=x.dtype).view(1, -1, 1, 1)
+    std = torch.tensor(IMAGENET_STD, device=x.device, dtype=x.dtype).view(1, -1, 1, 1)
+    return (x / 255.0 - mean) / std
+
+@torch.no_grad()
+def verify_parity(eager_model, optimized_model, img_size, device, atol=PARITY_ATOL, samples=PARITY_SAMPLES):
+    """
+    Runs random uint8 images through both models. The eager model gets the
+    normalized input, the optimized one the raw cast. Returns the max abs diff
+    and raises RuntimeError if it is above `atol`.
+    """
+    gen = torch.Generator().manual_seed(0)
+    raw = torch.randint(0, 256, (samples, 3, img_size, img_size), generator=gen, dtype=torch.uint8)
+    raw = raw.to(device).float()
+
+    expected = eager_model(raw_to_normalized(raw))
+    actual = optimized_model(raw.contiguous(memory_format=torch.channels_last))
+    max_diff = (expected - actual).abs().max().item()
+    if max_diff > atol:
+        raise RuntimeError(f"Optimized model output differs from eager model by {max_diff:.2e} (atol {atol:.0e})")
+    return max_diff
+
+def optimize_classifier(model, img_size, device, channels_last=True, compile_model=False):
+    """
+    Graph-level optimization of the malaria classifier (EfficientNet-B0 or a
+    distilled student from classifier_arch.py):
+      1. fold every BatchNorm (backbone and head) into adjacent Conv/Linear
+      2. fold the ImageNet Normalize into the stem conv (input = raw 0-255 floats)
+      3. switch to channels_last
+      4. optionally torch.compile
+    Output parity with the eager model is checked before returning.
+    """
+    eager = model.eval()
+    optimized = copy.deepcopy(eager).eval()
+
+    n_folded = fold_batchnorms(optimized)
+    if hasattr(optimized, 'features'):
+        # EfficientNet / MobileNetV3: features[0] is Conv2dNormActivation
+        stem = optimized.features[0]
+        stem[0] = fold_input_normalization(stem[0], img_size)
+    else:
+        # ResNet
+        optimized.conv1 = fold_input_normalization(optimized.conv1, img_size)
+
+    if channels_last:
+        optimized = optimized.to(memory_format=torch.channels_last)
+
+    max_diff = verify_parity(eager, optimized, img_size, device)
+
+    if compile_model:
+        optimized = torch.compile(optimized)
+        max_diff = max(max_diff, verify_parity(eager, optimized, img_size, device))
+
+    print(f"✓ Optimization pass: folded {n_folded} BatchNorm layers + input normalization"
+          f"{', channels_last' if channels_last else ''}{', torch.compile' if compile_model else ''}"
+          f" (max |diff| vs eager: {max_diff:.2e})")
+    return optimized
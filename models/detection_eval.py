@@ -0,0 +1,282 @@
+"""
+Box-level evaluation of cached detector predictions against YOLO labels.
+
+Count metrics alone can look good while boxes land in the wrong places, so
+every prediction is matched to the ground truth:
+
+  - IoUs are computed only for same-class box pairs whose x-ranges overlap
+    (sorted sweep, vectorized in NumPy), once for all 10 IoU thresholds
+    0.50:0.95
+  - matching is greedy by IoU, one-to-one, exactly like Ultralytics' val
+    (so AP50 / AP50-95 are comparable with `yolo val` on the same split)
+  - per class: precision / recall at the operating confidence, AP50,
+    AP50-95 (101-point interpolation, as Ultralytics) and the count MAE / bias
+  - per image: the same at IoU 0.5, for finding the images that hurt
+
+    python detection_eval.py --weights runs/detect/train4/weights/best.pt --images bccd_model/dataset/test/images --out per_image.csv
+"""
+import argparse
+import csv
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from pred_cache import CACHE_DIR_NAME, NMS_IOU, PredictionCache
+
+IMG_EXTS = {".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp"}
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+RECALL_POINTS = np.linspace(0, 1, 101)
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Precision / recall / mAP and count error of a detector on a labelled folder")
+    ap.add_argument("--weights", type=str, required=True)
+    ap.add_argument("--images", type=str, required=True, help="Folder of images (recursive) with YOLO labels")
+    ap.add_argument("--labels", type=str, default=None,
+                    help="Folder of <image stem>.txt labels (default: Ultralytics rule, last /images/ -> /labels/)")
+    ap.add_argument("--conf", type=float, default=0.25, help="Operating threshold for precision, recall and counts")
+    ap.add_argument("--iou", type=float, default=NMS_IOU, help="NMS IoU")
+    ap.add_argument("--batch", type=int, default=16, help="Images per detector call")
+    ap.add_argument("--pred_cache", type=str, default=CACHE_DIR_NAME,
+                    help="Prediction cache dir (relative paths: next to the weights)")
+    ap.add_argument("--out", type=str, default=None, help="Per-image CSV")
+    return ap.parse_args()
+
+# --- Ground truth --------------------------------------------------------------
+
+def label_path(image_path, label_dir=None):
+    """<label_dir>/<stem>.txt, or the Ultralytics rule: last /images/ -> /labels/"""
+    if label_dir:
+        return os.path.join(label_dir, Path(image_path).stem + ".txt")
+    sa, sb = f"{os.sep}images{os.sep}", f"{os.sep}labels{os.sep}"
+    return sb.join(os.path.normpath(image_path).rsplit(sa, 1)).rsplit(".", 1)[0] + ".txt"
+
+def read_yolo_boxes(path, shape):
+    """
+    (classes (G,), xyxy pixel boxes (G, 4)) of a YOLO label file for an
+    image of shape (h, w). No file = no objects; None if the file is corrupt.
+    """
+    if not os.path.exists(path):
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 4), dtype=np.float32)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            rows = np.array([line.split()[:5] for line in f if line.strip()], dtype=np.float64).reshape(-1, 5)
+    except (OSError, ValueError) as e:
+        print(f"[Warning] Corrupt label file {path}: {e}")
+        return None
+    h, w = shape
+    xy, wh = rows[:, 1:3] * (w, h), rows[:, 3:5] * (w, h)
+    return rows[:, 0].astype(np.int64), np.concatenate([xy - wh / 2, xy + wh / 2], axis=1).astype(np.float32)
+
+# --- Matching ------------------------------------------------------------------
+
+def box_iou(a, b):
+    """IoU of xyxy boxes a[i] and b[i] (elementwise)"""
+    iw = np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0])
+    ih = np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1])
+    inter = np.maximum(iw, 0) * np.maximum(ih, 0)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a + area_b - inter + 1e-9)
+
+def overlapping_pairs(a, a_cls, b, b_cls, min_iou):
+    """
+    All same-class pairs (i, j, iou) with IoU(a[i], b[j]) >= min_iou, without
+    building the dense len(a) x len(b) matrix: classes are shifted apart on
+    the x axis, a is sorted by x1, and every b box only looks at the a boxes
+    whose x-range can reach it (a sweep over sorted intervals). With
+    thousands of small cells per image that is a few percent of all pairs.
+    """
+    if len(a) == 0 or len(b) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(0, dtype=np.float32)
+    span = float(max(a[:, 2].max(), b[:, 2].max())) + 1.0
+    a = a + (a_cls * span).astype(a.dtype)[:, None] * (1, 0, 1, 0)
+    b = b + (b_cls * span).astype(b.dtype)[:, None] * (1, 0, 1, 0)
+    order = np.argsort(a[:, 0], kind="stable")
+    x1 = a[order, 0]
+    max_w = float((a[:, 2] - a[:, 0]).max())
+    # candidates of b[j]: a.x1 in (b.x1 - max_w, b.x2)
+    lo = np.searchsorted(x1, b[:, 0] - max_w, side="right")
+    hi = np.searchsorted(x1, b[:, 2], side="left")
+    n = np.maximum(hi - lo, 0)
+    j = np.repeat(np.arange(len(b)), n)
+    i = order[np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n) + np.repeat(lo, n)]
+    iou = box_iou(a[i], b[j])
+    ok = iou >= min_iou
+    return i[ok], j[ok], iou[ok]
+
+def match_predictions(pred_boxes, pred_cls, gt_boxes, gt_cls, iou_thresholds=IOU_THRESHOLDS):
+    """
+    True-positive matrix (P, T): prediction p is a TP at threshold t when it
+    is matched to a same-class ground truth box with IoU >= t. Pairs are
+    taken in descending IoU order, each box matched at most once.
+    """
+    tp = np.zeros((len(pred_cls), len(iou_thresholds)), dtype=bool)
+    g, p, vals = overlapping_pairs(gt_boxes, gt_cls, pred_boxes, pred_cls.astype(np.int64), iou_thresholds[0])
+    if len(g) == 0:
+        return tp
+    order = np.argsort(-vals, kind="stable")
+    g, p, vals = g[order], p[order], vals[order]
+    for t, thr in enumerate(iou_thresholds):
+        n = np.searchsorted(-vals, -thr, side="right")  # pairs with iou >= thr (vals is descending)
+        # Ultralytics' rule: every prediction keeps its highest-IoU pair, then
+        # every ground truth box keeps the first such prediction in prediction
+        # order (= highest confidence, the detections are score-sorted)
+        _, first = np.unique(p[:n], return_index=True)
+        _, keep = np.unique(g[:n][first], return_index=True)
+        tp[p[:n][first[keep]], t] = True
+    return tp
+
+# --- Metrics -------------------------------------------------------------------
+
+def average_precision(tp, conf, pred_cls, gt_cls, num_classes):
+    """
+    AP per class and IoU threshold (C, T) from the TP matrix of all
+    predictions of a dataset (or one image): area under the precision
+    envelope, sampled at 101 recall points as Ultralytics does. Classes
+    without ground truth get NaN.
+    """
+    ap = np.full((num_classes, tp.shape[1]), np.nan)
+    order = np.argsort(-conf, kind="stable")
+    tp, pred_cls = tp[order], pred_cls[order]
+    n_gt = np.bincount(gt_cls, minlength=num_classes)
+    for c in range(num_classes):
+        if n_gt[c] == 0:
+            continue
+        hits = tp[pred_cls == c]
+        if len(hits) == 0:
+            ap[c] = 0.0
+            continue
+        cum = np.cumsum(hits, axis=0)
+        recall = cum / n_gt[c]
+        precision = cum / np.arange(1, len(hits) + 1)[:, None]
+        T = tp.shape[1]
+        mrec = np.concatenate([np.zeros((1, T)), recall, recall[-1:], np.ones((1, T))])
+        mpre = np.concatenate([np.ones((1, T)), precision, np.zeros((2, T))])
+        envelope = np.flip(np.maximum.accumulate(np.flip(mpre, 0), axis=0), 0)
+        for t in range(T):
+            y = np.interp(RECALL_POINTS, mrec[:, t], envelope[:, t])
+            ap[c, t] = ((y[1:] + y[:-1]) / 2 * np.diff(RECALL_POINTS)).sum()
+    return ap
+
+class DetectionEvaluator:
+    """
+    Accumulates matches image by image; summary() reduces them.
+
+        ev = DetectionEvaluator(num_classes, conf=0.25)
+        for det, (gt_cls, gt_boxes) in ...:
+            ev.add(name, det, gt_cls, gt_boxes)
+        per_class = ev.summary()
+    """
+
+    def __init__(self, num_classes, conf=0.25, iou_thresholds=IOU_THRESHOLDS):
+        self.num_classes, self.conf, self.iou_thresholds = num_classes, conf, iou_thresholds
+        self._tp, self._conf, self._pred_cls, self._gt_cls = [], [], [], []
+        self._pred_counts, self._gt_counts = [], []
+        self.images = []  # per-image rows
+
+    def add(self, name, det, gt_cls, gt_boxes):
+        tp = match_predictions(det.boxes, det.classes, gt_boxes, gt_cls, self.iou_thresholds)
+        self._tp.append(tp); self._conf.append(det.scores); self._pred_cls.append(det.classes); self._gt_cls.append(gt_cls)
+        on = det.scores > self.conf
+        pred_counts = np.bincount(det.classes[on].astype(np.int64), minlength=self.num_classes)[:self.num_classes]
+        gt_counts = np.bincount(gt_cls, minlength=self.num_classes)[:self.num_classes]
+        self._pred_counts.append(pred_counts); self._gt_counts.append(gt_counts)
+
+        n_tp = int(tp[on, 0].sum())
+        ap50 = average_precision(tp[:, :1], det.scores, det.classes.astype(np.int64), gt_cls, self.num_classes)[:, 0]
+        self.images.append({
+            "image": name, "gt": len(gt_cls), "pred": int(on.sum()), "tp50": n_tp,
+            "precision": n_tp / int(on.sum()) if on.any() else float("nan"),
+            "recall": n_tp / len(gt_cls) if len(gt_cls) else float("nan"),
+            "ap50": float(np.nanmean(ap50)) if np.isfinite(ap50).any() else float("nan"),
+            "count_abs_err": int(np.abs(pred_counts - gt_counts).sum()),
+        })
+
+    def summary(self):
+        """Per-class dict of arrays: precision, recall, ap50, ap50_95, count_mae, count_bias, n_gt, n_pred"""
+        C = self.num_classes
+        tp = np.concatenate(self._tp) if self._tp else np.zeros((0, len(self.iou_thresholds)), dtype=bool)
+        conf = np.concatenate(self._conf) if self._conf else np.zeros(0, np.float32)
+        pred_cls = np.concatenate(self._pred_cls).astype(np.int64) if self._pred_cls else np.zeros(0, np.int64)
+        gt_cls = np.concatenate(self._gt_cls) if self._gt_cls else np.zeros(0, np.int64)
+        ap = average_precision(tp, conf, pred_cls, gt_cls, C)
+
+        on = conf > self.conf
+        n_pred = np.bincount(pred_cls[on], minlength=C)[:C]
+        n_tp = np.bincount(pred_cls[on], weights=tp[on, 0], minlength=C)[:C]
+        n_gt = np.bincount(gt_cls, minlength=C)[:C]
+        err = np.stack(self._pred_counts) - np.stack(self._gt_counts) if self._pred_counts else np.zeros((0, C))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return {
+                "n_gt": n_gt, "n_pred": n_pred,
+                "precision": n_tp / n_pred, "recall": n_tp / n_gt,
+                "ap50": ap[:, 0], "ap50_95": ap.mean(axis=1),
+                "count_mae": np.abs(err).mean(axis=0), "count_bias": err.mean(axis=0),
+            }
+
+def print_detection_metrics(summary, class_names, conf):
+    print("\n" + "="*76)
+    print(f"--- DETECTION METRICS (P / R / counts at conf > {conf:g}) ---")
+    print("="*76)
+    print(f"  {'class':<12}{'GT':>8}{'pred':>8}{'P':>8}{'R':>8}{'AP50':>8}{'AP50-95':>9}{'MAE':>8}{'bias':>8}")
+    for c in range(len(summary["n_gt"])):
+        print(f"  {class_names.get(c, f'ID {c}'):<12}{summary['n_gt'][c]:>8}{summary['n_pred'][c]:>8}"
+              f"{summary['precision'][c]:>8.3f}{summary['recall'][c]:>8.3f}{summary['ap50'][c]:>8.3f}"
+              f"{summary['ap50_95'][c]:>9.3f}{summary['count_mae'][c]:>8.2f}{summary['count_bias'][c]:>+8.2f}")
+    print(f"  {'all':<12}{summary['n_gt'].sum():>8}{summary['n_pred'].sum():>8}{'':>16}"
+          f"{np.nanmean(summary['ap50']):>8.3f}{np.nanmean(summary['ap50_95']):>9.3f}")
+
+def evaluate_folder(cache, image_paths, label_dir, num_classes, conf):
+    """Runs a DetectionEvaluator over cached predictions; skips unreadable images and corrupt labels"""
+    ev = DetectionEvaluator(num_classes, conf)
+    for img in image_paths:
+        det = cache.get(img)
+        if det is None:
+            continue
+        gt = read_yolo_boxes(label_path(str(img), label_dir), det.shape)
+        if gt is None:
+            continue
+        ev.add(str(img), det, *gt)
+    return ev
+
+def main():
+    args = parse_args()
+    import time
+
+    images = sorted(p for p in Path(args.images).rglob("*") if p.suffix.lower() in IMG_EXTS)
+    if not images:
+        print(f"[Error] No images found in {args.images}", file=sys.stderr)
+        return 1
+
+    # Default predict settings except the 0.001 floor -> same cache file as verify_counts.py
+    cache = PredictionCache(args.weights, args.pred_cache, iou=args.iou)
+    missing = cache.missing(images)
+    print(f"[INFO] {len(images) - len(missing)}/{len(images)} images in prediction cache {cache.path}")
+    if missing:
+        from ultralytics import YOLO
+        cache.update(YOLO(args.weights), missing, batch_size=args.batch)
+    names = cache.names or {}
+    num_classes = max(names) + 1 if names else 1
+
+    t0 = time.perf_counter()
+    ev = evaluate_folder(cache, images, args.labels, num_classes, args.conf)
+    summary = ev.summary()
+    elapsed = time.perf_counter() - t0
+    print_detection_metrics(summary, names, args.conf)
+    print(f"\n{len(ev.images)} images matched in {elapsed * 1000:.0f} ms ({elapsed * 1000 / max(len(ev.images), 1):.1f} ms/image)")
+
+    if args.out:
+        out = Path(args.out)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        with open(out, "w", newline="", encoding="utf-8") as f:
+            w = csv.DictWriter(f, fieldnames=list(ev.images[0]) if ev.images else ["image"])
+            w.writeheader()
+            w.writerows(ev.images)
+        print(f"[OK] Wrote per-image metrics: {out}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
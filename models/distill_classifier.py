@@ -0,0 +1,175 @@
+import argparse
+import json
+import time
+from pathlib import Path
+
+IMG_SIZE = 224  # must match app.py
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Distil the EfficientNet-B0 malaria classifier into a CPU-efficient student")
+    ap.add_argument("--data", type=str, required=True,
+                    help="Folder with train/ and val/ subfolders, each holding Parasitized/ and Uninfected/")
+    ap.add_argument("--teacher", type=str, default="malaria_model/best_malaria_model_finetuned.pt")
+    ap.add_argument("--student", type=str, default="mobilenet_v3_small", choices=["mobilenet_v3_small", "resnet18"])
+    ap.add_argument("--out", type=str, default=None, help="Student checkpoint (default: malaria_model/malaria_<student>_distilled.pt)")
+    ap.add_argument("--epochs", type=int, default=20)
+    ap.add_argument("--batch", type=int, default=64)
+    ap.add_argument("--lr", type=float, default=1e-3)
+    ap.add_argument("--temperature", type=float, default=4.0, help="Softening temperature for teacher logits")
+    ap.add_argument("--alpha", type=float, default=0.7, help="Weight of the distillation loss vs. the hard-label loss")
+    ap.add_argument("--pretrained", action="store_true", help="Start the student from ImageNet weights")
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--bench-threads", type=int, default=1, help="torch threads for the CPU latency benchmark")
+    ap.add_argument("--bench-iters", type=int, default=50)
+    return ap.parse_args()
+
+def build_transforms():
+    """Same preprocessing as preprocess_image() in app.py (+ flips for training)"""
+    from torchvision import transforms
+    normalize = transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+    train_tf = transforms.Compose([
+        transforms.Resize((IMG_SIZE, IMG_SIZE)),
+        transforms.RandomHorizontalFlip(),
+        transforms.RandomVerticalFlip(),
+        transforms.ToTensor(),
+        normalize
+    ])
+    eval_tf = transforms.Compose([
+        transforms.Resize((IMG_SIZE, IMG_SIZE)),
+        transforms.ToTensor(),
+        normalize
+    ])
+    return train_tf, eval_tf
+
+def load_teacher(path, device):
+    import torch
+    from classifier_arch import build_malaria_classifier
+    model = build_malaria_classifier('efficientnet_b0')
+    checkpoint = torch.load(path, map_location=device)
+    model.load_state_dict(checkpoint['model_state_dict'])
+    return model.to(device).eval()
+
+def evaluate(model, loader, device, teacher=None):
+    """Returns (accuracy, agreement with teacher or None)"""
+    import torch
+    model.eval()
+    correct = agree = total = 0
+    with torch.no_grad():
+        for x, y in loader:
+            x = x.to(device)
+            pred = (model(x).squeeze(1) > 0.5).long().cpu()
+            correct += (pred == y).sum().item()
+            if teacher is not None:
+                agree += (pred == (teacher(x).squeeze(1) > 0.5).long().cpu()).sum().item()
+            total += y.numel()
+    total = max(1, total)
+    return correct / total, (agree / total if teacher is not None else None)
+
+def cpu_latency_ms(model, img_size, threads, iters):
+    """Median single-image CPU latency in milliseconds"""
+    import torch
+    torch.set_num_threads(threads)
+    model = model.to('cpu').eval()
+    x = torch.randn(1, 3, img_size, img_size)
+    times = []
+    with torch.no_grad():
+        for _ in range(5):
+            model(x)
+        for _ in range(iters):
+            t0 = time.perf_counter()
+            model(x)
+            times.append((time.perf_counter() - t0) * 1000.0)
+    times.sort()
+    return times[len(times) // 2]
+
+def main():
+    args = parse_args()
+    import torch
+    import torch.nn.functional as F
+    from torch.utils.data import DataLoader
+    from torchvision import datasets
+    from classifier_arch import build_malaria_classifier, without_sigmoid
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    torch.manual_seed(42)
+    out = Path(args.out or f"malaria_model/malaria_{args.student}_distilled.pt")
+
+    train_tf, eval_tf = build_transforms()
+    train_ds = datasets.ImageFolder(f"{args.data}/train", transform=train_tf)
+    val_ds = datasets.ImageFolder(f"{args.data}/val", transform=eval_tf)
+    # ImageFolder sorts classes: Parasitized=0, Uninfected=1 -> sigmoid is P(Uninfected)
+    print(f"Classes: {train_ds.class_to_idx}")
+    train_loader = DataLoader(train_ds, batch_size=args.batch, shuffle=True, num_workers=args.workers)
+    val_loader = DataLoader(val_ds, batch_size=args.batch, shuffle=False, num_workers=args.workers)
+
+    teacher = load_teacher(args.teacher, device)
+    student = build_malaria_classifier(args.student, pretrained=args.pretrained).to(device)
+    # Losses work on the pre-Sigmoid logits of both networks
+    teacher_logits, student_logits = without_sigmoid(teacher), without_sigmoid(student)
+
+    optimizer = torch.optim.AdamW(student.parameters(), lr=args.lr, weight_decay=1e-4)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=args.epochs)
+    T = args.temperature
+
+    best_acc = -1.0
+    for epoch in range(args.epochs):
+        student.train()
+        t0 = time.perf_counter()
+        running = 0.0
+        for x, y in train_loader:
+            x, y = x.to(device), y.float().to(device)
+            with torch.no_grad():
+                t_logit = teacher_logits(x).squeeze(1)
+            s_logit = student_logits(x).squeeze(1)
+
+            # Binary KD: match the temperature-softened teacher probability,
+            # scaled by T^2 so its gradients stay comparable to the hard loss
+            soft = F.binary_cross_entropy_with_logits(s_logit / T, torch.sigmoid(t_logit / T)) * T * T
+            hard = F.binary_cross_entropy_with_logits(s_logit, y)
+            loss = args.alpha * soft + (1 - args.alpha) * hard
+
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            running += loss.item() * y.numel()
+        scheduler.step()
+
+        val_acc, agreement = evaluate(student, val_loader, device, teacher)
+        print(f"Epoch {epoch+1}/{args.epochs}  loss {running/len(train_ds):.4f}  val_acc {val_acc:.4f}  "
+              f"teacher agreement {agreement:.4f}  ({time.perf_counter()-t0:.1f}s)")
+        if val_acc > best_acc:
+            best_acc = val_acc
+            out.parent.mkdir(parents=True, exist_ok=True)
+            torch.save({'model_state_dict': student.state_dict(), 'val_acc': val_acc, 'arch': args.student}, out)
+
+    # --- Latency / accuracy trade-off report (best student vs. teacher) ---
+    student.load_state_dict(torch.load(out, map_location=device)['model_state_dict'])
+    teacher_acc, _ = evaluate(teacher, val_loader, device)
+    student_acc, agreement = evaluate(student, val_loader, device, teacher)
+
+    report = {'teacher': {'arch': 'efficientnet_b0', 'checkpoint': args.teacher}, 'student': {'arch': args.student, 'checkpoint': str(out)},
+              'cpu_threads': args.bench_threads, 'agreement': agreement}
+    for key, model, acc in (('teacher', teacher, teacher_acc), ('student', student, student_acc)):
+        report[key]['val_acc'] = acc
+        report[key]['params'] = sum(p.numel() for p in model.parameters())
+        report[key]['cpu_latency_ms'] = cpu_latency_ms(model, IMG_SIZE, args.bench_threads, args.bench_iters)
+    report['speedup'] = report['teacher']['cpu_latency_ms'] / report['student']['cpu_latency_ms']
+
+    report_path = out.with_suffix('.report.json')
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    print("\n" + "="*60)
+    print("--- DISTILLATION REPORT (CPU) ---")
+    print("="*60)
+    print(f"  {'model':<22}{'params':>12}{'latency ms':>12}{'val acc':>10}")
+    for key in ('teacher', 'student'):
+        r = report[key]
+        print(f"  {r['arch']:<22}{r['params']:>12,}{r['cpu_latency_ms']:>12.2f}{r['val_acc']:>10.4f}")
+    print(f"  Speedup: {report['speedup']:.2f}x   Agreement with teacher: {agreement*100:.2f}%")
+    print(f"\n✅ Student saved to {out}")
+    print(f"   Serve it with: MALARIA_MODEL_ARCH={args.student} MALARIA_MODEL_PATH={out} python app.py")
+    print(f"   Report: {report_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import torch
+import torch.nn as nn
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+# The screening model works on much smaller crops than the 224px EfficientNet
+SCREEN_IMG_SIZE = 64
+
+# Default uncertainty band around the 0.5 threshold used by predict_malaria():
+# screen probabilities inside [low, high] are escalated to the full model
+DEFAULT_BAND = (0.1, 0.9)
+
+STAGE_SCREEN = 'screen'
+STAGE_FULL = 'full'
+
+# ============================================================================
+# SCREENING MODEL
+# ============================================================================
+
+def _conv_block(c_in, c_out):
+    return nn.Sequential(
+        nn.Conv2d(c_in, c_out, 3, stride=2, padding=1, bias=False),
+        nn.BatchNorm2d(c_out),
+        nn.ReLU(inplace=True),
+    )
+
+class TinyCellNet(nn.Module):
+    """
+    ~60k-parameter CNN used as the first stage of the cascade.
+    Same output convention as the EfficientNet classifier: sigmoid P(Uninfected).
+    """
+
+    def __init__(self, width=16):
+        super().__init__()
+        self.features = nn.Sequential(
+            _conv_block(3, width),
+            _conv_block(width, width * 2),
+            _conv_block(width * 2, width * 4),
+            _conv_block(width * 4, width * 4),
+        )
+        self.pool = nn.AdaptiveAvgPool2d(1)
+        self.classifier = nn.Sequential(
+            nn.Flatten(),
+            nn.Dropout(0.2),
+            nn.Linear(width * 4, 1),
+            nn.Sigmoid()
+        )
+
+    def forward(self, x):
+        return self.classifier(self.pool(self.features(x)))
+
+def screen_transform():
+    """Preprocessing for the screening model (same normalization as the full model)"""
+    from torchvision import transforms
+    return transforms.Compose([
+        transforms.Resize((SCREEN_IMG_SIZE, SCREEN_IMG_SIZE)),
+        transforms.ToTensor(),
+        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+    ])
+
+def load_screen_model(path, device):
+    """Load a TinyCellNet checkpoint saved as {'model_state_dict', 'val_acc'}"""
+    checkpoint = torch.load(path, map_location=device)
+    model = TinyCellNet(width=checkpoint.get('width', 16))
+    model.load_state_dict(checkpoint['model_state_dict'])
+    model = model.to(device)
+    model.eval()
+
+    print(f"✓ Screening model loaded successfully!")
+    print(f"✓ Screening model validation accuracy: {checkpoint['val_acc']:.4f}")
+    return model
+
+# ============================================================================
+# CASCADE
+# ============================================================================
+
+def needs_escalation(probability, band=DEFAULT_BAND):
+    """True if the screen probability is too close to 0.5 to decide on"""
+    low, high = band
+    return low <= probability <= high
+
+class MalariaCascade:
+    """
+    Two-stage classifier: every image is scored by the cheap screening model
+    and only uncertain ones (probability inside `band`) go to the full model.
+    """
+
+    def __init__(self, screen_model, full_model, full_preprocess, device, band=DEFAULT_BAND):
+        low, high = band
+        if not 0.0 <= low <= 0.5 <= high <= 1.0:
+            raise ValueError(f"Cascade band must satisfy 0 <= low <= 0.5 <= high <= 1, got {band}")
+        self.screen_model = screen_model
+        self.full_model = full_model
+        self.full_preprocess = full_preprocess
+        self.device = device
+        self.band = band
+        self._screen_transform = screen_transform()
+
+    @torch.no_grad()
+    def screen_probability(self, image):
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        x = self._screen_transform(image).unsqueeze(0).to(self.device)
+        return self.screen_model(x).item()
+
+    @torch.no_grad()
+    def full_probability(self, image):
+        return self.full_model(self.full_preprocess(image)).item()
+
+    def predict_probability(self, image):
+        """Returns (P(Uninfected), stage that decided)"""
+        probability = self.screen_probability(image)
+        if not needs_escalation(probability, self.band):
+            return probability, STAGE_SCREEN
+        return self.full_probability(image), STAGE_FULL
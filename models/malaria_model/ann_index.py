@@ -0,0 +1,255 @@
+"""
+Persistent columnar index of an annotation folder (All_annotations,
+GT_updated, Annotations, ...).
+
+Every annotation row is stored once with its file, class, shape and
+geometry, next to a per-file table (patient id, image id, header
+count/H/W and the (size, mtime_ns) the row data was parsed from).
+load_index() re-parses only files that were added or changed since the
+last run and drops removed ones, so repeated runs of prepare_yolo.py,
+unify_data.py and analyze_sizes.py only stat the folder.
+
+    python ann_index.py <annotation_root> [...]     # build/update + summary
+"""
+import argparse
+import os
+import sys
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from ann_parser import (Annotations, AnnotationFile, LABEL_NAMES, SHAPE_CIRCLE, empty_annotations,
+                        parse_header, parse_lines)
+
+INDEX_NAME = "ann_index.npz"
+INDEX_VERSION = 1
+
+FILE_COLUMNS = ("rel", "patient", "image_id", "size", "mtime_ns", "count", "H", "W", "n_lines", "ok", "start", "n_rows")
+ROW_COLUMNS = ("file", "label", "shape", "coords", "raw_label", "exact")
+
+# ---------------------------------------------------------------------------
+# Index
+# ---------------------------------------------------------------------------
+
+class AnnotationIndex:
+    """
+    Columnar annotations of one folder.
+
+    files: per annotation file (rel path, patient = parent folder, image_id =
+           stem, header count/H/W (-1 if missing), n_lines, ok = parsed
+           without error, start/n_rows into the row columns)
+    rows:  per annotation (file, label, shape, coords (N, 4), raw_label =
+           index into raw_labels, exact = row passes the strict rules)
+    Only rows with a recognised class (see ann_parser.classify_label) are kept.
+    """
+
+    def __init__(self, root, files: dict, rows: dict, raw_labels):
+        self.root = Path(root)
+        self.files = files
+        self.rows = rows
+        self.raw_labels = np.asarray(raw_labels, dtype=str)
+        self._pos = {rel: i for i, rel in enumerate(self.files["rel"].tolist())}
+
+    def __len__(self):
+        return len(self.files["rel"])
+
+    @property
+    def n_rows(self):
+        return len(self.rows["label"])
+
+    def paths(self):
+        """Absolute paths of every indexed annotation file"""
+        return [self.root / rel for rel in self.files["rel"].tolist()]
+
+    def position(self, path) -> Optional[int]:
+        try:
+            rel = Path(path).relative_to(self.root).as_posix()
+        except ValueError:
+            rel = Path(path).as_posix()
+        return self._pos.get(rel)
+
+    def header(self, i):
+        f = self.files
+        if f["H"][i] < 0:
+            return None
+        return int(f["count"][i]), int(f["H"][i]), int(f["W"][i])
+
+    def _labels(self, label_map, strict, rows=slice(None)):
+        """(row mask, label column) of rows[rows] for a query; label_map maps raw label text -> id"""
+        labels = self.rows["label"][rows]
+        mask = np.ones(len(labels), dtype=bool)
+        if strict:
+            mask &= self.rows["exact"][rows]
+        if label_map is not None:
+            keys = self.raw_labels if strict else np.char.strip(self.raw_labels)
+            lut = np.array([label_map.get(k, -1) for k in keys.tolist()] + [-1], dtype=np.int16)
+            labels = lut[self.rows["raw_label"][rows]]
+            mask &= labels >= 0
+        return mask, labels
+
+    def select(self, label_map: Optional[dict] = None, strict: bool = False):
+        """All matching rows at once: (file_idx, Annotations). Same rules as ann_parser.parse_lines."""
+        mask, labels = self._labels(label_map, strict)
+        anns = Annotations(labels[mask].astype(np.int16), self.rows["shape"][mask], self.rows["coords"][mask])
+        return self.rows["file"][mask], anns
+
+    def file(self, path_or_pos, label_map: Optional[dict] = None, strict: bool = False) -> Optional[AnnotationFile]:
+        """
+        Annotations of one file as an AnnotationFile, or None if the file is
+        not indexed or could not be parsed.
+        """
+        i = path_or_pos if isinstance(path_or_pos, (int, np.integer)) else self.position(path_or_pos)
+        if i is None or not self.files["ok"][i]:
+            return None
+        a, n = int(self.files["start"][i]), int(self.files["n_rows"][i])
+        rows = slice(a, a + n)
+        mask, labels = self._labels(label_map, strict, rows)
+        anns = Annotations(labels[mask].astype(np.int16), self.rows["shape"][rows][mask], self.rows["coords"][rows][mask])
+        return AnnotationFile(self.header(i), anns, int(self.files["n_lines"][i]))
+
+# ---------------------------------------------------------------------------
+# Build / incremental update
+# ---------------------------------------------------------------------------
+
+def scan_annotation_files(ann_root: Path) -> dict:
+    """rel path -> (size, mtime_ns) of every .txt under ann_root (stat only)"""
+    found = {}
+    for dirpath, _, names in os.walk(ann_root):
+        for name in names:
+            if name.lower().endswith(".txt"):
+                full = os.path.join(dirpath, name)
+                st = os.stat(full)
+                found[Path(full).relative_to(ann_root).as_posix()] = (st.st_size, st.st_mtime_ns)
+    return dict(sorted(found.items()))
+
+def parse_for_index(path):
+    """(header, Annotations, n_lines, row_info, ok) of one file, lenient rules + strict flags"""
+    try:
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            all_lines = f.read().splitlines()
+        lines = [ln for ln in all_lines if ln.strip()]
+        row_info = []
+        if not lines:
+            return None, empty_annotations(), len(all_lines), row_info, True
+        anns = parse_lines(lines[1:], row_info=row_info)
+        return parse_header(lines[0]), anns, len(all_lines), row_info, True
+    except (OSError, ValueError):
+        return None, empty_annotations(), 0, [], False
+
+def _read_index(path: Path):
+    try:
+        with np.load(path, allow_pickle=False) as z:
+            if int(z["version"]) != INDEX_VERSION:
+                return None
+            files = {k: z["f_" + k] for k in FILE_COLUMNS}
+            rows = {k: z["r_" + k] for k in ROW_COLUMNS}
+            return files, rows, z["raw_labels"]
+    except (OSError, KeyError, ValueError):
+        return None
+
+def _write_index(path: Path, index: AnnotationIndex):
+    tmp = path.with_name(path.name + ".tmp")
+    try:
+        with open(tmp, "wb") as f:
+            np.savez(f, version=np.int32(INDEX_VERSION), raw_labels=index.raw_labels,
+                     **{"f_" + k: v for k, v in index.files.items()},
+                     **{"r_" + k: v for k, v in index.rows.items()})
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+def load_index(ann_root, index_path=None, rebuild: bool = False, verbose: bool = True) -> AnnotationIndex:
+    """
+    Loads the index of ann_root (default file: <ann_root>/ann_index.npz),
+    re-parsing only new/changed annotation files, and saves it if anything
+    changed. If the index cannot be written (read-only dataset mount) the
+    in-memory index is returned with a warning.
+    """
+    ann_root = Path(ann_root)
+    index_path = Path(index_path) if index_path else ann_root / INDEX_NAME
+    current = scan_annotation_files(ann_root)
+    old = None if rebuild else _read_index(index_path)
+
+    old_files, old_rows, old_vocab = old if old else ({k: np.empty(0) for k in FILE_COLUMNS}, None, np.empty(0, str))
+    old_pos = {rel: i for i, rel in enumerate(old_files["rel"].tolist())}
+    vocab = {t: i for i, t in enumerate(old_vocab.tolist())}
+
+    files = {k: [] for k in FILE_COLUMNS}
+    parts = []  # per file: dict of row columns
+    reused = parsed = changed = 0
+    for rel, (size, mtime_ns) in current.items():
+        i = old_pos.get(rel)
+        if i is not None and old_files["size"][i] == size and old_files["mtime_ns"][i] == mtime_ns:
+            a, n = int(old_files["start"][i]), int(old_files["n_rows"][i])
+            part = {k: old_rows[k][a:a + n] for k in ROW_COLUMNS}
+            head = (old_files["count"][i], old_files["H"][i], old_files["W"][i])
+            n_lines, ok = old_files["n_lines"][i], old_files["ok"][i]
+            reused += 1
+        else:
+            header, anns, n_lines, info, ok = parse_for_index(ann_root / rel)
+            head = header if header else (-1, -1, -1)
+            raw_ids = [vocab.setdefault(text, len(vocab)) for text, _ in info]
+            part = {"label": anns.label, "shape": anns.shape, "coords": anns.coords,
+                    "raw_label": np.array(raw_ids, dtype=np.int32),
+                    "exact": np.array([e for _, e in info], dtype=bool)}
+            parsed += 1
+            changed += i is not None
+        rel_path = Path(rel)
+        files["rel"].append(rel)
+        files["patient"].append(rel_path.parent.name)
+        files["image_id"].append(rel_path.stem)
+        files["size"].append(size); files["mtime_ns"].append(mtime_ns)
+        files["count"].append(head[0]); files["H"].append(head[1]); files["W"].append(head[2])
+        files["n_lines"].append(n_lines); files["ok"].append(ok)
+        files["n_rows"].append(len(part["label"]))
+        parts.append(part)
+
+    n_rows = np.array(files["n_rows"], dtype=np.int64)
+    files["start"] = np.concatenate([[0], np.cumsum(n_rows)[:-1]]) if len(n_rows) else np.empty(0, np.int64)
+    dtypes = {"rel": str, "patient": str, "image_id": str, "size": np.int64, "mtime_ns": np.int64, "count": np.int32,
+              "H": np.int32, "W": np.int32, "n_lines": np.int32, "ok": bool, "start": np.int64, "n_rows": np.int64}
+    files = {k: np.asarray(v, dtype=dtypes[k]) for k, v in files.items()}
+
+    empty = {"label": np.empty(0, np.int16), "shape": np.empty(0, np.int8), "coords": np.empty((0, 4)),
+             "raw_label": np.empty(0, np.int32), "exact": np.empty(0, bool)}
+    rows = {k: np.concatenate([empty[k]] + [p[k] for p in parts]).astype(empty[k].dtype, copy=False) for k in empty}
+    rows["file"] = np.repeat(np.arange(len(n_rows), dtype=np.int32), n_rows)
+
+    raw_labels = np.array(list(vocab), dtype=str) if vocab else np.empty(0, str)
+    index = AnnotationIndex(ann_root, files, rows, raw_labels)
+
+    removed = len(old_pos) - reused - changed
+    if not ann_root.is_dir():
+        return index  # nothing to index (and nowhere to save it)
+    saved = index_path
+    if parsed or removed or old is None:
+        try:
+            _write_index(index_path, index)
+        except OSError as e:
+            # Read-only / shared dataset mount: keep going with the in-memory index
+            print(f"[Warning] Could not save annotation index {index_path}: {e} (using it in memory only)", file=sys.stderr)
+            saved = "(in memory)"
+    if verbose:
+        print(f"✓ Annotation index {saved}: {len(index)} files, {index.n_rows} rows "
+              f"({parsed} parsed, {reused} unchanged, {removed} removed)")
+    return index
+
+def main():
+    ap = argparse.ArgumentParser(description="Build/update the annotation index of one or more annotation folders")
+    ap.add_argument("roots", nargs="+", help="Annotation folders, e.g. .../All_annotations .../GT_updated")
+    ap.add_argument("--rebuild", action="store_true", help="Ignore the existing index and re-parse every file")
+    args = ap.parse_args()
+
+    for root in args.roots:
+        index = load_index(root, rebuild=args.rebuild)
+        _, anns = index.select()
+        print(f"  patients: {len(np.unique(index.files['patient']))}  files without header: {int((index.files['H'] < 0).sum())}")
+        for label, name in LABEL_NAMES.items():
+            sel = anns.label == label
+            print(f"  {name:<18} circles: {int((sel & (anns.shape == SHAPE_CIRCLE)).sum()):>8}"
+                  f"  points: {int((sel & (anns.shape != SHAPE_CIRCLE)).sum()):>8}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""
+Shared parser for NIH/LHNCBC thick-smear annotation files.
+
+Files look like:
+    60,4032,3024                                        <- count,H,W header
+    19-1,Parasitized,No_Comment,Circle,2,1948,1493,2030,1493
+    4-36,White_Blood_Cell,No_Comment,Point,1,1838.25,522.4
+
+Each file is read in one go and returned as columnar NumPy arrays
+(label id, shape id, x1/y1/x2/y2) instead of per-row tuples, so the
+bbox/YOLO conversion below runs vectorized over a whole file.
+"""
+import math
+import re
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+# Canonical label ids (same as CLS in prepare_yolo.py)
+LABEL_PARASITE = 0
+LABEL_WBC = 1
+LABEL_NAMES = {LABEL_PARASITE: "parasite", LABEL_WBC: "white_blood_cell"}
+
+SHAPE_CIRCLE = 0
+SHAPE_POINT = 1
+
+# %-formatting is noticeably faster than f-strings for the per-row output
+YOLO_FMT = "%d %.6f %.6f %.6f %.6f"
+
+_NUM_RE = re.compile(r"[-+]?\d*\.\d+|\d+")
+
+class Annotations(NamedTuple):
+    """Columnar annotations; coords[:, 2:] are NaN for points."""
+    label: np.ndarray   # int16 label id
+    shape: np.ndarray   # int8 SHAPE_CIRCLE / SHAPE_POINT
+    coords: np.ndarray  # float64 (N, 4): x1, y1, x2, y2
+
+    def __len__(self):
+        return len(self.label)
+
+class AnnotationFile(NamedTuple):
+    header: Optional[tuple]  # (count, H, W) or None
+    anns: Annotations
+    n_lines: int             # lines read, header included (0 = empty file)
+
+def empty_annotations() -> Annotations:
+    return Annotations(np.empty(0, np.int16), np.empty(0, np.int8), np.empty((0, 4), np.float64))
+
+# ---------------------------------------------------------------------------
+# Header / label / shape classification
+# ---------------------------------------------------------------------------
+
+def parse_header(first: str):
+    """
+    Parse header like: 60,4032,3024  -> (count=60, H=4032, W=3024)
+    Falls back to regex if commas missing.
+    """
+    first = first.strip()
+    if not first:
+        return None
+    try:
+        if "," in first:
+            parts = [p.strip() for p in first.split(",") if p.strip()]
+            if len(parts) >= 3:
+                return int(float(parts[0])), int(float(parts[1])), int(float(parts[2]))
+        nums = _NUM_RE.findall(first)
+        if len(nums) >= 3:
+            return int(float(nums[0])), int(float(nums[-2])), int(float(nums[-1]))
+    except ValueError:
+        pass
+    return None
+
+_label_cache = {}
+
+def classify_label(text: str) -> int:
+    """Lenient label match: anything with 'paras' is a parasite, wbc/leukocyte a WBC, else -1."""
+    hit = _label_cache.get(text)
+    if hit is None:
+        low = text.lower()
+        if "paras" in low:
+            hit = LABEL_PARASITE
+        elif ("white_blood_cell" in low) or ("wbc" in low) or ("leukocyte" in low):
+            hit = LABEL_WBC
+        else:
+            hit = -1
+        _label_cache[text] = hit
+    return hit
+
+_shape_cache = {}
+
+def classify_shape(text: str) -> int:
+    hit = _shape_cache.get(text)
+    if hit is None:
+        low = text.lower()
+        hit = SHAPE_CIRCLE if "circle" in low else (SHAPE_POINT if "point" in low else -1)
+        _shape_cache[text] = hit
+    return hit
+
+# ---------------------------------------------------------------------------
+# Parsing
+# ---------------------------------------------------------------------------
+
+def _fallback_row(row: str, shape: int):
+    """Regex fallback used for malformed rows: returns (shape, [x1, y1, x2, y2]) or None."""
+    nums = [float(n) for n in _NUM_RE.findall(row)]
+    if shape == SHAPE_CIRCLE and len(nums) >= 4:
+        return SHAPE_CIRCLE, nums[-4:]
+    if shape == SHAPE_POINT and len(nums) >= 2:
+        return SHAPE_POINT, nums[-2:] + [math.nan, math.nan]
+    if shape == -1:
+        # shape missing -> infer from numbers
+        if len(nums) >= 4:
+            return SHAPE_CIRCLE, nums[-4:]
+        if len(nums) >= 2:
+            return SHAPE_POINT, nums[-2:] + [math.nan, math.nan]
+    return None
+
+def parse_lines(lines: List[str], label_map: Optional[dict] = None, strict: bool = False,
+                row_info: Optional[list] = None) -> Annotations:
+    """
+    Parse annotation rows (header already removed) into columnar arrays.
+
+    label_map: exact label string -> id. If None, classify_label() is used.
+    strict:    only accept exact 'Circle' rows with >= 9 columns and 'Point'
+               rows with >= 7 columns (what unify_data.py/analyze_sizes.py
+               did); otherwise fall back to regex like prepare_yolo.py did.
+    Rows whose label is not recognised are dropped.
+    row_info:  optional list that receives (raw label, exact) for every kept
+               row, where exact means the row also passes the strict rules
+               (used by ann_index.py to answer both kinds of query).
+    """
+    labels, shapes, nums = [], [], []
+    nan = "nan"
+    label_cache, shape_cache = _label_cache, _shape_cache  # local names: this loop is the hot path
+    for row in lines:
+        cols = row.split(",")
+        n = len(cols)
+        if n >= 6 or strict:
+            if n < 4:
+                continue
+            raw_label = cols[1].strip() if not strict else cols[1]
+            if label_map is not None:
+                label = label_map.get(raw_label, -1)
+            else:
+                label = label_cache.get(raw_label)
+                if label is None:
+                    label = classify_label(raw_label)
+            if label < 0:
+                continue
+            if strict:
+                shape_txt = cols[3]
+                if shape_txt == "Circle" and n >= 9:
+                    shape = SHAPE_CIRCLE
+                elif shape_txt == "Point" and n >= 7:
+                    shape = SHAPE_POINT
+                else:
+                    continue
+            else:
+                shape = shape_cache.get(cols[3])
+                if shape is None:
+                    shape = classify_shape(cols[3])
+            if shape == SHAPE_CIRCLE and n >= 9:
+                labels.append(label); shapes.append(shape)
+                nums.extend(cols[5:9])
+                if row_info is not None:
+                    row_info.append((cols[1], cols[3] == "Circle"))
+            elif shape == SHAPE_POINT and n >= 7:
+                labels.append(label); shapes.append(shape)
+                nums.extend((cols[5], cols[6], nan, nan))
+                if row_info is not None:
+                    row_info.append((cols[1], cols[3] == "Point"))
+            else:
+                hit = _fallback_row(row, shape)
+                if hit:
+                    labels.append(label); shapes.append(hit[0])
+                    nums.extend(hit[1])
+                    if row_info is not None:
+                        row_info.append((cols[1], False))
+        else:
+            # fallback path: label/shape anywhere in the row
+            row_low = row.lower()
+            label = classify_label(row_low)
+            if label < 0:
+                continue
+            hit = None
+            if "circle" in row_low:
+                hit = _fallback_row(row, SHAPE_CIRCLE)
+            if hit is None and "point" in row_low:
+                hit = _fallback_row(row, SHAPE_POINT)
+            if hit:
+                labels.append(label); shapes.append(hit[0])
+                nums.extend(hit[1])
+                if row_info is not None:
+                    row_info.append(("", False))
+
+    if not labels:
+        return empty_annotations()
+    # One vectorized str -> float64 conversion for the whole file
+    try:
+        coords = np.array(nums, dtype=np.float64).reshape(-1, 4)
+    except ValueError:
+        # A malformed coordinate somewhere: convert row by row and drop only the bad rows
+        coords, good = _coords_by_row(nums)
+        labels = [v for v, ok in zip(labels, good) if ok]
+        shapes = [v for v, ok in zip(shapes, good) if ok]
+        if row_info is not None:
+            row_info[:] = [v for v, ok in zip(row_info, good) if ok]
+        if not labels:
+            return empty_annotations()
+    return Annotations(np.array(labels, np.int16), np.array(shapes, np.int8), coords)
+
+def _coords_by_row(nums):
+    """(coords (N, 4), per-row ok flags) of a flat x1,y1,x2,y2 list, skipping rows that do not convert"""
+    rows, good = [], []
+    for i in range(0, len(nums), 4):
+        try:
+            rows.append([float(v) for v in nums[i:i + 4]])
+            good.append(True)
+        except ValueError:
+            good.append(False)
+    return np.array(rows, dtype=np.float64).reshape(-1, 4), good
+
+def parse_annotation_file(txt_path, label_map: Optional[dict] = None, strict: bool = False) -> AnnotationFile:
+    """Reads a whole annotation file once and returns its header and columnar rows."""
+    with open(txt_path, "r", encoding="utf-8", errors="ignore") as f:
+        text = f.read()
+    lines = [ln for ln in text.splitlines() if ln.strip()] if not strict else text.splitlines()
+    if not lines:
+        return AnnotationFile(None, empty_annotations(), 0)
+    return AnnotationFile(parse_header(lines[0]), parse_lines(lines[1:], label_map, strict), len(lines))
+
+def parse_annotation_files(paths, label_map: Optional[dict] = None, strict: bool = False):
+    """
+    Parses many files into one set of columns.
+    Returns (headers, file_idx, Annotations) where file_idx maps each row to
+    its position in `paths` and headers[i] is the (count, H, W) of paths[i].
+    """
+    headers, file_idx, parts = [], [], []
+    for i, p in enumerate(paths):
+        try:
+            af = parse_annotation_file(p, label_map, strict)
+        except (OSError, ValueError):
+            af = AnnotationFile(None, empty_annotations(), 0)
+        headers.append(af.header)
+        file_idx.append(np.full(len(af.anns), i, np.int32))
+        parts.append(af.anns)
+    if not parts:
+        return headers, np.empty(0, np.int32), empty_annotations()
+    anns = Annotations(np.concatenate([a.label for a in parts]),
+                       np.concatenate([a.shape for a in parts]),
+                       np.concatenate([a.coords for a in parts]))
+    return headers, np.concatenate(file_idx), anns
+
+# ---------------------------------------------------------------------------
+# Vectorized geometry / YOLO formatting
+# ---------------------------------------------------------------------------
+
+def circle_to_bbox(xc, yc, xr, yr):
+    """Circle given by center and a rim point -> (xc, yc, w, h). Works on scalars or arrays."""
+    r = np.hypot(np.subtract(xr, xc), np.subtract(yr, yc))
+    return xc, yc, 2 * r, 2 * r
+
+def point_to_bbox(x, y, r):
+    """Point -> fixed-size square box of radius r. Works on scalars or arrays."""
+    side = np.broadcast_to(np.multiply(2.0, r), np.shape(x))
+    return x, y, side, side
+
+def annotation_boxes(anns: Annotations, point_radius):
+    """
+    (xc, yc, w, h) arrays for every row: circles use their own radius, points
+    use point_radius[label] (a dict label id -> px radius).
+    """
+    x1, y1, x2, y2 = anns.coords.T
+    _, _, cw, ch = circle_to_bbox(x1, y1, x2, y2)
+    radius = np.zeros(len(anns), np.float64)
+    for label, r in point_radius.items():
+        radius[anns.label == label] = r
+    is_circle = anns.shape == SHAPE_CIRCLE
+    w = np.where(is_circle, cw, 2 * radius)
+    h = np.where(is_circle, ch, 2 * radius)
+    return x1, y1, w, h
+
+def yolo_lines(cls_id, xc, yc, w, h, W: int, H: int) -> List[str]:
+    """Vectorized YOLO label lines (normalized + clamped to [0, 1])."""
+    x = np.clip(np.asarray(xc, np.float64) / W, 0.0, 1.0)
+    y = np.clip(np.asarray(yc, np.float64) / H, 0.0, 1.0)
+    bw = np.clip(np.asarray(w, np.float64) / W, 1e-6, 1.0)
+    bh = np.clip(np.asarray(h, np.float64) / H, 1e-6, 1.0)
+    cls = np.broadcast_to(np.asarray(cls_id, np.int64), x.shape)
+    return [YOLO_FMT % row for row in zip(cls.tolist(), x.tolist(), y.tolist(), bw.tolist(), bh.tolist())]
+
+def yolo_line(cls_id: int, xc: float, yc: float, w: float, h: float, W: int, H: int) -> str:
+    return yolo_lines(cls_id, [xc], [yc], [w], [h], W, H)[0]
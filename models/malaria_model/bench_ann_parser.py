@@ -0,0 +1,199 @@
+"""
+Benchmark: legacy row-by-row annotation parsing (what prepare_yolo.py did)
+vs the columnar ann_parser, on a synthetic corpus of annotation files.
+
+    python bench_ann_parser.py --files 5000 --rows 60
+"""
+import argparse
+import math
+import random
+import re
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from ann_parser import (LABEL_PARASITE, LABEL_WBC, parse_annotation_file, parse_annotation_files,
+                        annotation_boxes, yolo_lines)
+
+R_POINT = {LABEL_PARASITE: 16.0, LABEL_WBC: 24.0}
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Benchmark the columnar annotation parser")
+    ap.add_argument("--files", type=int, default=5000, help="Synthetic annotation files to generate")
+    ap.add_argument("--rows", type=int, default=60, help="Average annotation rows per file")
+    ap.add_argument("--repeat", type=int, default=3, help="Timed passes (best is reported)")
+    ap.add_argument("--dir", type=str, default=None, help="Corpus dir (default: temp dir, removed afterwards)")
+    return ap.parse_args()
+
+# ---------------------------------------------------------------------------
+# Legacy implementation (row tuples + scalar math), kept here as the baseline
+# ---------------------------------------------------------------------------
+
+_NUM = r"[-+]?\d*\.\d+|\d+"
+
+def legacy_read_first_line_dims(txt_path):
+    try:
+        with open(txt_path, "r", encoding="utf-8", errors="ignore") as f:
+            first = f.readline().strip()
+        if not first:
+            return None
+        if "," in first:
+            parts = [p.strip() for p in first.split(",") if p.strip()]
+            if len(parts) >= 3:
+                return int(float(parts[0])), int(float(parts[1])), int(float(parts[2]))
+        nums = re.findall(_NUM, first)
+        if len(nums) >= 3:
+            return int(float(nums[0])), int(float(nums[-2])), int(float(nums[-1]))
+    except Exception:
+        pass
+    return None
+
+def legacy_parse_ann_lines(txt_path):
+    anns = []
+    try:
+        with open(txt_path, "r", encoding="utf-8", errors="ignore") as f:
+            lines = [ln.strip() for ln in f.readlines() if ln.strip()]
+        for row in lines[1:]:
+            cols = [c.strip() for c in row.split(",")]
+            if len(cols) >= 6:
+                label_raw = cols[1].lower()
+                shape_raw = cols[3].lower()
+                if "paras" in label_raw:
+                    label = "parasite"
+                elif ("white_blood_cell" in label_raw) or ("wbc" in label_raw) or ("leukocyte" in label_raw):
+                    label = "white_blood_cell"
+                else:
+                    continue
+                if "circle" in shape_raw:
+                    if len(cols) >= 9:
+                        anns.append((label, "circle", float(cols[5]), float(cols[6]), float(cols[7]), float(cols[8])))
+                    else:
+                        nums = [float(n) for n in re.findall(_NUM, row)]
+                        if len(nums) >= 4:
+                            anns.append((label, "circle", *nums[-4:]))
+                elif "point" in shape_raw:
+                    if len(cols) >= 7:
+                        anns.append((label, "point", float(cols[5]), float(cols[6]), None, None))
+                    else:
+                        nums = [float(n) for n in re.findall(_NUM, row)]
+                        if len(nums) >= 2:
+                            anns.append((label, "point", nums[-2], nums[-1], None, None))
+                else:
+                    nums = [float(n) for n in re.findall(_NUM, row)]
+                    if len(nums) >= 4:
+                        anns.append((label, "circle", *nums[-4:]))
+                    elif len(nums) >= 2:
+                        anns.append((label, "point", nums[-2], nums[-1], None, None))
+            else:
+                row_low = row.lower()
+                if "paras" in row_low:
+                    label = "parasite"
+                elif ("white_blood_cell" in row_low) or ("wbc" in row_low) or ("leukocyte" in row_low):
+                    label = "white_blood_cell"
+                else:
+                    continue
+                nums = [float(n) for n in re.findall(_NUM, row)]
+                if "circle" in row_low and len(nums) >= 4:
+                    anns.append((label, "circle", *nums[-4:]))
+                elif "point" in row_low and len(nums) >= 2:
+                    anns.append((label, "point", nums[-2], nums[-1], None, None))
+    except Exception:
+        pass
+    return anns
+
+def legacy_yolo_line(cls_id, xc, yc, w, h, W, H):
+    x = max(0.0, min(1.0, xc / W))
+    y = max(0.0, min(1.0, yc / H))
+    bw = max(1e-6, min(1.0, w / W))
+    bh = max(1e-6, min(1.0, h / H))
+    return f"{cls_id} {x:.6f} {y:.6f} {bw:.6f} {bh:.6f}"
+
+def legacy_file(path):
+    dims = legacy_read_first_line_dims(path)
+    if not dims:
+        return []
+    _, H, W = dims
+    out = []
+    for label, shape, x1, y1, x2, y2 in legacy_parse_ann_lines(path):
+        cls = LABEL_PARASITE if label == "parasite" else LABEL_WBC
+        if shape == "circle":
+            r = math.hypot(x2 - x1, y2 - y1)
+            bw = bh = 2 * r
+        else:
+            bw = bh = 2 * R_POINT[cls]
+        out.append(legacy_yolo_line(cls, x1, y1, bw, bh, W, H))
+    return out
+
+def columnar_file(path):
+    af = parse_annotation_file(path)
+    if not af.header or len(af.anns) == 0:
+        return []
+    _, H, W = af.header
+    return yolo_lines(af.anns.label, *annotation_boxes(af.anns, R_POINT), W, H)
+
+# ---------------------------------------------------------------------------
+# Corpus
+# ---------------------------------------------------------------------------
+
+def make_corpus(root: Path, n_files: int, rows: int, seed: int = 0):
+    rng = random.Random(seed)
+    labels = ["Parasitized", "Parasite", "White_Blood_Cell"]
+    for i in range(n_files):
+        W, H = 3024, 4032
+        n = rng.randint(0, 2 * rows)
+        lines = [f"{n},{H},{W}"]
+        for j in range(n):
+            x, y = rng.uniform(0, W), rng.uniform(0, H)
+            if rng.random() < 0.6:
+                lines.append(f"{i}-{j},{rng.choice(labels)},No_Comment,Circle,2,{x:.2f},{y:.2f},"
+                             f"{x + rng.uniform(-40, 40):.2f},{y + rng.uniform(-40, 40):.2f}")
+            else:
+                lines.append(f"{i}-{j},{rng.choice(labels)},No_Comment,Point,1,{x:.2f},{y:.2f}")
+        (root / f"P{i % 150}").mkdir(exist_ok=True)
+        (root / f"P{i % 150}" / f"img_{i}.txt").write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return sorted(root.rglob("*.txt"))
+
+def best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+def main():
+    args = parse_args()
+    root = Path(args.dir) if args.dir else Path(tempfile.mkdtemp(prefix="ann_bench_"))
+    root.mkdir(parents=True, exist_ok=True)
+    try:
+        print(f"Generating {args.files} annotation files in {root} ...")
+        files = make_corpus(root, args.files, args.rows)
+
+        t_legacy, legacy = best_of(lambda: [legacy_file(p) for p in files], args.repeat)
+        t_new, columnar = best_of(lambda: [columnar_file(p) for p in files], args.repeat)
+        t_lparse, _ = best_of(lambda: [legacy_parse_ann_lines(p) for p in files], args.repeat)
+        t_parse, (_, _, anns) = best_of(lambda: parse_annotation_files(files), args.repeat)
+
+        n_rows = sum(len(x) for x in legacy)
+        if legacy != columnar:
+            bad = sum(a != b for a, b in zip(legacy, columnar))
+            print(f"[Error] YOLO lines differ in {bad} files")
+        else:
+            print(f"✓ Identical YOLO labels for {len(files)} files / {n_rows} boxes")
+        assert len(anns) == n_rows
+
+        print("\n" + "="*60)
+        print("--- ANNOTATION PARSER BENCHMARK ---")
+        print("="*60)
+        print(f"  {'legacy (rows + scalar)':<28}{t_legacy:>9.3f}s  {n_rows / t_legacy:>12,.0f} rows/s")
+        print(f"  {'legacy (parse only)':<28}{t_lparse:>9.3f}s  {n_rows / t_lparse:>12,.0f} rows/s")
+        print(f"  {'columnar (parse + yolo)':<28}{t_new:>9.3f}s  {n_rows / t_new:>12,.0f} rows/s")
+        print(f"  {'columnar (parse only)':<28}{t_parse:>9.3f}s  {n_rows / t_parse:>12,.0f} rows/s")
+        print(f"  Speedup: {t_legacy / t_new:.2f}x end-to-end, {t_lparse / t_parse:.2f}x parsing")
+    finally:
+        if not args.dir:
+            shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""
+Content-addressed image store shared by the dataset preparation scripts.
+
+Images are stored once under <store>/blobs/<aa>/<sha256><ext>; dataset views
+(the unified dataset, the final split, prepare_yolo.py output, ...) hold
+hardlinks to those blobs (reflink/copy when a hardlink is impossible) or
+list their paths, and record which blobs they use in <store>/refs/<view>.json.
+File digests are cached by (path, size, mtime) in <store>/digests.json, so
+re-running a script only hashes files that changed.
+
+    python blob_store.py --store STORE ingest <view> <dir>    # dedup an existing folder in place
+    python blob_store.py --store STORE report                 # bytes stored vs. referenced
+    python blob_store.py --store STORE gc [--dry-run]         # delete unreferenced blobs
+    python blob_store.py --store STORE drop <view>            # forget a view (then gc)
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import uuid
+from pathlib import Path
+
+HASH_CHUNK = 1 << 20
+DIGEST_CACHE = "digests.json"
+IMG_EXTS = {".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp"}
+
+def file_digest(path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _reflink(src, dst):
+    """Copy-on-write clone (Linux FICLONE: btrfs, XFS, ...). Raises OSError if unsupported."""
+    import fcntl
+    FICLONE = 0x40049409
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+def link_or_copy(src, dst):
+    """
+    Atomically make dst have src's content: hardlink, else reflink, else copy.
+    Goes through a temp name next to dst so readers never see a partial file.
+    """
+    dst = Path(dst)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(f".{dst.name}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        os.link(src, tmp)
+    except OSError:
+        try:
+            _reflink(src, tmp)
+        except (OSError, ImportError):
+            if os.path.lexists(tmp):
+                os.remove(tmp)
+            shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+class BlobStore:
+    def __init__(self, root):
+        self.root = Path(root)
+        self.blobs = self.root / "blobs"
+        self.refs = self.root / "refs"
+        self.blobs.mkdir(parents=True, exist_ok=True)
+        self.refs.mkdir(parents=True, exist_ok=True)
+        self._digests = None     # abs path -> [size, mtime_ns, sha256], loaded on first use
+        self._new_digests = {}   # entries not yet in digests.json
+
+    # --- digest cache ----------------------------------------------------------
+
+    def _digest_cache(self) -> dict:
+        if self._digests is None:
+            try:
+                with open(self.root / DIGEST_CACHE, "r", encoding="utf-8") as f:
+                    self._digests = json.load(f)
+            except (OSError, ValueError):
+                self._digests = {}
+        return self._digests
+
+    def _remember(self, path: Path, digest: str):
+        st = path.stat()
+        entry = [st.st_size, st.st_mtime_ns, digest]
+        name = str(path.resolve())
+        if self._digest_cache().get(name) != entry:
+            self._digests[name] = self._new_digests[name] = entry
+
+    def digest(self, path) -> str:
+        """sha256 of a file; only hashed again when its (size, mtime) changed since the last time"""
+        path = Path(path)
+        st = path.stat()
+        hit = self._digest_cache().get(str(path.resolve()))
+        if hit and hit[:2] == [st.st_size, st.st_mtime_ns]:
+            return hit[2]
+        digest = file_digest(path)
+        self._remember(path, digest)
+        return digest
+
+    def take_new_digests(self) -> dict:
+        """Digest cache entries added since the last call (worker processes hand these to save_digests)"""
+        new, self._new_digests = self._new_digests, {}
+        return new
+
+    def save_digests(self, extra: dict = None):
+        """Merges the new digest cache entries (plus `extra` from other processes) into digests.json"""
+        new = self.take_new_digests()
+        new.update(extra or {})
+        if not new:
+            return
+        path = self.root / DIGEST_CACHE
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                merged = json.load(f)
+        except (OSError, ValueError):
+            merged = {}
+        merged.update(new)
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(merged, f)
+        os.replace(tmp, path)
+        self._digests = merged
+
+    # --- blobs ---------------------------------------------------------------
+
+    def blob_path(self, key: str) -> Path:
+        return self.blobs / key[:2] / key
+
+    def put(self, path, digest=None) -> str:
+        """
+        Registers a file and returns its blob key (sha256 + extension). The
+        blob is a hardlink to `path` when it is new, so registering costs no
+        extra space. The file is only hashed when the digest cache has no
+        entry for its current (size, mtime).
+        """
+        path = Path(path)
+        key = (digest or self.digest(path)) + path.suffix.lower()
+        blob = self.blob_path(key)
+        if not blob.exists():
+            link_or_copy(path, blob)
+        return key
+
+    def link(self, key: str, dst):
+        """Places blob `key` at dst (hardlink, else reflink/copy)"""
+        dst = Path(dst)
+        blob = self.blob_path(key)
+        if dst.exists() and os.path.samefile(blob, dst):
+            return
+        link_or_copy(blob, dst)
+        self._remember(dst, key.split(".", 1)[0])  # dst's new stat, so re-registering it needs no hashing
+
+    def add(self, src, dst) -> str:
+        """put(src) + link(key, dst): dst ends up sharing storage with every copy of src's content"""
+        key = self.put(src)
+        self.link(key, dst)
+        return key
+
+    def adopt(self, path) -> str:
+        """Registers a freshly written file and swaps it for the existing blob if that content is already stored"""
+        key = self.put(path)
+        self.link(key, path)
+        return key
+
+    # --- views -----------------------------------------------------------------
+
+    def _ref_path(self, view: str) -> Path:
+        safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in view)
+        return self.refs / f"{safe}.json"
+
+    def read_view(self, view: str) -> dict:
+        try:
+            with open(self._ref_path(view), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"root": None, "files": {}}
+
+    def write_view(self, view: str, root, files: dict):
+        """files: path relative to root -> blob key (or [key, size, mtime_ns])"""
+        path = self._ref_path(view)
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"view": view, "root": str(root), "files": files}, f)
+        os.replace(tmp, path)
+
+    def drop_view(self, view: str) -> bool:
+        path = self._ref_path(view)
+        if path.exists():
+            path.unlink()
+            return True
+        return False
+
+    def views(self):
+        for p in sorted(self.refs.glob("*.json")):
+            with open(p, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            yield data.get("view", p.stem), data
+
+    @staticmethod
+    def _key(entry):
+        return entry[0] if isinstance(entry, list) else entry
+
+    def referenced(self) -> set:
+        return {self._key(e) for _, data in self.views() for e in data["files"].values()}
+
+    def all_blobs(self):
+        for sub in self.blobs.iterdir():
+            if sub.is_dir():
+                for blob in sub.iterdir():
+                    if not blob.name.endswith(".tmp"):
+                        yield blob.name, blob
+
+    # --- maintenance -------------------------------------------------------------
+
+    def gc(self, dry_run: bool = False):
+        """Deletes blobs no view references. Returns (blobs removed, bytes freed)."""
+        live = self.referenced()
+        removed = freed = 0
+        for key, blob in list(self.all_blobs()):
+            if key in live:
+                continue
+            st = blob.stat()
+            # bytes only come back if nothing outside the store links the inode
+            freed += st.st_size if st.st_nlink == 1 else 0
+            removed += 1
+            if not dry_run:
+                blob.unlink()
+                try:
+                    blob.parent.rmdir()  # only succeeds once the shard is empty
+                except OSError:
+                    pass
+        return removed, freed
+
+    def report(self) -> dict:
+        sizes = {key: blob.stat().st_size for key, blob in self.all_blobs()}
+        views = {}
+        for view, data in self.views():
+            keys = [self._key(e) for e in data["files"].values()]
+            views[view] = {"files": len(keys), "logical_bytes": sum(sizes.get(k, 0) for k in keys),
+                           "unique_blobs": len(set(keys)), "missing_blobs": sum(k not in sizes for k in set(keys))}
+        logical = sum(v["logical_bytes"] for v in views.values())
+        stored = sum(sizes.values())
+        live = self.referenced()
+        return {"blobs": len(sizes), "stored_bytes": stored, "logical_bytes": logical, "saved_bytes": logical - stored,
+                "unreferenced_blobs": sum(k not in live for k in sizes), "views": views}
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def ingest(store: BlobStore, view: str, folder: Path):
+    """
+    Registers every image under folder and replaces it with a link to its
+    blob, deduplicating an existing dataset copy in place. Files whose
+    (size, mtime) match the previous ingest are not hashed again.
+    """
+    from tqdm import tqdm
+
+    prev = store.read_view(view)["files"]
+    files = {}
+    images = sorted(p for p in folder.rglob("*") if p.suffix.lower() in IMG_EXTS and p.is_file())
+    for img in tqdm(images, desc=f"Ingest {view}"):
+        rel = img.relative_to(folder).as_posix()
+        st = img.stat()
+        old = prev.get(rel)
+        if isinstance(old, list) and old[1:] == [st.st_size, st.st_mtime_ns] and store.blob_path(old[0]).exists():
+            files[rel] = old
+            continue
+        key = store.adopt(img)
+        st = img.stat()
+        files[rel] = [key, st.st_size, st.st_mtime_ns]
+    store.write_view(view, folder.resolve(), files)
+    store.save_digests()
+    return len(files)
+
+def fmt_bytes(n):
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if abs(n) < 1024 or unit == "TB":
+            return f"{n:.1f} {unit}" if unit != "B" else f"{n} B"
+        n /= 1024
+
+def main():
+    ap = argparse.ArgumentParser(description="Content-addressed image store for the malaria datasets")
+    ap.add_argument("--store", type=str, required=True, help="Store root (blobs/ and refs/ live here)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("ingest", help="Register a folder of images as a view and dedup it in place")
+    p.add_argument("view"); p.add_argument("folder")
+    sub.add_parser("report", help="Storage report")
+    p = sub.add_parser("gc", help="Delete blobs that no view references")
+    p.add_argument("--dry-run", action="store_true")
+    p = sub.add_parser("drop", help="Forget a view (its blobs become collectable)")
+    p.add_argument("view")
+    args = ap.parse_args()
+
+    store = BlobStore(args.store)
+    if args.cmd == "ingest":
+        n = ingest(store, args.view, Path(args.folder))
+        print(f"✓ {args.view}: {n} images linked to the store")
+    elif args.cmd == "drop":
+        if not store.drop_view(args.view):
+            print(f"[Error] No such view: {args.view}", file=sys.stderr)
+            return 1
+        print(f"✓ Dropped {args.view} (run gc to free its blobs)")
+    elif args.cmd == "gc":
+        removed, freed = store.gc(dry_run=args.dry_run)
+        verb = "Would remove" if args.dry_run else "Removed"
+        print(f"✓ {verb} {removed} unreferenced blobs, {fmt_bytes(freed)} freed")
+
+    if args.cmd in ("report", "ingest", "gc"):
+        r = store.report()
+        print("\n" + "="*60)
+        print("--- IMAGE STORE REPORT ---")
+        print("="*60)
+        print(f"  {'view':<28}{'files':>9}{'unique':>9}{'logical':>12}")
+        for view, v in r["views"].items():
+            missing = f"  ({v['missing_blobs']} missing)" if v["missing_blobs"] else ""
+            print(f"  {view:<28}{v['files']:>9}{v['unique_blobs']:>9}{fmt_bytes(v['logical_bytes']):>12}{missing}")
+        print(f"\n  Blobs stored : {r['blobs']} ({fmt_bytes(r['stored_bytes'])}, {r['unreferenced_blobs']} unreferenced)")
+        print(f"  Referenced   : {fmt_bytes(r['logical_bytes'])} across all views")
+        print(f"  Saved        : {fmt_bytes(r['saved_bytes'])}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,307 @@
+"""
+Pre-resized training image cache for a YOLO dataset.
+
+YOLO training resizes every image so its long side is `imgsz` on each
+epoch; with ~4032x3024 originals that decode + downscale dominates CPU
+data loading. This writes the downscaled copies once (aspect preserved,
+no upscaling), optionally together with overlapping full-resolution tiles,
+and a dataset YAML pointing at them. YOLO labels are normalized, so they
+are copied unchanged for resized images and clipped/renormalized for tiles.
+
+    python image_cache.py --data malaria_dataset_final/malaria.yaml --imgsz 640
+    python image_cache.py --data out/malaria.yaml --imgsz 640 --tiles --tile_size 640 --tile_overlap 0.2
+
+prepare_yolo.py runs the same thing with --cache_imgsz.
+"""
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+from ann_parser import YOLO_FMT
+
+IMG_EXTS = {".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp"}
+CACHE_MANIFEST_NAME = "cache_manifest.json"
+SPLITS = ("train", "val", "test")
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Write a pre-resized (and optionally tiled) copy of a YOLO dataset")
+    ap.add_argument("--data", type=str, required=True, help="Dataset YAML (prepare_yolo.py / split_data.py output)")
+    ap.add_argument("--imgsz", type=int, default=640, help="Long side of the cached images (the training imgsz)")
+    ap.add_argument("--out", type=str, default=None, help="Cache root (default: <dataset>/cache_<imgsz>[_tiles])")
+    ap.add_argument("--tiles", action="store_true", help="Also write overlapping tiles cut from the originals")
+    ap.add_argument("--tile_size", type=int, default=None, help="Tile side in original pixels (default: imgsz)")
+    ap.add_argument("--tile_overlap", type=float, default=0.2, help="Overlap between neighbouring tiles (fraction)")
+    ap.add_argument("--min_visibility", type=float, default=0.5, help="Keep a clipped box if this fraction of it is inside the tile")
+    ap.add_argument("--quality", type=int, default=95, help="JPEG quality of the cached images")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    ap.add_argument("--force", action="store_true", help=f"Ignore {CACHE_MANIFEST_NAME} and rewrite everything")
+    return ap.parse_args()
+
+# ---------------------------------------------------------------------------
+# Geometry
+# ---------------------------------------------------------------------------
+
+def fit_size(W: int, H: int, max_side: int):
+    """(w, h) with the long side at most max_side, aspect preserved (never upscales)."""
+    scale = min(1.0, max_side / max(W, H))
+    return max(1, round(W * scale)), max(1, round(H * scale))
+
+def tile_grid(W: int, H: int, tile: int, overlap: float) -> List[tuple]:
+    """
+    (x0, y0, x1, y1) windows of side `tile` covering a W x H image with at
+    least `overlap` between neighbours; the last row/column is shifted to
+    end exactly at the border so no tile is padded.
+    """
+    def starts(n):
+        if n <= tile:
+            return [0]
+        stride = max(1, int(tile * (1.0 - overlap)))
+        s = list(range(0, n - tile, stride))
+        return s + [n - tile]
+    return [(x, y, min(x + tile, W), min(y + tile, H)) for y in starts(H) for x in starts(W)]
+
+def read_yolo_labels(path) -> np.ndarray:
+    """(N, 5) float array of cls, xc, yc, w, h; empty if the file is missing or empty."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            values = f.read().split()
+    except FileNotFoundError:
+        values = []
+    return np.array(values, dtype=np.float64).reshape(-1, 5)
+
+def crop_labels(rows: np.ndarray, W: int, H: int, window, min_visibility: float) -> np.ndarray:
+    """
+    Clips normalized YOLO rows of a W x H image to a pixel window and
+    renormalizes them to it. Boxes with less than min_visibility of their
+    area inside the window are dropped.
+    """
+    if len(rows) == 0:
+        return rows
+    x0, y0, x1, y1 = window
+    xc, yc, w, h = rows[:, 1] * W, rows[:, 2] * H, rows[:, 3] * W, rows[:, 4] * H
+    bx0 = np.maximum(xc - w / 2, x0); bx1 = np.minimum(xc + w / 2, x1)
+    by0 = np.maximum(yc - h / 2, y0); by1 = np.minimum(yc + h / 2, y1)
+    cw, ch = bx1 - bx0, by1 - by0
+    area = np.maximum(w * h, 1e-9)
+    keep = (cw > 0) & (ch > 0) & (cw * ch / area >= min_visibility)
+    tw, th = x1 - x0, y1 - y0
+    out = np.stack([rows[:, 0], ((bx0 + bx1) / 2 - x0) / tw, ((by0 + by1) / 2 - y0) / th, cw / tw, ch / th], axis=1)
+    return out[keep]
+
+def write_yolo_labels(path, rows: np.ndarray):
+    with open(path, "w", encoding="utf-8") as f:
+        for row in rows.tolist():
+            f.write(YOLO_FMT % (int(row[0]), *row[1:]) + "\n")
+
+# ---------------------------------------------------------------------------
+# Per-image work (runs in worker processes)
+# ---------------------------------------------------------------------------
+
+def _open_rgb(path: Path, draft_size=None):
+    """RGB image as cv2.imread would see it (EXIF orientation applied)"""
+    from PIL import Image, ImageOps
+    im = Image.open(path)
+    if draft_size:
+        im.draft("RGB", draft_size)  # JPEG: decode at a reduced scale via the DCT
+    try:
+        im.seek(0)
+    except Exception:
+        pass
+    return ImageOps.exif_transpose(im).convert("RGB")
+
+def _save(im, dst: Path, quality: int):
+    tmp = dst.with_name(f".{dst.name}.tmp")
+    im.save(tmp, format="JPEG", quality=quality)
+    os.replace(tmp, dst)
+
+def cache_image(task: dict) -> dict:
+    """
+    Writes the resized copy (and tiles) of one image plus their labels.
+    Returns the task with task["outputs"] filled in.
+    """
+    from PIL import Image
+
+    src, out_img = Path(task["img"]), Path(task["out_img"])
+    out_img.parent.mkdir(parents=True, exist_ok=True)
+    out_lbl = Path(task["out_lbl"])
+    out_lbl.parent.mkdir(parents=True, exist_ok=True)
+    rows = read_yolo_labels(task["lbl"])
+    imgsz, tile = task["imgsz"], task["tile_size"]
+
+    # Tiles need full resolution; otherwise let the decoder do most of the downscale
+    im = _open_rgb(src, None if tile else (imgsz, imgsz))
+    full = im
+    if max(im.size) > imgsz:
+        im = im.resize(fit_size(*im.size, imgsz), Image.LANCZOS, reducing_gap=3.0)
+    _save(im, out_img, task["quality"])
+    write_yolo_labels(out_lbl, rows)
+    outputs = [str(out_img), str(out_lbl)]
+
+    if tile:
+        W, H = full.size
+        for window in tile_grid(W, H, tile, task["tile_overlap"]):
+            crop = full.crop(window)
+            if max(crop.size) > imgsz:
+                crop = crop.resize(fit_size(*crop.size, imgsz), Image.LANCZOS, reducing_gap=3.0)
+            suffix = f"_t{window[0]}_{window[1]}"
+            t_img = out_img.with_name(out_img.stem + suffix + ".jpg")
+            t_lbl = out_lbl.with_name(out_lbl.stem + suffix + ".txt")
+            _save(crop, t_img, task["quality"])
+            write_yolo_labels(t_lbl, crop_labels(rows, W, H, window, task["min_visibility"]))
+            outputs += [str(t_img), str(t_lbl)]
+    task["outputs"] = outputs
+    return task
+
+# ---------------------------------------------------------------------------
+# Dataset
+# ---------------------------------------------------------------------------
+
+def img2label_path(img: str) -> str:
+    """Same rule as Ultralytics: last /images/ -> /labels/, extension -> .txt"""
+    sa, sb = f"{os.sep}images{os.sep}", f"{os.sep}labels{os.sep}"
+    img = os.path.normpath(img)
+    return sb.join(img.rsplit(sa, 1)).rsplit(".", 1)[0] + ".txt"
+
+def load_data_yaml(path) -> dict:
+    import yaml
+    with open(path, "r", encoding="utf-8") as f:
+        data = yaml.safe_load(f)
+    root = Path(data.get("path") or Path(path).parent)
+    if not root.is_absolute():
+        root = (Path(path).parent / root).resolve()
+    data["path"] = str(root)
+    return data
+
+def split_images(data: dict, split: str) -> List[str]:
+    """Image paths of one split: a folder, or a .txt list of image paths, relative to data['path']"""
+    entry = data.get(split)
+    if not entry:
+        return []
+    src = Path(entry) if Path(entry).is_absolute() else Path(data["path"]) / entry
+    if src.suffix == ".txt":
+        with open(src, "r", encoding="utf-8") as f:
+            paths = [ln.strip() for ln in f if ln.strip()]
+        return [p if Path(p).is_absolute() else str(src.parent / p) for p in paths]
+    return sorted(str(p) for p in src.rglob("*") if p.suffix.lower() in IMG_EXTS)
+
+def _signature(path) -> Optional[List[int]]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+def _load_manifest(path: Path) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("entries", {})
+    except Exception:
+        return {}
+
+def _save_manifest(path: Path, entries: dict):
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "entries": entries}, f)
+    os.replace(tmp, path)
+
+def write_data_yaml(path, root, splits: dict, names):
+    """Dataset YAML in the same layout prepare_yolo.py writes"""
+    root_path = str(Path(root).resolve()).replace("\\", "/")
+    lines = ["# auto-generated by image_cache.py", f"path: {root_path}"]
+    lines += [f"{sp}: {entry}" for sp, entry in splits.items()]
+    names = list(names.values()) if isinstance(names, dict) else list(names)
+    lines += [f"nc: {len(names)}", f"names: [{', '.join(names)}]"]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+def build_cache(data: dict, out, imgsz: int = 640, tiles: bool = False, tile_size: Optional[int] = None,
+                tile_overlap: float = 0.2, min_visibility: float = 0.5, quality: int = 95,
+                workers: int = 1, force: bool = False) -> dict:
+    """
+    Writes the cache for a loaded dataset YAML (see load_data_yaml) into
+    `out`, mirroring each image's path under the dataset root (images/train/x.jpg
+    -> <out>/images/train/x.jpg; images outside the root go to images/<split>/).
+    Only new/changed images are processed. Returns {split: YAML entry}.
+    """
+    from tqdm import tqdm
+
+    out = Path(out)
+    root = Path(data["path"])
+    params = {"imgsz": imgsz, "tile_size": (tile_size or imgsz) if tiles else None,
+              "tile_overlap": tile_overlap, "min_visibility": min_visibility, "quality": quality}
+    manifest_path = out / CACHE_MANIFEST_NAME
+    manifest = {} if force else _load_manifest(manifest_path)
+    new_manifest, tasks, splits, lists = {}, [], {}, {}
+
+    for split in SPLITS:
+        entry = data.get(split)
+        if not entry:
+            continue
+        images = split_images(data, split)
+        for img in images:
+            try:
+                rel = Path(img).resolve().relative_to(root.resolve())
+            except ValueError:
+                rel = Path("images") / split / Path(img).name
+            out_img = (out / rel).with_suffix(".jpg")
+            lbl = img2label_path(img)
+            sig = {"img_sig": _signature(img), "lbl_sig": _signature(lbl), "params": params}
+            prev = manifest.get(img)
+            if prev and all(prev.get(k) == v for k, v in sig.items()) and all(os.path.exists(p) for p in prev["outputs"]):
+                new_manifest[img] = prev
+                continue
+            tasks.append({"img": img, "lbl": lbl, "out_img": str(out_img), "out_lbl": img2label_path(str(out_img)),
+                          "sig": sig, **params})
+        if str(entry).endswith(".txt"):
+            # list splits stay lists, now of the cached images (and their tiles)
+            splits[split] = f"{split}.txt"
+            lists[split] = images
+        else:
+            splits[split] = entry if not Path(entry).is_absolute() else f"images/{split}"
+
+    print(f"[INFO] Image cache {out}: {len(tasks)} images to write, {len(new_manifest)} unchanged")
+    out.mkdir(parents=True, exist_ok=True)
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            done = pool.map(cache_image, tasks, chunksize=max(1, min(16, len(tasks) // (workers * 4))))
+            for task in tqdm(done, total=len(tasks), desc=f"Caching ({workers} workers)"):
+                new_manifest[task["img"]] = {**task["sig"], "outputs": task["outputs"]}
+    else:
+        for task in tqdm(tasks, desc="Caching"):
+            task = cache_image(task)
+            new_manifest[task["img"]] = {**task["sig"], "outputs": task["outputs"]}
+
+    # Outputs of images that left the dataset (or of an older tiling)
+    live = {p for e in new_manifest.values() for p in e["outputs"]}
+    for prev in manifest.values():
+        for p in prev.get("outputs", []):
+            if p not in live and os.path.exists(p):
+                os.remove(p)
+    _save_manifest(manifest_path, new_manifest)
+
+    for split, images in lists.items():
+        with open(out / splits[split], "w", encoding="utf-8") as f:
+            for img in images:
+                for p in new_manifest[img]["outputs"][::2]:  # outputs alternate image, label
+                    f.write(os.path.abspath(p).replace("\\", "/") + "\n")
+    return splits
+
+def main():
+    args = parse_args()
+    data = load_data_yaml(args.data)
+    tag = f"cache_{args.imgsz}" + (f"_tiles{args.tile_size or args.imgsz}" if args.tiles else "")
+    out = Path(args.out) if args.out else Path(data["path"]) / tag
+    splits = build_cache(data, out, args.imgsz, args.tiles, args.tile_size, args.tile_overlap,
+                         args.min_visibility, args.quality, args.workers, args.force)
+    yaml_path = out / "malaria.yaml"
+    write_data_yaml(yaml_path, out, splits, data.get("names", ["parasite", "wbc"]))
+    print(f"✅ Image cache ready: {out}")
+    print(f"   Train with: --data {yaml_path} --imgsz {args.imgsz}")
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,21 @@
 import argparse
 import csv
+import glob
+import json
+import os
+import sys
 from pathlib import Path
 from collections import defaultdict
-from ultralytics import YOLO
+
+import numpy as np
+
+# pred_cache.py lives one level up, next to app.py
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from pred_cache import CACHE_DIR_NAME, CONF_FLOOR, PredictionCache
+
+# A part file is also written after this many images, so images with few
+# detections don't pile up unwritten (their CSV rows wait for the part too)
+PART_MAX_IMAGES = 1024
 
 def parse_args():
     ap = argparse.ArgumentParser()
@@ -11,6 +24,22 @@ def parse_args():
     ap.add_argument("--out", type=str, default="./report.csv")
     ap.add_argument("--conf", type=float, default=0.25)
     ap.add_argument("--iou", type=float, default=0.5)
+    ap.add_argument("--batch", type=int, default=16, help="Images per detector call")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="Processes predicting in parallel, each with its own model (1 = in this process)")
+    ap.add_argument("--threads", type=int, default=None, help="Torch threads per worker (default: CPU count / workers)")
+    ap.add_argument("--fresh", action="store_true",
+                    help="Start over instead of resuming from an existing <out>.images.csv")
+    ap.add_argument("--pred_cache", type=str, default=CACHE_DIR_NAME,
+                    help="Raw prediction cache dir (relative paths: next to the weights); 'none' to disable. "
+                         "Reruns with another --conf then need no inference")
+    ap.add_argument("--detections", type=str, default=None,
+                    help="Also export every detection above --conf (image, patient, class, score, xyxy) into this "
+                         "folder as columnar part files (needs pyarrow)")
+    ap.add_argument("--detections_format", choices=["parquet", "arrow"], default="parquet",
+                    help="Part file format: Parquet, or the Arrow IPC file format (Feather v2)")
+    ap.add_argument("--detections_rows", type=int, default=1 << 16,
+                    help=f"Detections per part file (a part also closes after {PART_MAX_IMAGES} images)")
     return ap.parse_args()
 
 def patient_id_from_path(p: Path) -> str:
@@ -19,32 +48,181 @@ def patient_id_from_path(p: Path) -> str:
             return parent.name
     return p.parent.name
 
+PER_IMAGE_COLUMNS = ["image","parasite_count","wbc_count","patient_id"]
+
+def new_patient_counts():
+    return defaultdict(lambda: {"parasite": 0, "wbc": 0, "images": 0})
+
+def load_checkpoint(path: Path):
+    """
+    Reads a partial per-image CSV: (images already done, patient aggregates
+    rebuilt from its rows). A line torn by a crash mid-write is cut off.
+    """
+    with open(path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+    done, patient_counts = set(), new_patient_counts()
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            done.add(row["image"])
+            d = patient_counts[row["patient_id"]]
+            d["parasite"] += int(row["parasite_count"])
+            d["wbc"] += int(row["wbc_count"])
+            d["images"] += 1
+    return done, patient_counts
+
+class DetectionExporter:
+    """
+    Buffers the detection arrays of up to PART_MAX_IMAGES images and writes
+    them as one columnar part file (part-00000.parquet, part-00001.parquet,
+    ...) once --detections_rows detections or that many images have piled
+    up. Columns are built by concatenating the per-image NumPy arrays, so no
+    Python object is made per box; image and patient are dictionary-encoded.
+    Every part is written to a temporary name and renamed, so a killed run
+    leaves only complete parts. Read the folder with pyarrow.dataset / pandas.read_parquet.
+    """
+
+    def __init__(self, out_dir, fmt, max_rows, metadata):
+        # Deferred so the CSV-only report does not need pyarrow
+        import pyarrow as pa
+        self.pa = pa
+        self.out_dir, self.fmt, self.max_rows = Path(out_dir), fmt, max_rows
+        self.metadata = {k: json.dumps(v) for k, v in metadata.items()}
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.part = len(glob.glob(str(self.out_dir / f"part-*.{fmt}")))
+        self._clear()
+
+    def _clear(self):
+        self.images, self.patients, self.dets, self.rows = [], [], [], 0
+
+    def add(self, image, patient, det):
+        self.images.append(image); self.patients.append(patient); self.dets.append(det)
+        self.rows += len(det.scores)
+
+    def full(self):
+        return self.rows >= self.max_rows or len(self.images) >= PART_MAX_IMAGES
+
+    def flush(self, names=None):
+        """Writes the buffered images as one part file (nothing if the buffer is empty)"""
+        if not self.images:
+            return
+        pa = self.pa
+        lengths = np.array([len(d.scores) for d in self.dets], dtype=np.int64)
+        image_idx = pa.array(np.repeat(np.arange(len(self.images), dtype=np.int32), lengths))
+        patient_names = sorted(set(self.patients))
+        patient_idx = np.repeat(np.searchsorted(patient_names, self.patients).astype(np.int32), lengths)
+        boxes = np.concatenate([d.boxes for d in self.dets]).reshape(-1, 4)
+        table = pa.table({
+            "image": pa.DictionaryArray.from_arrays(image_idx, pa.array(self.images)),
+            "patient_id": pa.DictionaryArray.from_arrays(pa.array(patient_idx), pa.array(patient_names)),
+            "class": pa.array(np.concatenate([d.classes for d in self.dets])),
+            "score": pa.array(np.concatenate([d.scores for d in self.dets])),
+            "x1": pa.array(boxes[:, 0]), "y1": pa.array(boxes[:, 1]),
+            "x2": pa.array(boxes[:, 2]), "y2": pa.array(boxes[:, 3]),
+        })
+        metadata = dict(self.metadata, names=json.dumps({str(k): v for k, v in (names or {}).items()}))
+        table = table.replace_schema_metadata(metadata)
+
+        path = self.out_dir / f"part-{self.part:05d}.{self.fmt}"
+        tmp = path.with_suffix(".tmp")
+        if self.fmt == "parquet":
+            import pyarrow.parquet as pq
+            pq.write_table(table, tmp)
+        else:
+            with pa.OSFile(str(tmp), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp, path)
+        self.part += 1
+        self._clear()
+
 def main():
     args = parse_args()
-    model = YOLO(args.weights)
-
-    imgs = [p for p in Path(args.images).rglob("*") if p.suffix.lower() in {".jpg",".jpeg",".png",".tif",".tiff",".bmp"}]
-    patient_counts = defaultdict(lambda: {"parasite": 0, "wbc": 0, "images": 0})
-    per_image = []
-
-    for img in imgs:
-        res = model.predict(source=str(img), conf=args.conf, iou=args.iou, verbose=False)[0]
-        n_par = 0
-        n_wbc = 0
-        for b in res.boxes:
-            cls = int(b.cls.item())
-            if cls == 0:
-                n_par += 1
-            elif cls == 1:
-                n_wbc += 1
-        patient = patient_id_from_path(img)
-        patient_counts[patient]["parasite"] += n_par
-        patient_counts[patient]["wbc"] += n_wbc
-        patient_counts[patient]["images"] += 1
-        per_image.append([str(img), n_par, n_wbc, patient])
+    if args.detections:
+        try:
+            import pyarrow  # noqa: F401  (optional, only needed for the export)
+        except ImportError:
+            raise SystemExit("[Error] --detections needs pyarrow (pip install pyarrow)")
+
+    # Sorted, so the per-image CSV has the same order however the work is split.
+    # Absolute, so rows of a resumed run match however --images is spelled.
+    images_root = Path(os.path.abspath(args.images))
+    imgs = sorted(p for p in images_root.rglob("*") if p.suffix.lower() in {".jpg",".jpeg",".png",".tif",".tiff",".bmp"})
 
+    if args.pred_cache.lower() == "none":
+        cache = PredictionCache(args.weights, None, conf=args.conf, iou=args.iou)
+    else:
+        cache = PredictionCache(args.weights, args.pred_cache, conf=CONF_FLOOR, iou=args.iou)
+
+    # Per-image rows are appended and flushed as they are produced, so a
+    # killed run resumes where it stopped. The settings they were made with
+    # are kept next to them; resuming with different ones would mix counts.
     out_path = Path(args.out)
     out_path.parent.mkdir(parents=True, exist_ok=True)
+    images_csv = out_path.with_suffix(".images.csv")
+    settings_path = out_path.with_suffix(".progress.json")
+    settings = {"weights": os.path.abspath(args.weights), "images": str(images_root),
+                "conf": args.conf, "iou": args.iou,
+                "detections": os.path.abspath(args.detections) if args.detections else None,
+                "detections_format": args.detections_format if args.detections else None}
+    if not args.fresh and images_csv.exists() and settings_path.exists():
+        with open(settings_path, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        if previous != settings:
+            raise SystemExit(f"[Error] {images_csv} was made with {previous}; rerun with --fresh to start over")
+        done, patient_counts = load_checkpoint(images_csv)
+        print(f"[INFO] Resuming: {len(done)} images already in {images_csv}")
+    else:
+        done, patient_counts = set(), new_patient_counts()
+        if args.detections:
+            for part in glob.glob(os.path.join(args.detections, f"part-*.{args.detections_format}")) + \
+                        glob.glob(os.path.join(args.detections, "part-*.tmp")):
+                os.remove(part)
+        with open(images_csv, "w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerow(PER_IMAGE_COLUMNS)
+        with open(settings_path, "w", encoding="utf-8") as f:
+            json.dump(settings, f, indent=2)
+
+    todo = [p for p in imgs if str(p) not in done]
+    del done
+    missing = len(cache.missing(todo))
+    if cache.path:
+        print(f"[INFO] {len(todo) - missing}/{len(todo)} remaining images in prediction cache {cache.path}")
+    if missing and args.workers > 1:
+        print(f"[INFO] Predicting {missing} images with {args.workers} worker processes")
+
+    exporter = None
+    if args.detections:
+        exporter = DetectionExporter(args.detections, args.detections_format, args.detections_rows,
+                                     {"weights": settings["weights"], "conf": args.conf, "iou": args.iou})
+
+    # Line-buffered: every row reaches the file as soon as it is written. With
+    # --detections, rows wait until their detections are in a finished part
+    # file, so a resumed run never skips an image whose boxes were lost.
+    pending = []
+    with open(images_csv, "a", newline="", encoding="utf-8", buffering=1) as f:
+        w = csv.writer(f)
+        for img, det in cache.stream(todo, args.weights, args.workers, args.threads, args.batch):
+            if det is None:
+                continue  # unreadable image, reported by the reader
+            n_par, n_wbc = det.counts(2, args.conf).tolist()
+            patient = patient_id_from_path(img)
+            patient_counts[patient]["parasite"] += n_par
+            patient_counts[patient]["wbc"] += n_wbc
+            patient_counts[patient]["images"] += 1
+            if exporter is None:
+                w.writerow([str(img), n_par, n_wbc, patient])
+                continue
+            exporter.add(str(img), patient, det.above(args.conf))
+            pending.append([str(img), n_par, n_wbc, patient])
+            if exporter.full():
+                exporter.flush(cache.names)
+                w.writerows(pending)
+                pending.clear()
+        if exporter is not None:
+            exporter.flush(cache.names)
+            w.writerows(pending)
+
     with open(out_path, "w", newline="", encoding="utf-8") as f:
         w = csv.writer(f)
         w.writerow(["patient_id","images","parasite_count","wbc_count","estimated_parasitemia_per_uL","infected_flag"])
@@ -53,13 +231,10 @@ def main():
             infected = 1 if d["parasite"] > 0 else 0
             w.writerow([pid, d["images"], d["parasite"], d["wbc"], est_para, infected])
 
-    with open(out_path.with_suffix(".images.csv"), "w", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        w.writerow(["image","parasite_count","wbc_count","patient_id"])
-        w.writerows(per_image)
-
     print(f"[OK] Wrote summary: {out_path}")
-    print(f"[OK] Wrote per-image details: {out_path.with_suffix('.images.csv')}")
+    print(f"[OK] Wrote per-image details: {images_csv}")
+    if exporter is not None:
+        print(f"[OK] Wrote detections: {args.detections} ({exporter.part} {args.detections_format} part files)")
 
 if __name__ == "__main__":
     main()
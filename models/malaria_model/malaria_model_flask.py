@@ -1,12 +1,11 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-import torch
-import torch.nn as nn
-from torchvision import transforms, models
-from PIL import Image
 import io
 import base64
-import numpy as np
+import threading
+
+# torch, torchvision and PIL are imported lazily inside the functions that
+# need them so the server starts without paying for them up front.
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
@@ -20,23 +19,41 @@ import os
 # Use relative path to the model file
 MODEL_PATH = os.path.join(os.path.dirname(__file__), 'best_malaria_model_finetuned.pt')
 IMG_SIZE = 224
-DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+# Set PRELOAD_MODELS=1 to load the model at startup instead of on first use
+PRELOAD_MODELS = os.environ.get('PRELOAD_MODELS', '0') == '1'
 
 CLASS_NAMES = ['Parasitized', 'Uninfected']
 
 print("="*80)
 print("MALARIA DETECTION API - FLASK SERVER")
 print("="*80)
-print(f"Device: {DEVICE}")
 print(f"Model Path: {MODEL_PATH}")
 
 # ============================================================================
 # LOAD MODEL
 # ============================================================================
 
+_model_lock = threading.Lock()
+_device = None
+model = None
+
+def get_device():
+    """Return the torch device, importing torch on first call"""
+    global _device
+    if _device is None:
+        import torch
+        _device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    return _device
+
 def load_model():
     """Load the fine-tuned EfficientNet-B0 model"""
-    print("\nLoading model...")
+    import torch
+    import torch.nn as nn
+    from torchvision import models
+
+    device = get_device()
+    print(f"\nLoading model on {device}...")
     
     # Create model architecture
     model = models.efficientnet_b0(weights=None)
@@ -54,9 +71,9 @@ def load_model():
     )
     
     # Load weights
-    checkpoint = torch.load(MODEL_PATH, map_location=DEVICE)
+    checkpoint = torch.load(MODEL_PATH, map_location=device)
     model.load_state_dict(checkpoint['model_state_dict'])
-    model = model.to(DEVICE)
+    model = model.to(device)
     model.eval()
     
     print(f"✓ Model loaded successfully!")
@@ -64,15 +81,31 @@ def load_model():
     
     return model
 
-# Load model at startup
-model = load_model()
+def get_model():
+    """Load the model on first use and return it"""
+    global model
+    if model is None:
+        with _model_lock:
+            if model is None:
+                model = load_model()
+    return model
+
+if PRELOAD_MODELS:
+    get_model()
 
 # ============================================================================
 # IMAGE PREPROCESSING
 # ============================================================================
 
+def open_image(image_bytes):
+    """Open uploaded image bytes with PIL"""
+    from PIL import Image
+    return Image.open(io.BytesIO(image_bytes))
+
 def preprocess_image(image):
     """Preprocess image for model input"""
+    from torchvision import transforms
+
     transform = transforms.Compose([
         transforms.Resize((IMG_SIZE, IMG_SIZE)),
         transforms.ToTensor(),
@@ -85,7 +118,7 @@ def preprocess_image(image):
     
     # Apply transforms
     image_tensor = transform(image).unsqueeze(0)  # Add batch dimension
-    return image_tensor.to(DEVICE)
+    return image_tensor.to(get_device())
 
 # ============================================================================
 # PREDICTION FUNCTION
@@ -93,6 +126,10 @@ def preprocess_image(image):
 
 def predict_malaria(image):
     """Run inference on the image"""
+    import torch
+
+    model = get_model()
+
     # Preprocess
     input_tensor = preprocess_image(image)
     
@@ -140,7 +177,7 @@ def health():
     return jsonify({
         'status': 'healthy',
         'model_loaded': model is not None,
-        'device': str(DEVICE)
+        'device': str(_device) if _device is not None else None
     })
 
 @app.route('/analyse-malaria', methods=['POST'])
@@ -188,7 +225,7 @@ def analyse_malaria():
             
             # Read image
             image_bytes = file.read()
-            image = Image.open(io.BytesIO(image_bytes))
+            image = open_image(image_bytes)
         
         # Check if image is provided as base64 in JSON
         elif request.is_json and 'image' in request.json:
@@ -198,7 +235,7 @@ def analyse_malaria():
                 if ',' in image_base64:
                     image_base64 = image_base64.split(',')[1]
                 image_bytes = base64.b64decode(image_base64)
-                image = Image.open(io.BytesIO(image_bytes))
+                image = open_image(image_bytes)
             except Exception as e:
                 return jsonify({
                     'success': False,
@@ -286,7 +323,7 @@ def batch_analyse():
             try:
                 # Read image
                 image_bytes = file.read()
-                image = Image.open(io.BytesIO(image_bytes))
+                image = open_image(image_bytes)
                 
                 # Predict
                 result = predict_malaria(image)
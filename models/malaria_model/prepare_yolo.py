@@ -1,18 +1,25 @@
 import argparse
+import hashlib
 import json
-import math
 import os
-import random
 import shutil
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Tuple, Optional, List
-from PIL import Image
-import re
 
-CLS = {"parasite": 0, "wbc": 1}
+import numpy as np
+
+from ann_index import load_index
+from blob_store import BlobStore
+from image_cache import build_cache, write_data_yaml
+from ann_parser import LABEL_PARASITE, LABEL_WBC, Annotations, annotation_boxes, yolo_lines
+
+CLS = {"parasite": LABEL_PARASITE, "wbc": LABEL_WBC}
 IMG_EXTS = {".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp"}
-RAND_SEED = 42
-random.seed(RAND_SEED)
+RAND_SEED = 42  # salt of the patient -> split hash
+MANIFEST_NAME = "prepare_manifest.json"
+MANIFEST_FLUSH_EVERY = 500
+STORE_DIR = "all"  # images/<STORE_DIR>, labels/<STORE_DIR> in --split_mode lists
 
 def parse_args():
     ap = argparse.ArgumentParser(description="Prepare NIH/LHNCBC thick-smear datasets for YOLOv8" )
@@ -25,137 +32,25 @@ def parse_args():
     ap.add_argument("--r_point_parasite", type=float, default=16.0, help="px radius for POINT parasite fallback")
     ap.add_argument("--r_point_wbc", type=float, default=24.0, help="px radius for POINT WBC fallback")
     ap.add_argument("--copy_mode", choices=["copy","link"], default="copy", help="Use hardlinks/symlinks where possible (link) or copy files")
+    ap.add_argument("--store", type=str, default=None, help="Content-addressed image store (blob_store.py); images become links to its blobs")
     ap.add_argument("--max_per_patient", type=int, default=None, help="Optional cap per patient for quick experiments")
     ap.add_argument("--labels_only", action="store_true", help="Only write labels; skip copying/coverting images")
+    ap.add_argument("--workers", type=int, default=1, help="Worker processes for image conversion/label writing (1 = sequential)")
+    ap.add_argument("--force", action="store_true", help=f"Ignore {MANIFEST_NAME} and rewrite every image/label")
+    ap.add_argument("--split_mode", choices=["copy", "lists"], default="copy",
+                    help="copy: images/<split>/ folders; lists: one images/all/ store + train/val/test.txt image lists")
+    ap.add_argument("--rebuild_index", action="store_true", help="Re-parse every annotation file instead of updating ann_index.npz")
+    ap.add_argument("--cache_imgsz", type=int, default=None,
+                    help="Also write images downscaled to this long side (the training imgsz) under cache_<N>/; malaria.yaml then points there")
+    ap.add_argument("--cache_tiles", action="store_true", help="With --cache_imgsz: also write overlapping full-resolution tiles")
+    ap.add_argument("--tile_size", type=int, default=None, help="Tile side in original pixels (default: --cache_imgsz)")
+    ap.add_argument("--tile_overlap", type=float, default=0.2, help="Overlap between neighbouring tiles (fraction)")
 
     return ap.parse_args()
 
 def list_images(folder: Path):
     return [p for p in folder.rglob("*") if p.suffix.lower() in IMG_EXTS]
 
-def yolo_line(cls_id: int, xc: float, yc: float, w: float, h: float, W: int, H: int) -> str:
-    x = max(0.0, min(1.0, xc / W))
-    y = max(0.0, min(1.0, yc / H))
-    bw = max(1e-6, min(1.0, w / W))
-    bh = max(1e-6, min(1.0, h / H))
-    return f"{cls_id} {x:.6f} {y:.6f} {bw:.6f} {bh:.6f}"
-
-def circle_to_bbox(xc: float, yc: float, xr: float, yr: float):
-    r = math.hypot(xr - xc, yr - yc)
-    return xc, yc, 2*r, 2*r
-
-def point_to_bbox(x: float, y: float, r: float):
-    return x, y, 2*r, 2*r
-
-def read_first_line_dims(txt_path: Path):
-    """
-    Parse header like: 60,4032,3024  -> (count=60, H=4032, W=3024)
-    Falls back to regex if commas missing.
-    """
-    try:
-        with open(txt_path, "r", encoding="utf-8", errors="ignore") as f:
-            first = f.readline().strip()
-        if not first:
-            return None
-        # Prefer comma-separated
-        if "," in first:
-            parts = [p.strip() for p in first.split(",") if p.strip()]
-            if len(parts) >= 3:
-                count = int(float(parts[0]))
-                H = int(float(parts[1]))
-                W = int(float(parts[2]))
-                return count, H, W
-        # Fallback: extract numbers anywhere
-        nums = re.findall(r"[-+]?\d*\.\d+|\d+", first)
-        if len(nums) >= 3:
-            count = int(float(nums[0]))
-            H = int(float(nums[-2]))
-            W = int(float(nums[-1]))
-            return count, H, W
-    except Exception:
-        pass
-    return None
-
-
-def parse_ann_lines(txt_path: Path):
-    """
-    CSV annotations like:
-      19-1,Parasitized,No_Comment,Circle,2,1948,1493,2030,1493
-      4-36,White_Blood_Cell,No_Comment,Point,1,1838.25,522.4
-    Returns: (label_lower, shape_lower, x1, y1, x2, y2 or None)
-             label_lower in {'parasite','white_blood_cell'}
-    """
-    anns = []
-    try:
-        with open(txt_path, "r", encoding="utf-8", errors="ignore") as f:
-            lines = [ln.strip() for ln in f.readlines() if ln.strip()]
-        if not lines:
-            return anns
-
-        body = lines[1:]  # skip header "count,H,W"
-        for row in body:
-            cols = [c.strip() for c in row.split(",")]
-            if len(cols) >= 6:
-                label_raw = cols[1].lower()
-                shape_raw = cols[3].lower()
-
-                # ---- FIX: accept 'Parasitized' (and any variant containing 'paras') ----
-                if "paras" in label_raw:                         # matches parasite, parasitized, etc.
-                    label = "parasite"
-                elif ("white_blood_cell" in label_raw) or ("wbc" in label_raw) or ("leukocyte" in label_raw):
-                    label = "white_blood_cell"
-                else:
-                    continue
-
-                if "circle" in shape_raw:
-                    if len(cols) >= 9:
-                        xc = float(cols[5]); yc = float(cols[6])
-                        xr = float(cols[7]); yr = float(cols[8])
-                        anns.append((label, "circle", xc, yc, xr, yr))
-                    else:
-                        nums = [float(n) for n in re.findall(r"[-+]?\d*\.\d+|\d+", row)]
-                        if len(nums) >= 4:
-                            xc, yc, xr, yr = nums[-4], nums[-3], nums[-2], nums[-1]
-                            anns.append((label, "circle", xc, yc, xr, yr))
-                elif "point" in shape_raw:
-                    if len(cols) >= 7:
-                        x = float(cols[5]); y = float(cols[6])
-                        anns.append((label, "point", x, y, None, None))
-                    else:
-                        nums = [float(n) for n in re.findall(r"[-+]?\d*\.\d+|\d+", row)]
-                        if len(nums) >= 2:
-                            x, y = nums[-2], nums[-1]
-                            anns.append((label, "point", x, y, None, None))
-                else:
-                    # shape missing → infer from numbers
-                    nums = [float(n) for n in re.findall(r"[-+]?\d*\.\d+|\d+", row)]
-                    if len(nums) >= 4:
-                        xc, yc, xr, yr = nums[-4], nums[-3], nums[-2], nums[-1]
-                        anns.append((label, "circle", xc, yc, xr, yr))
-                    elif len(nums) >= 2:
-                        x, y = nums[-2], nums[-1]
-                        anns.append((label, "point", x, y, None, None))
-            else:
-                # fallback path
-                row_low = row.lower()
-                if "paras" in row_low:                             # <- same fix here
-                    label = "parasite"
-                elif ("white_blood_cell" in row_low) or ("wbc" in row_low) or ("leukocyte" in row_low):
-                    label = "white_blood_cell"
-                else:
-                    continue
-                nums = [float(n) for n in re.findall(r"[-+]?\d*\.\d+|\d+", row)]
-                if "circle" in row_low and len(nums) >= 4:
-                    xc, yc, xr, yr = nums[-4], nums[-3], nums[-2], nums[-1]
-                    anns.append((label, "circle", xc, yc, xr, yr))
-                elif "point" in row_low and len(nums) >= 2:
-                    x, y = nums[-2], nums[-1]
-                    anns.append((label, "point", x, y, None, None))
-    except Exception:
-        pass
-    return anns
-
-
 def patient_id_from_path(p: Path) -> str:
     for parent in p.parents:
         name = parent.name
@@ -179,7 +74,14 @@ def place_file(src: Path, dst: Path, copy_mode: str):
                 pass
     shutil.copy2(src, dst)
 
+def image_size(path: Path):
+    """(W, H) of an image; PIL is only imported when a header has no dims."""
+    from PIL import Image
+    with Image.open(path) as im:
+        return im.size
+
 def save_as_png(src: Path, dst: Path):
+    from PIL import Image
     dst.parent.mkdir(parents=True, exist_ok=True)
     with Image.open(src) as im:
         try:
@@ -190,6 +92,7 @@ def save_as_png(src: Path, dst: Path):
         
 def save_as_jpg(src: Path, dst: Path, quality: int = 90):
     """Fast: take ONLY the first page from (multi-page) TIFF and save as RGB JPEG."""
+    from PIL import Image
     dst.parent.mkdir(parents=True, exist_ok=True)
     with Image.open(src) as im:
         try:
@@ -198,6 +101,68 @@ def save_as_jpg(src: Path, dst: Path, quality: int = 90):
             pass
         im.convert("RGB").save(dst, format="JPEG", quality=quality, optimize=False, progressive=False)
 
+def patient_bucket(pid: str, seed: int = RAND_SEED) -> float:
+    """
+    Stable number in [0, 1) for a patient id. Splits are thresholds on it, so a
+    patient's split never changes when other patients are added or removed.
+    """
+    digest = hashlib.sha1(f"{seed}:{pid}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64
+
+def file_signature(path) -> Optional[List[int]]:
+    """[size, mtime_ns] of a source file, None if there is no file."""
+    if not path:
+        return None
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+def load_manifest(path: Path) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("entries", {})
+    except Exception:
+        return {}
+
+def save_manifest(path: Path, entries: dict):
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "entries": entries}, f)
+    os.replace(tmp, path)
+
+_stores = {}
+
+def image_store(root) -> BlobStore:
+    """BlobStore of root, one per process so its digest cache is only loaded once"""
+    if root not in _stores:
+        _stores[root] = BlobStore(root)
+    return _stores[root]
+
+def process_record(task: dict) -> dict:
+    """
+    Writes one image and/or label file. Module-level so it can run in a
+    ProcessPoolExecutor worker; returns the task for the manifest, with the
+    store digests hashed for it under "digests".
+    """
+    if task["write_img"]:
+        src, out_img = Path(task["img"]), Path(task["out_img"])
+        if out_img.exists() or out_img.is_symlink():
+            out_img.unlink()  # a stale hardlink/symlink would otherwise survive
+        if task["convert"]:
+            save_as_jpg(src, out_img, quality=90)
+            if task["store"]:
+                task["entry"]["blob"] = image_store(task["store"]).adopt(out_img)
+        elif task["store"]:
+            task["entry"]["blob"] = image_store(task["store"]).add(src, out_img)
+        else:
+            place_file(src, out_img, task["copy_mode"])
+    if task["write_lbl"]:
+        with open(task["out_lbl"], "w", encoding="utf-8") as f:
+            for line in task["yolo_items"]:
+                f.write(line + "\n")
+    if task["store"]:
+        task["digests"] = image_store(task["store"]).take_new_digests()
+    return task
+
 def convert_dataset(args):
     out = Path(args.out)
     (out / "images").mkdir(parents=True, exist_ok=True)
@@ -205,33 +170,45 @@ def convert_dataset(args):
 
     records: List[dict] = []
 
+    point_radius = {CLS["parasite"]: args.r_point_parasite, CLS["wbc"]: args.r_point_wbc}
+
+    def read_ann(index, ann: Path, keep_labels):
+        """(header, yolo-ready boxes) of one annotation file, looked up in the annotation index."""
+        af = index.file(ann)
+        if af is None:
+            return None, None
+        anns = af.anns
+        keep = np.isin(anns.label, keep_labels)
+        if not keep.all():
+            anns = Annotations(anns.label[keep], anns.shape[keep], anns.coords[keep])
+        return af.header, (anns.label, *annotation_boxes(anns, point_radius))
+
+    def to_yolo(boxes, W, H):
+        if boxes is None or len(boxes[0]) == 0:
+            return []
+        return yolo_lines(*boxes, W, H)
+
     def process_infected1(root: Path):
         img_root = root / "All_PvTk"
         ann_root = root / "All_annotations"
+        index = load_index(ann_root, rebuild=args.rebuild_index)
         for img in list_images(img_root):
             rel = img.relative_to(img_root)
             ann = (ann_root / rel).with_suffix(".txt")
             if not ann.exists():
                 continue
-            dims = read_first_line_dims(ann)
+            dims, boxes = read_ann(index, ann, [CLS["parasite"]])
             if not dims:
                 continue
             count, H, W = dims
-            anns = parse_ann_lines(ann)
-            yolo_items = []
-            for (label, shape, x1, y1, x2, y2) in anns:
-                if label.startswith("parasit"):
-                    if shape == "circle" and x2 is not None and y2 is not None:
-                        xc, yc, bw, bh = circle_to_bbox(x1, y1, x2, y2)
-                    else:
-                        xc, yc, bw, bh = point_to_bbox(x1, y1, args.r_point_parasite)
-                    yolo_items.append(yolo_line(CLS["parasite"], xc, yc, bw, bh, W, H))
+            yolo_items = to_yolo(boxes, W, H)
             patient = patient_id_from_path(img)
             records.append({"img": str(img), "lbl": str(ann), "W": W, "H": H, "patient": patient, "yolo_items": yolo_items})
 
     def process_uninfected(root: Path):
         img_root = root / "Uninfected patients"
         ann_root = root / "Annotations"
+        index = load_index(ann_root, rebuild=args.rebuild_index)
         for img in list_images(img_root):
             if "tiled" not in str(img.parent).lower():
                 continue
@@ -241,24 +218,14 @@ def convert_dataset(args):
                 parts.remove("tiled")
             ann = ann_root.joinpath(*parts).with_suffix(".txt")
             if ann.exists():
-                dims = read_first_line_dims(ann)
+                dims, boxes = read_ann(index, ann, [CLS["wbc"]])
                 if not dims:
-                    with Image.open(img) as im:
-                        W, H = im.size
+                    W, H = image_size(img)
                 else:
                     _, H, W = dims
-                anns = parse_ann_lines(ann)
-                yolo_items = []
-                for (label, shape, x1, y1, x2, y2) in anns:
-                    if "white_blood_cell" in label:
-                        if shape == "circle" and x2 is not None and y2 is not None:
-                            xc, yc, bw, bh = circle_to_bbox(x1, y1, x2, y2)
-                        else:
-                            xc, yc, bw, bh = point_to_bbox(x1, y1, args.r_point_wbc)
-                        yolo_items.append(yolo_line(CLS["wbc"], xc, yc, bw, bh, W, H))
+                yolo_items = to_yolo(boxes, W, H)
             else:
-                with Image.open(img) as im:
-                    W, H = im.size
+                W, H = image_size(img)
                 yolo_items = []
             patient = patient_id_from_path(img)
             records.append({"img": str(img), "lbl": str(ann) if ann.exists() else None, "W": W, "H": H, "patient": patient, "yolo_items": yolo_items})
@@ -266,30 +233,17 @@ def convert_dataset(args):
     def process_infected2(root: Path):
         img_root = root / "Thick_Smears_150"
         ann_root = root / "GT_updated"
+        index = load_index(ann_root, rebuild=args.rebuild_index)
         for img in list_images(img_root):
             rel = img.relative_to(img_root)
             ann = (ann_root / rel).with_suffix(".txt")
             if not ann.exists():
                 continue
-            dims = read_first_line_dims(ann)
+            dims, boxes = read_ann(index, ann, [CLS["parasite"], CLS["wbc"]])
             if not dims:
                 continue
             _, H, W = dims
-            anns = parse_ann_lines(ann)
-            yolo_items = []
-            for (label, shape, x1, y1, x2, y2) in anns:
-                if label.startswith("parasite"):
-                    cls = CLS["parasite"]
-                elif "white_blood_cell" in label:
-                    cls = CLS["wbc"]
-                else:
-                    continue
-                if shape == "circle" and x2 is not None and y2 is not None:
-                    xc, yc, bw, bh = circle_to_bbox(x1, y1, x2, y2)
-                else:
-                    r = args.r_point_parasite if cls == CLS["parasite"] else args.r_point_wbc
-                    xc, yc, bw, bh = point_to_bbox(x1, y1, r)
-                yolo_items.append(yolo_line(cls, xc, yc, bw, bh, W, H))
+            yolo_items = to_yolo(boxes, W, H)
             patient = patient_id_from_path(img)
             records.append({"img": str(img), "lbl": str(ann), "W": W, "H": H, "patient": patient, "yolo_items": yolo_items})
 
@@ -314,13 +268,20 @@ def convert_dataset(args):
 
     pos_patients = [p for p, hb in patient_has_box.items() if hb]
     neg_patients = [p for p, hb in patient_has_box.items() if not hb]
-    random.shuffle(pos_patients); random.shuffle(neg_patients)
 
     def stratified_split(pats, val_ratio, test_ratio):
-        n = len(pats)
-        n_test = max(1, int(round(n * test_ratio))) if n > 0 else 0
-        n_val  = max(1, int(round(n * val_ratio)))  if n > 2 else 0
-        test = set(pats[:n_test]); val = set(pats[n_test:n_test+n_val]); train = set(pats[n_test+n_val:])
+        # Each group (pos/neg) is cut by the same hash thresholds, so both keep
+        # the requested ratios; adding a patient never moves an existing one
+        test = {p for p in pats if patient_bucket(p) < test_ratio}
+        val = {p for p in pats if test_ratio <= patient_bucket(p) < test_ratio + val_ratio}
+        train = set(pats) - test - val
+        # Tiny groups: still at least one test patient (and one val patient if
+        # there are more than two), borrowed deterministically by bucket
+        if pats and not test:
+            donor = train or val
+            p = min(donor, key=patient_bucket); donor.remove(p); test.add(p)
+        if len(pats) > 2 and not val and train:
+            p = min(train, key=patient_bucket); train.remove(p); val.add(p)
         return train, val, test
 
     pos_train, pos_val, pos_test = stratified_split(pos_patients, args.val_ratio, args.test_ratio)
@@ -332,15 +293,18 @@ def convert_dataset(args):
 
     def ensure_positive(target_set, source_set):
         if not any(patient_has_box[p] for p in target_set) and any(patient_has_box[p] for p in source_set):
-            mover = next((p for p in list(source_set) if patient_has_box[p]), None)
+            mover = min((p for p in source_set if patient_has_box[p]), key=patient_bucket, default=None)
             if mover:
                 source_set.remove(mover); target_set.add(mover)
 
     ensure_positive(val_p, train_p); ensure_positive(test_p, train_p)
 
-    for split in ["train","val","test"]:
-        (out / "images" / split).mkdir(parents=True, exist_ok=True)
-        (out / "labels" / split).mkdir(parents=True, exist_ok=True)
+    # lists mode: every split lives in one store folder and only the list
+    # files say which image belongs where, so re-splitting moves no bytes
+    store_dirs = ["train","val","test"] if args.split_mode == "copy" else [STORE_DIR]
+    for d in store_dirs:
+        (out / "images" / d).mkdir(parents=True, exist_ok=True)
+        (out / "labels" / d).mkdir(parents=True, exist_ok=True)
 
     split_map = {"train": [], "val": [], "test": []}
     for r in records:
@@ -350,37 +314,135 @@ def convert_dataset(args):
 
     index = {"splits": {"train": [], "val": [], "test": []}}
 
+    # Manifest keyed on source path: (size, mtime) of image + annotation and the
+    # outputs written for them, so a rerun only touches new or changed inputs
+    manifest_path = out / MANIFEST_NAME
+    copy_mode = f"store:{os.path.abspath(args.store)}" if args.store else args.copy_mode
+    manifest = {} if args.force else load_manifest(manifest_path)
+    new_manifest = {}
+    tasks = []
+
     for split, items in split_map.items():
+        folder = split if args.split_mode == "copy" else STORE_DIR
         for r in items:
             src = Path(r["img"])
             stem = src.stem
-            if not args.labels_only:
-                if src.suffix.lower() in {".tif", ".tiff"}:
-                    out_img = out / "images" / split / f"{stem}.png"
-                    save_as_jpg(src, out_img, quality=90)
-                else:
-                    out_img = out / "images" / split / f"{stem}{src.suffix}"
-                    place_file(src, out_img, args.copy_mode)
+            convert = src.suffix.lower() in {".tif", ".tiff"}
+            if not args.labels_only and convert:
+                out_img = out / "images" / folder / f"{stem}.png"
             else:
-                # Still define an out_img path for bookkeeping, but don't write it
-                out_img = out / "images" / split / f"{stem}{src.suffix}"
-            out_lbl = out / "labels" / split / f"{stem}.txt"
-            with open(out_lbl, "w", encoding="utf-8") as f:
-                for line in r["yolo_items"]:
-                    f.write(line + "\n")
+                # labels_only: still define an out_img path for bookkeeping, but don't write it
+                out_img = out / "images" / folder / f"{stem}{src.suffix}"
+            out_lbl = out / "labels" / folder / f"{stem}.txt"
             index["splits"][split].append({"img": str(out_img), "lbl": str(out_lbl), "patient": r["patient"]})
 
+            entry = {
+                "img_sig": file_signature(src),
+                "lbl_sig": file_signature(r["lbl"]),
+                "out_img": str(out_img),
+                "out_lbl": str(out_lbl),
+                "copy_mode": copy_mode,
+                "images_written": not args.labels_only,
+                "label_digest": hashlib.sha1("\n".join(r["yolo_items"]).encode("utf-8")).hexdigest(),
+            }
+            prev = manifest.get(str(src), {})
+            write_img = not args.labels_only and (
+                any(prev.get(k) != entry[k] for k in ("img_sig", "out_img", "copy_mode", "images_written"))
+                or not out_img.exists()
+            )
+            write_lbl = (
+                any(prev.get(k) != entry[k] for k in ("lbl_sig", "out_lbl", "label_digest"))
+                or not out_lbl.exists()
+            )
+            if args.labels_only and prev.get("images_written") and prev.get("out_img") == entry["out_img"]:
+                entry["images_written"] = True  # earlier full run already placed it
+            if not write_img and prev.get("blob"):
+                entry["blob"] = prev["blob"]
+
+            if write_img or write_lbl:
+                tasks.append({"img": str(src), "out_img": str(out_img), "out_lbl": str(out_lbl), "convert": convert,
+                              "copy_mode": copy_mode, "store": args.store, "yolo_items": r["yolo_items"],
+                              "write_img": write_img, "write_lbl": write_lbl, "entry": entry})
+            else:
+                new_manifest[str(src)] = entry
+
+    # Outputs left behind by sources that were removed or moved to another split
+    live = {p for e in new_manifest.values() for p in (e["out_img"], e["out_lbl"])}
+    live |= {t[k] for t in tasks for k in ("out_img", "out_lbl")}
+    for src_key, prev in manifest.items():
+        for key in ("out_img", "out_lbl"):
+            stale = prev.get(key)
+            if stale and stale not in live and os.path.lexists(stale):
+                os.remove(stale)
+
+    skipped = len(new_manifest)
+    print(f"[INFO] {len(tasks)} records to write, {skipped} unchanged (manifest: {manifest_path.name})")
+
+    from tqdm import tqdm
+    digests = {}  # digest cache entries hashed while writing, saved with the store view
+    if args.workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            results = pool.map(process_record, tasks, chunksize=max(1, min(64, len(tasks) // (args.workers * 4))))
+            done = tqdm(results, total=len(tasks), desc=f"Writing ({args.workers} workers)")
+            for i, task in enumerate(done, 1):
+                new_manifest[task["img"]] = task["entry"]
+                digests.update(task.get("digests") or {})
+                if i % MANIFEST_FLUSH_EVERY == 0:
+                    save_manifest(manifest_path, new_manifest)
+    else:
+        for i, task in enumerate(tqdm(tasks, desc="Writing"), 1):
+            task = process_record(task)
+            new_manifest[task["img"]] = task["entry"]
+            digests.update(task.get("digests") or {})
+            if i % MANIFEST_FLUSH_EVERY == 0:
+                save_manifest(manifest_path, new_manifest)
+    save_manifest(manifest_path, new_manifest)
+
+    if args.store:
+        store = image_store(args.store)
+        refs = {Path(e["out_img"]).relative_to(out).as_posix(): e["blob"] for e in new_manifest.values() if e.get("blob")}
+        store.write_view(f"prepare_yolo_{out.resolve().name}", out.resolve(), refs)
+        # digests hashed in the worker processes come back with their tasks
+        store.save_digests(digests)
+        print(f"[INFO] {len(refs)} images linked from store {args.store}")
+
     root_path = str(out.resolve()).replace("\\", "/")
+    if args.split_mode == "lists":
+        # YOLO accepts .txt files listing image paths instead of folders
+        for split, items in index["splits"].items():
+            with open(out / f"{split}.txt", "w", encoding="utf-8") as f:
+                for it in items:
+                    f.write(os.path.abspath(it["img"]).replace("\\", "/") + "\n")
+        split_entries = {sp: f"{sp}.txt" for sp in ["train","val","test"]}
+    else:
+        for sp in ["train","val","test"]:
+            if (out / f"{sp}.txt").exists():
+                (out / f"{sp}.txt").unlink()  # left over from an earlier lists-mode run
+        split_entries = {sp: f"images/{sp}" for sp in ["train","val","test"]}
     yaml_text = f"""# auto-generated by prepare_yolo.py
 path: {root_path}
-train: images/train
-val: images/val
-test: images/test
+train: {split_entries["train"]}
+val: {split_entries["val"]}
+test: {split_entries["test"]}
 nc: 2
 names: [parasite, wbc]
 """
-    with open(out / "malaria.yaml", "w", encoding="utf-8") as f:
+    cache = args.cache_imgsz and not args.labels_only
+    if args.cache_imgsz and args.labels_only:
+        print("[Warning] --cache_imgsz needs images; skipped with --labels_only")
+    # With a cache, malaria.yaml points at the resized copies and the originals
+    # stay available through malaria_full.yaml
+    with open(out / ("malaria_full.yaml" if cache else "malaria.yaml"), "w", encoding="utf-8") as f:
         f.write(yaml_text)
+    if cache:
+        tag = f"cache_{args.cache_imgsz}" + (f"_tiles{args.tile_size or args.cache_imgsz}" if args.cache_tiles else "")
+        cache_root = out / tag
+        data = {"path": root_path, **split_entries}
+        cache_splits = build_cache(data, cache_root, args.cache_imgsz, args.cache_tiles, args.tile_size,
+                                   args.tile_overlap, workers=args.workers)
+        write_data_yaml(out / "malaria.yaml", cache_root, cache_splits, ["parasite", "wbc"])
+    elif (out / "malaria_full.yaml").exists():
+        (out / "malaria_full.yaml").unlink()  # left over from an earlier --cache_imgsz run
 
     with open(out / "split_index.json", "w", encoding="utf-8") as f:
         json.dump(index, f, indent=2)
@@ -402,7 +464,7 @@ names: [parasite, wbc]
     print(f"  train: {tr_c} images  (non-empty labels: {tr_pos})")
     print(f"  val  : {va_c} images  (non-empty labels: {va_pos})")
     print(f"  test : {te_c} images  (non-empty labels: {te_pos})")
-    print(f"YAML: {out/'malaria.yaml'}")
+    print(f"YAML: {out/'malaria.yaml'}" + (f"  (images resized to {args.cache_imgsz} px; originals: malaria_full.yaml)" if cache else ""))
     
 
 
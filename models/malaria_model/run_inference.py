@@ -1,7 +1,13 @@
-import cv2
 from pathlib import Path
-from ultralytics import YOLO
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import sys
+import threading
+import time
+
+# pred_cache.py lives one level up, next to app.py
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from pred_cache import PredictionCache, read_image
 
 MODEL_PATH = Path(r"C:\Ankit\Reposetories\honors-final-project\models\malaria_model\runs\detect\train3\weights\best.pt")
 
@@ -14,26 +20,114 @@ OUTPUT_DIR = Path(r"C:\Ankit\Reposetories\honors-final-project\models\malaria_mo
 # 4. How many images to test
 NUM_IMAGES_TO_TEST = 10
 
+# 5. We set a low confidence (0.1) to see *everything* the model is
+#    *thinking* about, not just high-confidence results. Raw predictions are
+#    cached per model in PRED_CACHE_DIR (relative to the model folder), so
+#    rerunning with another CONF_THRESHOLD needs no inference.
+CONF_THRESHOLD = 0.1
+PRED_CACHE_DIR = "pred_cache"
+
+# 6. Annotated images are drawn and saved by RENDER_WORKERS background threads
+#    while the model works on the next batch; at most RENDER_QUEUE results
+#    wait for them (each holds a full-size image). To save fewer images:
+#    RENDER_SAMPLE = fraction to save (stable per file name, 1.0 = all),
+#    RENDER_MIN_DETECTIONS = only save images with at least this many boxes.
+RENDER_WORKERS = 2
+RENDER_QUEUE = 8
+RENDER_SAMPLE = 1.0
+RENDER_MIN_DETECTIONS = 0
+
 # --- END OF CONFIGURATION ---
 
+class AsyncImageWriter:
+    """
+    Draws and saves Results on a small thread pool (OpenCV drawing and JPEG
+    encoding release the GIL). submit() blocks while RENDER_QUEUE results are
+    pending, so memory stays bounded when rendering is slower than inference.
+    """
+
+    def __init__(self, workers=RENDER_WORKERS, max_pending=RENDER_QUEUE):
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.workers = workers
+        self.saved = 0
+        self.render_time = 0.0   # summed over the worker threads
+        self.blocked_time = 0.0  # caller waiting for a free slot
+        self.drain_time = 0.0    # close() waiting for the last images
+        self.errors = []
+
+    def submit(self, result, filename):
+        t0 = time.perf_counter()
+        self.slots.acquire()
+        self.blocked_time += time.perf_counter() - t0
+        future = self.pool.submit(self._render, result, filename)
+        future.add_done_callback(lambda _: self.slots.release())
+
+    def _render(self, result, filename):
+        t0 = time.perf_counter()
+        try:
+            # This saves the original image with predictions overlaid
+            result.save(filename=str(filename))
+        except Exception as e:
+            with self.lock:
+                self.errors.append((filename, e))
+            return
+        with self.lock:
+            self.saved += 1
+            self.render_time += time.perf_counter() - t0
+
+    def close(self):
+        t0 = time.perf_counter()
+        self.pool.shutdown(wait=True)
+        self.drain_time = time.perf_counter() - t0
+        for filename, e in self.errors:
+            print(f"  [Error] Failed to save {filename}: {e}", file=sys.stderr)
+
+def should_render(img_path, n_detections):
+    """RENDER_MIN_DETECTIONS / RENDER_SAMPLE filter (the sample is a hash of the name, so reruns pick the same images)"""
+    if n_detections < RENDER_MIN_DETECTIONS:
+        return False
+    if RENDER_SAMPLE >= 1.0:
+        return True
+    digest = hashlib.sha1(img_path.name.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64 < RENDER_SAMPLE
+
+def report_image(img_path, image, det, names, writer):
+    """Prints the counts of one image and queues its annotated copy"""
+    print(f"\n--- Processing: {img_path.name} ---")
+
+    # Result object of the cached predictions above the threshold
+    result = det.above(CONF_THRESHOLD).to_results(image, img_path, names)
+
+    # Print what it found
+    parasite_count = 0
+    wbc_count = 0
+
+    for box in result.boxes:
+        class_id = int(box.cls)
+        class_name = names[class_id]
+        if class_name == 'parasite':
+            parasite_count += 1
+        elif class_name == 'white_blood_cell':
+            wbc_count += 1
+
+    print(f"  Found: {parasite_count} parasites")
+    print(f"  Found: {wbc_count} white_blood_cells")
+
+    # Save the image with boxes drawn on it (in the background)
+    if not should_render(img_path, len(result.boxes)):
+        print("  Not saved (RENDER_SAMPLE / RENDER_MIN_DETECTIONS)")
+        return False
+    output_filename = OUTPUT_DIR / f"result_{img_path.name}"
+    writer.submit(result, output_filename)
+    print(f"  Saving detection image to: {output_filename}")
+    return True
+
 def run_inference():
-    print(f"Loading model from {MODEL_PATH}...")
     if not MODEL_PATH.exists():
         print(f"[Error] Model file not found at {MODEL_PATH}", file=sys.stderr)
         return
-        
-    try:
-        # Load the trained model
-        model = YOLO(MODEL_PATH)
-    except Exception as e:
-        print(f"[Error] Failed to load model: {e}", file=sys.stderr)
-        return
-
-    print("Model loaded successfully.")
-    
-    # Create the output directory
-    OUTPUT_DIR.mkdir(exist_ok=True)
-    print(f"Results will be saved in: {OUTPUT_DIR}")
 
     # Get a list of validation images
     image_files = list(VALIDATION_IMAGE_DIR.glob("*.jpg"))
@@ -44,45 +138,78 @@ def run_inference():
     # Select a few images to test
     images_to_test = image_files[:NUM_IMAGES_TO_TEST]
 
+    cache = PredictionCache(MODEL_PATH, PRED_CACHE_DIR)
+    missing = cache.missing(images_to_test)
+    model = None
+    if missing:
+        print(f"Loading model from {MODEL_PATH}...")
+        try:
+            # Load the trained model (ultralytics is imported here, not at module level)
+            from ultralytics import YOLO
+            model = YOLO(MODEL_PATH)
+        except Exception as e:
+            print(f"[Error] Failed to load model: {e}", file=sys.stderr)
+            return
+        print("Model loaded successfully.")
+
+    # Create the output directory
+    OUTPUT_DIR.mkdir(exist_ok=True)
+    print(f"Results will be saved in: {OUTPUT_DIR}")
+
+    writer = AsyncImageWriter()
+    t_start = time.perf_counter()
+    queued = [0]
+    t_report = [0.0]  # main-thread time spent in handle() during inference
+
+    def handle(img_path, image, det):
+        t0 = time.perf_counter()
+        if image is None:
+            print(f"  [Error] Failed to read {img_path.name}", file=sys.stderr)
+        else:
+            queued[0] += report_image(img_path, image, det, cache.names, writer)
+        t_report[0] += time.perf_counter() - t0
+
+    # Images predicted before: straight to the writer
     for img_path in images_to_test:
-        print(f"\n--- Processing: {img_path.name} ---")
-        
-        # Run inference
-        # We set a low confidence (conf=0.1) to see *everything* the
-        # model is *thinking* about, not just high-confidence results.
+        det = cache.get(img_path)
+        if det is not None:
+            handle(img_path, read_image(str(img_path)), det)
+    if len(missing) < len(images_to_test):
+        print(f"\nPredictions for {len(images_to_test) - len(missing)} images loaded from {cache.path}")
+
+    # The rest: every predicted batch is handed to the writer while the
+    # model already works on the next one
+    t_infer = 0.0
+    if missing:
+        print(f"\nRunning inference on {len(missing)} images...")
+        t0, r0 = time.perf_counter(), t_report[0]
         try:
-            results = model(img_path, conf=0.1)
+            cache.update(model, missing,
+                         on_batch=lambda paths, images, dets: [handle(p, im, d) for p, im, d in zip(paths, images, dets)])
         except Exception as e:
-            print(f"  [Error] Failed to run inference on {img_path.name}: {e}", file=sys.stderr)
-            continue
-
-        # Get the first result object
-        result = results[0]
-        
-        # Print what it found
-        parasite_count = 0
-        wbc_count = 0
-        
-        for box in result.boxes:
-            class_id = int(box.cls)
-            class_name = model.names[class_id]
-            if class_name == 'parasite':
-                parasite_count += 1
-            elif class_name == 'white_blood_cell':
-                wbc_count += 1
-        
-        print(f"  Found: {parasite_count} parasites")
-        print(f"  Found: {wbc_count} white_blood_cells")
-
-        # Save the image with boxes drawn on it
-        output_filename = OUTPUT_DIR / f"result_{img_path.name}"
-        
-        # This saves the original image with predictions overlaid
-        result.save(filename=str(output_filename))
-        print(f"  Saved detection image to: {output_filename}")
+            print(f"[Error] Failed to run inference: {e}", file=sys.stderr)
+        t_infer = time.perf_counter() - t0 - (t_report[0] - r0)
+        for img_path in missing:
+            if cache.get(img_path) is None:
+                print(f"  [Error] Failed to run inference on {img_path.name}", file=sys.stderr)
+
+    writer.close()
+    wall = time.perf_counter() - t_start
+    # Without the writer, the main thread's own work and the rendering would add up
+    sequential = wall - writer.blocked_time - writer.drain_time + writer.render_time
+
+    print("\n" + "="*60)
+    print("--- TIMING (inference and rendering overlap) ---")
+    print("="*60)
+    print(f"  Inference:            {t_infer:6.2f} s ({len(missing)} images)")
+    print(f"  Rendering work:       {writer.render_time:6.2f} s on {writer.workers} threads "
+          f"({writer.saved} saved, {len(images_to_test) - queued[0]} not queued)")
+    print(f"  Waiting for a slot:   {writer.blocked_time:6.2f} s (render queue full)")
+    print(f"  Final drain:          {writer.drain_time:6.2f} s")
+    print(f"  Wall time:            {wall:6.2f} s (sequential would be ~{sequential:.2f} s)")
 
     print("\n✅ Inference complete.")
     print("Please open the 'inference_results' folder to see the detections.")
 
 if __name__ == "__main__":
-    run_inference()
\ No newline at end of file
+    run_inference()
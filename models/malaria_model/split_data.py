@@ -1,11 +1,13 @@
+import hashlib
 import os
-import random
 import shutil
 from pathlib import Path
 from collections import defaultdict
 from tqdm import tqdm
 import sys
 
+from blob_store import BlobStore
+
 # --- CONFIGURATION: YOU MUST EDIT THESE PATHS ---
 
 # 1. Set the path to the dataset you created in Step 1
@@ -18,15 +20,44 @@ FINAL_DATA_ROOT = Path(r"C:\Ankit\Reposetories\honors-final-project\models\malar
 # 3. Set your desired validation split ratio (e.g., 0.2 = 20% validation)
 VAL_SPLIT_RATIO = 0.2
 
-# 4. Set a random seed for reproducible splits
+# 4. Set a seed for reproducible splits (salt of the patient -> split hash)
 RANDOM_SEED = 42
 
+# 5. "copy": copy images/labels into FINAL_DATA_ROOT/{images,labels}/{train,val}
+#    "lists": write FINAL_DATA_ROOT/train.txt + val.txt listing images in
+#             UNIFIED_DATA_ROOT (no image bytes copied) and a malaria.yaml using them
+SPLIT_MODE = "copy"
+
+# 6. Optional content-addressed image store (see blob_store.py). In "copy" mode
+#    images are then hardlinked from the store instead of copied, so the final
+#    dataset costs no extra disk space. None = plain copies.
+STORE_ROOT = None
+
 # --- END OF CONFIGURATION ---
 
-def move_files(patient_list, patients_to_files, src_img_dir, src_lab_dir, dest_img_dir, dest_lab_dir):
+def patient_bucket(patient_id):
+    """
+    Stable number in [0, 1) for a patient id. A patient goes to validation
+    when it is below VAL_SPLIT_RATIO, so adding new patients never moves
+    existing ones (and never forces their files to be copied again).
+    """
+    digest = hashlib.sha1(f"{RANDOM_SEED}:{patient_id}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64
+
+def same_file_stat(src, dest):
+    try:
+        a, b = src.stat(), dest.stat()
+    except FileNotFoundError:
+        return False
+    return a.st_size == b.st_size and a.st_mtime_ns == b.st_mtime_ns
+
+def move_files(patient_list, patients_to_files, src_img_dir, src_lab_dir, dest_img_dir, dest_lab_dir, placed=None):
     """
     Moves all files for a given list of patients to the destination folders.
+    With STORE_ROOT set, images are linked from the store and `placed` receives
+    {path relative to FINAL_DATA_ROOT: blob key}.
     """
+    store = BlobStore(STORE_ROOT) if STORE_ROOT else None
     total_files_moved = 0
     for patient_id in tqdm(patient_list, desc=f"Moving files to {dest_img_dir.parent.name}"):
         file_stems = patients_to_files[patient_id]
@@ -39,18 +70,77 @@ def move_files(patient_list, patients_to_files, src_img_dir, src_lab_dir, dest_i
             dest_lab = dest_lab_dir / f"{stem}.txt"
             
             if src_img.exists() and src_lab.exists():
-                # Use shutil.copy2 to copy file and metadata
-                shutil.copy2(src_img, dest_img)
-                shutil.copy2(src_lab, dest_lab)
+                # Use shutil.copy2 to copy file and metadata; files already
+                # copied by an earlier run (same size + mtime) are left alone
+                if store:
+                    key = store.add(src_img, dest_img)
+                    placed[dest_img.relative_to(FINAL_DATA_ROOT).as_posix()] = key
+                elif not same_file_stat(src_img, dest_img):
+                    shutil.copy2(src_img, dest_img)
+                if not same_file_stat(src_lab, dest_lab):
+                    shutil.copy2(src_lab, dest_lab)
                 total_files_moved += 1
             else:
                 print(f"  [Warning] Missing file for stem {stem}, skipping.", file=sys.stderr)
-                
+
+    if store:
+        store.save_digests()
     return total_files_moved
 
+def prune_split(patient_list, patients_to_files, dest_img_dir, dest_lab_dir):
+    """
+    Deletes images/labels of a split whose stem is not assigned to it, left
+    there by an earlier run (a patient that moved, e.g. the one borrowed for
+    validation, or an older random split), so no image is in two splits.
+    Returns the number of images removed.
+    """
+    keep = {stem for patient_id in patient_list for stem in patients_to_files[patient_id]}
+    removed = 0
+    for folder, pattern in ((dest_img_dir, "*.jpg"), (dest_lab_dir, "*.txt")):
+        for path in folder.glob(pattern):
+            if path.stem not in keep:
+                path.unlink()
+                removed += folder is dest_img_dir
+    return removed
+
+def write_file_lists(splits, patients_to_files, src_img_dir, src_lab_dir):
+    """
+    Writes one image-list file per split (YOLO dataset YAMLs accept .txt
+    lists) pointing into the unified store, plus a YAML that uses them.
+    Only looks at file metadata. Returns {split: image count}.
+    """
+    counts = {}
+    for split, patient_list in splits.items():
+        lines = []
+        for patient_id in patient_list:
+            for stem in patients_to_files[patient_id]:
+                src_img = src_img_dir / f"{stem}.jpg"
+                if (src_lab_dir / f"{stem}.txt").exists():
+                    lines.append(os.path.abspath(src_img).replace("\\", "/"))
+                else:
+                    print(f"  [Warning] Missing file for stem {stem}, skipping.", file=sys.stderr)
+        list_path = FINAL_DATA_ROOT / f"{split}.txt"
+        tmp = list_path.with_suffix(".tmp")
+        tmp.write_text("".join(line + "\n" for line in lines), encoding="utf-8")
+        os.replace(tmp, list_path)
+        counts[split] = len(lines)
+
+    root_path = str(FINAL_DATA_ROOT.resolve()).replace("\\", "/")
+    yaml_text = f"""# auto-generated by split_data.py (image lists over {UNIFIED_DATA_ROOT.name})
+path: {root_path}
+train: train.txt
+val: val.txt
+
+nc: 2
+names:
+  - parasite
+  - white_blood_cell
+"""
+    (FINAL_DATA_ROOT / "malaria.yaml").write_text(yaml_text, encoding="utf-8")
+    return counts
+
 def main():
     print(f"Starting patient-based split...")
-    random.seed(RANDOM_SEED)
 
     # Define source directories from Step 1
     src_img_dir = UNIFIED_DATA_ROOT / "images"
@@ -68,10 +158,13 @@ def main():
     val_lab_dir = FINAL_DATA_ROOT / "labels" / "val"
 
     # Create directories
-    train_img_dir.mkdir(parents=True, exist_ok=True)
-    train_lab_dir.mkdir(parents=True, exist_ok=True)
-    val_img_dir.mkdir(parents=True, exist_ok=True)
-    val_lab_dir.mkdir(parents=True, exist_ok=True)
+    if SPLIT_MODE == "lists":
+        FINAL_DATA_ROOT.mkdir(parents=True, exist_ok=True)
+    else:
+        train_img_dir.mkdir(parents=True, exist_ok=True)
+        train_lab_dir.mkdir(parents=True, exist_ok=True)
+        val_img_dir.mkdir(parents=True, exist_ok=True)
+        val_lab_dir.mkdir(parents=True, exist_ok=True)
 
     # 1. Discover all files and map them to unique patients
     print("Scanning files and identifying patients...")
@@ -106,31 +199,41 @@ def main():
 
     print(f"Found {len(patients_to_files)} unique patients.")
 
-    # 2. Shuffle and split the list of patients
-    patient_list = list(patients_to_files.keys())
-    random.shuffle(patient_list)
+    # 2. Split the list of patients by a stable hash of their id
+    patient_list = sorted(patients_to_files.keys(), key=patient_bucket)
 
-    split_index = int(len(patient_list) * VAL_SPLIT_RATIO)
+    val_patients = [p for p in patient_list if patient_bucket(p) < VAL_SPLIT_RATIO]
+    train_patients = [p for p in patient_list if patient_bucket(p) >= VAL_SPLIT_RATIO]
     
     # Ensure at least one patient in validation set (if possible)
-    if split_index == 0 and len(patient_list) > 1:
-        split_index = 1
-        
-    val_patients = patient_list[:split_index]
-    train_patients = patient_list[split_index:]
+    if not val_patients and len(patient_list) > 1:
+        val_patients = [train_patients.pop(0)]
 
     print(f"Total patients: {len(patient_list)}")
     print(f"Training patients: {len(train_patients)}")
     print(f"Validation patients: {len(val_patients)}")
 
-    # 3. Move files for each set
-    train_count = move_files(train_patients, patients_to_files, 
-                             src_img_dir, src_lab_dir, 
-                             train_img_dir, train_lab_dir)
-                             
-    val_count = move_files(val_patients, patients_to_files, 
-                           src_img_dir, src_lab_dir, 
-                           val_img_dir, val_lab_dir)
+    # 3. Move files for each set (or just list them)
+    if SPLIT_MODE == "lists":
+        counts = write_file_lists({"train": train_patients, "val": val_patients},
+                                  patients_to_files, src_img_dir, src_lab_dir)
+        train_count, val_count = counts["train"], counts["val"]
+    else:
+        placed = {}
+        train_count = move_files(train_patients, patients_to_files, 
+                                 src_img_dir, src_lab_dir, 
+                                 train_img_dir, train_lab_dir, placed)
+                                 
+        val_count = move_files(val_patients, patients_to_files, 
+                               src_img_dir, src_lab_dir, 
+                               val_img_dir, val_lab_dir, placed)
+        stale = prune_split(train_patients, patients_to_files, train_img_dir, train_lab_dir)
+        stale += prune_split(val_patients, patients_to_files, val_img_dir, val_lab_dir)
+        if stale:
+            print(f"[INFO] Removed {stale} images left in a split their patient is no longer assigned to")
+        if STORE_ROOT:
+            BlobStore(STORE_ROOT).write_view(f"final_{FINAL_DATA_ROOT.name}", FINAL_DATA_ROOT.resolve(), placed)
+            print(f"[INFO] {len(placed)} images linked from store {STORE_ROOT}")
 
     # 4. Final Summary
     print("\n--- Split Summary ---")
@@ -139,7 +242,10 @@ def main():
     print(f"Total images processed:         {train_count + val_count}")
     print("\n✅ Patient-based split complete!")
     print(f"Your final dataset is ready in: {FINAL_DATA_ROOT}")
-    print("Your next step is to create the 'malaria.yaml' file and start training.")
+    if SPLIT_MODE == "lists":
+        print(f"Train with: {FINAL_DATA_ROOT / 'malaria.yaml'} (train.txt / val.txt image lists)")
+    else:
+        print("Your next step is to create the 'malaria.yaml' file and start training.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,154 @@
+"""
+Offline overlapping tiling of a YOLO dataset (run after prepare_yolo.py).
+
+Parasites are ~57 px across on ~4000 px fields, so letting YOLO resize whole
+fields to 640 shrinks them to a few pixels. This cuts every image into
+overlapping native-resolution tiles instead:
+
+  - labels are clipped to each tile and renormalized (boxes with less than
+    --min_visibility of their area inside are dropped)
+  - empty background tiles are dropped or kept with probability --empty_keep
+    (deterministic per tile, so reruns pick the same ones)
+  - images are processed in parallel and every tile is written as soon as it
+    is cut; workers hold one image at a time and the parent only streams
+    small index rows, so memory does not grow with the dataset
+  - tile_index.csv maps every tile back to its source image and window
+
+    python tile_dataset.py --data out/malaria.yaml --tile_size 640 --overlap 0.2 --empty_keep 0.1
+"""
+import argparse
+import csv
+import hashlib
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from image_cache import (SPLITS, crop_labels, img2label_path, load_data_yaml, read_yolo_labels, split_images,
+                         tile_grid, write_data_yaml, write_yolo_labels)
+
+INDEX_NAME = "tile_index.csv"
+INDEX_COLUMNS = ("split", "tile", "source", "x0", "y0", "x1", "y1", "boxes")
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Cut a YOLO dataset into overlapping tiles for small-object training")
+    ap.add_argument("--data", type=str, required=True, help="Dataset YAML (prepare_yolo.py output, e.g. out/malaria_full.yaml)")
+    ap.add_argument("--out", type=str, default=None, help="Output root (default: <dataset>/tiles_<tile_size>)")
+    ap.add_argument("--tile_size", type=int, default=640, help="Tile side in pixels (tiles are not resized)")
+    ap.add_argument("--overlap", type=float, default=0.2, help="Overlap between neighbouring tiles (fraction of tile_size)")
+    ap.add_argument("--min_visibility", type=float, default=0.5, help="Keep a clipped box if this fraction of it is inside the tile")
+    ap.add_argument("--empty_keep", type=float, default=0.1, help="Fraction of empty background tiles to keep (0 = drop all)")
+    ap.add_argument("--splits", nargs="+", default=list(SPLITS), help="Splits to tile")
+    ap.add_argument("--seed", type=int, default=42, help="Salt of the empty-tile sampling hash")
+    ap.add_argument("--quality", type=int, default=95, help="JPEG quality of the tiles")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    return ap.parse_args()
+
+def tile_bucket(source: str, x0: int, y0: int, seed: int) -> float:
+    """Stable number in [0, 1) per tile; an empty tile is kept when it is below --empty_keep."""
+    digest = hashlib.sha1(f"{seed}:{source}:{x0}:{y0}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64
+
+def tile_image(task: dict) -> list:
+    """
+    Cuts one image into tiles and writes every kept tile + label straight to
+    disk. Runs in a worker process; returns the index rows of the kept tiles.
+    """
+    import cv2
+
+    src = task["img"]
+    image = cv2.imread(src)  # applies EXIF orientation, like YOLO's loader
+    if image is None:
+        print(f"[Warning] Could not read {src}, skipped")
+        return []
+    H, W = image.shape[:2]
+    rows = read_yolo_labels(task["lbl"])
+    out_img_dir, out_lbl_dir = Path(task["out_img_dir"]), Path(task["out_lbl_dir"])
+    stem = Path(src).stem
+    params = [cv2.IMWRITE_JPEG_QUALITY, task["quality"]]
+
+    index_rows = []
+    for window in tile_grid(W, H, task["tile_size"], task["overlap"]):
+        x0, y0, x1, y1 = window
+        boxes = crop_labels(rows, W, H, window, task["min_visibility"])
+        if len(boxes) == 0 and tile_bucket(src, x0, y0, task["seed"]) >= task["empty_keep"]:
+            continue
+        name = f"{stem}_x{x0}_y{y0}"
+        cv2.imwrite(str(out_img_dir / f"{name}.jpg"), image[y0:y1, x0:x1], params)
+        write_yolo_labels(out_lbl_dir / f"{name}.txt", boxes)
+        index_rows.append((task["split"], f"{name}.jpg", src, x0, y0, x1, y1, len(boxes)))
+    return index_rows
+
+def load_tile_index(path) -> list:
+    """Rows of tile_index.csv as dicts (coordinates and box counts as ints)"""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        return [{k: (int(v) if k in ("x0", "y0", "x1", "y1", "boxes") else v) for k, v in r.items()}
+                for r in csv.DictReader(f)]
+
+def main():
+    args = parse_args()
+    from tqdm import tqdm
+
+    data = load_data_yaml(args.data)
+    out = Path(args.out) if args.out else Path(data["path"]) / f"tiles_{args.tile_size}"
+    if out.resolve() == Path(data["path"]).resolve():
+        raise SystemExit("[Error] --out must differ from the source dataset root")
+
+    tasks, splits = [], {}
+    for split in args.splits:
+        images = split_images(data, split)
+        if not images:
+            continue
+        # A previous run's tiles would otherwise mix with different settings
+        for sub in ("images", "labels"):
+            if (out / sub / split).exists():
+                shutil.rmtree(out / sub / split)
+            (out / sub / split).mkdir(parents=True)
+        splits[split] = f"images/{split}"
+        for img in images:
+            tasks.append({"img": img, "lbl": img2label_path(img), "split": split,
+                          "out_img_dir": str(out / "images" / split), "out_lbl_dir": str(out / "labels" / split),
+                          "tile_size": args.tile_size, "overlap": args.overlap, "min_visibility": args.min_visibility,
+                          "empty_keep": args.empty_keep, "seed": args.seed, "quality": args.quality})
+    if not tasks:
+        print(f"[Error] No images found for splits {args.splits} in {args.data}")
+        return
+
+    print(f"Tiling {len(tasks)} images into {args.tile_size}px tiles ({args.overlap:.0%} overlap) -> {out}")
+    counts = {sp: [0, 0, 0] for sp in splits}  # tiles, empty tiles, boxes
+    index_path = out / INDEX_NAME
+    tmp = index_path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(INDEX_COLUMNS)
+        if args.workers > 1 and len(tasks) > 1:
+            pool = ProcessPoolExecutor(max_workers=args.workers)
+            results = pool.map(tile_image, tasks, chunksize=max(1, min(8, len(tasks) // (args.workers * 4))))
+        else:
+            pool, results = None, map(tile_image, tasks)
+        try:
+            for index_rows in tqdm(results, total=len(tasks), desc="Tiling"):
+                writer.writerows(index_rows)
+                for split, _, _, _, _, _, _, n in index_rows:
+                    c = counts[split]
+                    c[0] += 1; c[1] += n == 0; c[2] += n
+        finally:
+            if pool:
+                pool.shutdown()
+    os.replace(tmp, index_path)
+
+    yaml_path = out / "malaria.yaml"
+    write_data_yaml(yaml_path, out, splits, data.get("names", ["parasite", "wbc"]))
+
+    print("\n" + "="*60)
+    print("--- TILING SUMMARY ---")
+    print("="*60)
+    print(f"  {'split':<8}{'tiles':>10}{'empty':>10}{'boxes':>10}")
+    for split, (n, empty, boxes) in counts.items():
+        print(f"  {split:<8}{n:>10}{empty:>10}{boxes:>10}")
+    print(f"\n✅ Tiled dataset: {out}")
+    print(f"   Index: {index_path}")
+    print(f"   Train with: --data {yaml_path} --imgsz {args.tile_size}")
+
+if __name__ == "__main__":
+    main()
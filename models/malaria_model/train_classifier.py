@@ -0,0 +1,285 @@
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+# classifier_arch.py / cell_shards.py live one level up, next to app.py
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+IMG_SIZE = 224  # must match app.py
+
+# Notebook settings per stage: "head" trains the new head on a frozen backbone
+# (Malaria_Model_EfficientNet_B0.ipynb, part 1), "finetune" continues from it
+# with the last 3 feature blocks unfrozen (part 2)
+STAGES = {
+    "head":     {"lr": 1e-3, "batch": 128, "epochs": 50, "patience": 10},
+    "finetune": {"lr": 1e-4, "batch": 64,  "epochs": 30, "patience": 8},
+}
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Train the EfficientNet-B0 malaria cell classifier served by app.py")
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--data", type=str, help="Folder with train/ and val/ subfolders, each holding Parasitized/ and Uninfected/")
+    src.add_argument("--shards", type=str, help="Pre-decoded shard root from cell_shards.py (train/ and val/ inside); "
+                     "the stage augmentation then runs batched on the device (cell_shards.augment_batch)")
+    ap.add_argument("--stage", choices=list(STAGES), default="head")
+    ap.add_argument("--init", type=str, default=None, help="Checkpoint to start from (finetune: the head-stage model)")
+    ap.add_argument("--out", type=str, default=None,
+                    help="Best checkpoint (default: best_malaria_model.pt / best_malaria_model_finetuned.pt)")
+    ap.add_argument("--resume", action="store_true", help="Continue from <out>.last.pt if it exists")
+    ap.add_argument("--epochs", type=int, default=None)
+    ap.add_argument("--batch", type=int, default=None)
+    ap.add_argument("--lr", type=float, default=None)
+    ap.add_argument("--patience", type=int, default=None, help="Early stopping patience (epochs)")
+    ap.add_argument("--bf16", action="store_true", help="bfloat16 autocast (CPU with AVX512-BF16/AMX, or CUDA)")
+    ap.add_argument("--channels-last", action="store_true", help="NHWC memory format for the model and inputs")
+    ap.add_argument("--workers", type=int, default=None, help="DataLoader workers (default: tuned to the CPU count)")
+    ap.add_argument("--threads", type=int, default=None, help="torch compute threads (default: cores left after workers)")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--from-scratch", action="store_true", help="Without --init: random backbone instead of ImageNet weights")
+    return ap.parse_args()
+
+# build_transforms() as cell_shards.augment_batch() parameters, for --shards batches
+STAGE_AUGMENT = {
+    "head":     dict(degrees=20, hflip=0.5, translate=0.1, brightness=0.2, contrast=0.2),
+    "finetune": dict(degrees=25, hflip=0.5, vflip=0.3, translate=0.15, brightness=0.3, contrast=0.3,
+                     saturation=0.2, perspective=0.2, perspective_p=0.5),
+}
+
+def build_transforms(stage):
+    """Augmentation of the matching notebook stage; validation is Resize + Normalize"""
+    from torchvision import transforms
+    normalize = transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+    if stage == "head":
+        aug = [
+            transforms.RandomRotation(20),
+            transforms.RandomHorizontalFlip(),
+            transforms.RandomAffine(degrees=0, translate=(0.1, 0.1)),
+            transforms.ColorJitter(brightness=0.2, contrast=0.2),
+        ]
+    else:
+        aug = [
+            transforms.RandomRotation(25),
+            transforms.RandomHorizontalFlip(),
+            transforms.RandomVerticalFlip(p=0.3),
+            transforms.RandomAffine(degrees=0, translate=(0.15, 0.15)),
+            transforms.ColorJitter(brightness=0.3, contrast=0.3, saturation=0.2),
+            transforms.RandomPerspective(distortion_scale=0.2, p=0.5),
+        ]
+    train_tf = transforms.Compose([transforms.Resize((IMG_SIZE, IMG_SIZE)), *aug, transforms.ToTensor(), normalize])
+    eval_tf = transforms.Compose([transforms.Resize((IMG_SIZE, IMG_SIZE)), transforms.ToTensor(), normalize])
+    return train_tf, eval_tf
+
+def cpu_plan(workers, threads, cuda):
+    """
+    Splits the cores between DataLoader workers (decode/augment) and torch
+    compute threads, so the two don't oversubscribe the CPU.
+    """
+    cores = os.cpu_count() or 1
+    if workers is None:
+        workers = min(8, max(1, cores // 4)) if not cuda else min(8, cores)
+    if threads is None:
+        threads = max(1, cores - workers) if not cuda else max(1, cores // 2)
+    return workers, threads
+
+def make_loaders(args, workers, cuda):
+    import torch
+    from torch.utils.data import DataLoader
+
+    if args.shards:
+        from cell_shards import ShardDataset
+        train_ds = ShardDataset(Path(args.shards) / "train")
+        val_ds = ShardDataset(Path(args.shards) / "val")
+    else:
+        from torchvision import datasets
+        train_tf, eval_tf = build_transforms(args.stage)
+        train_ds = datasets.ImageFolder(f"{args.data}/train", transform=train_tf)
+        val_ds = datasets.ImageFolder(f"{args.data}/val", transform=eval_tf)
+
+    g = torch.Generator().manual_seed(args.seed)
+    common = {"num_workers": workers, "pin_memory": cuda}
+    if workers > 0:
+        common.update(persistent_workers=True, prefetch_factor=4)
+    train_loader = DataLoader(train_ds, batch_size=args.batch, shuffle=True, drop_last=False, generator=g, **common)
+    val_loader = DataLoader(val_ds, batch_size=args.batch, shuffle=False, **common)
+    return train_ds, val_ds, train_loader, val_loader
+
+def prepare_batch(x, y, args, device, training, generator):
+    """
+    Moves a batch to the device; shard batches are uint8 and get the stage's
+    augmentation (on the device, same recipe as build_transforms) and
+    normalization here
+    """
+    import torch
+    if args.shards:
+        from cell_shards import augment_batch, normalize_batch
+        x = x.to(device, non_blocking=True)
+        if training:
+            x = augment_batch(x, generator, **STAGE_AUGMENT[args.stage])
+        x = normalize_batch(x)
+    else:
+        x = x.to(device, non_blocking=True)
+    if args.channels_last:
+        x = x.contiguous(memory_format=torch.channels_last)
+    return x, y.to(device, non_blocking=True).float().unsqueeze(1)
+
+def run_epoch(model, loader, criterion, optimizer, args, device, generator=None):
+    """One pass over loader (training if optimizer is given). Returns (loss, acc, images/sec)."""
+    import torch
+    training = optimizer is not None
+    model.train(training)
+    amp = torch.autocast(device.type, dtype=torch.bfloat16, enabled=args.bf16)
+    running_loss, correct, total = 0.0, 0, 0
+    t0 = time.perf_counter()
+    with torch.set_grad_enabled(training):
+        for x, y in loader:
+            x, y = prepare_batch(x, y, args, device, training, generator)
+            with amp:
+                outputs = model(x)
+            # BCELoss is not autocast-safe: compute it in float32
+            outputs = outputs.float()
+            loss = criterion(outputs, y)
+            if training:
+                optimizer.zero_grad(set_to_none=True)
+                loss.backward()
+                optimizer.step()
+            running_loss += loss.item() * x.size(0)
+            correct += ((outputs > 0.5).float() == y).sum().item()
+            total += y.size(0)
+    dt = time.perf_counter() - t0
+    total = max(1, total)
+    return running_loss / total, correct / total, total / max(dt, 1e-9)
+
+def build_model(args, device):
+    """Notebook architecture + the freezing of the selected stage"""
+    import torch
+    from classifier_arch import build_malaria_classifier
+
+    model = build_malaria_classifier('efficientnet_b0', pretrained=args.init is None and not args.from_scratch)
+    if args.init:
+        checkpoint = torch.load(args.init, map_location='cpu')
+        model.load_state_dict(checkpoint['model_state_dict'])
+        print(f"Initialized from {args.init} (val_acc {checkpoint.get('val_acc', float('nan')):.4f})")
+
+    for p in model.parameters():
+        p.requires_grad = False
+    if args.stage == "head":
+        trainable = [model.classifier]
+        param_groups = [{'params': model.classifier.parameters(), 'lr': args.lr}]
+    else:
+        trainable = [model.features[-3:], model.classifier]
+        param_groups = [
+            {'params': model.features[-3:].parameters(), 'lr': args.lr * 0.1},  # lower LR for the base
+            {'params': model.classifier.parameters(), 'lr': args.lr},
+        ]
+    for m in trainable:
+        for p in m.parameters():
+            p.requires_grad = True
+
+    model = model.to(device)
+    if args.channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    return model, param_groups
+
+def main():
+    args = parse_args()
+    # Heavy imports are deferred so `--help` and argument errors return instantly
+    import random
+    import numpy as np
+    import torch
+    import torch.nn as nn
+    from torch.optim.lr_scheduler import ReduceLROnPlateau
+
+    stage = STAGES[args.stage]
+    for k in ("lr", "batch", "epochs", "patience"):
+        if getattr(args, k) is None:
+            setattr(args, k, stage[k])
+    if args.stage == "finetune" and not args.init and not args.resume:
+        print("[Warning] finetune stage without --init starts from ImageNet weights, not the trained head")
+    default_out = "best_malaria_model.pt" if args.stage == "head" else "best_malaria_model_finetuned.pt"
+    out = Path(args.out or Path(__file__).resolve().parent / default_out)
+    last = out.with_suffix(".last.pt")
+
+    random.seed(args.seed); np.random.seed(args.seed); torch.manual_seed(args.seed)
+    cuda = torch.cuda.is_available()
+    device = torch.device('cuda' if cuda else 'cpu')
+    workers, threads = cpu_plan(args.workers, args.threads, cuda)
+    torch.set_num_threads(threads)
+    if args.bf16 and not cuda and not torch.backends.mkldnn.is_available():
+        print("[Warning] oneDNN not available: bf16 autocast on this CPU will be slow")
+
+    train_ds, val_ds, train_loader, val_loader = make_loaders(args, workers, cuda)
+    # ImageFolder sorts classes: Parasitized=0, Uninfected=1 -> sigmoid is P(Uninfected)
+    print(f"Classes: {train_ds.class_to_idx}  train {len(train_ds)}  val {len(val_ds)}")
+    print(f"Device: {device}  stage: {args.stage}  batch: {args.batch}  lr: {args.lr}  "
+          f"workers: {workers}  threads: {threads}  bf16: {args.bf16}  channels_last: {args.channels_last}")
+
+    model, param_groups = build_model(args, device)
+    criterion = nn.BCELoss()
+    optimizer = torch.optim.Adam(param_groups)
+    scheduler = ReduceLROnPlateau(optimizer, mode='max', factor=0.5, patience=3) if args.stage == "finetune" else None
+    aug_gen = torch.Generator().manual_seed(args.seed + 1)
+
+    start_epoch, best_val_acc, epochs_no_improve = 0, 0.0, 0
+    if args.resume and last.exists():
+        state = torch.load(last, map_location='cpu', weights_only=False)
+        model.load_state_dict(state['model_state_dict'])
+        optimizer.load_state_dict(state['optimizer_state_dict'])
+        if scheduler and state.get('scheduler_state_dict'):
+            scheduler.load_state_dict(state['scheduler_state_dict'])
+        torch.set_rng_state(state['rng_state'])
+        train_loader.generator.set_state(state['loader_rng_state'])
+        aug_gen.set_state(state.get('aug_rng_state', state.get('flip_rng_state')))  # older checkpoints: 'flip_rng_state'
+        start_epoch, best_val_acc = state['epoch'] + 1, state['best_val_acc']
+        epochs_no_improve = state['epochs_no_improve']
+        print(f"✓ Resumed from {last} at epoch {start_epoch + 1} (best val_acc {best_val_acc:.4f})")
+    elif args.resume:
+        print(f"[INFO] No {last} yet, starting from scratch")
+
+    start_time = time.time()
+    for epoch in range(start_epoch, args.epochs):
+        train_loss, train_acc, train_ips = run_epoch(model, train_loader, criterion, optimizer, args, device, aug_gen)
+        val_loss, val_acc, val_ips = run_epoch(model, val_loader, criterion, None, args, device)
+        if scheduler:
+            scheduler.step(val_acc)
+
+        print(f"\nEpoch {epoch + 1}/{args.epochs}")
+        print(f"  Train Loss: {train_loss:.4f} | Train Acc: {train_acc:.4f} | {train_ips:.1f} img/s")
+        print(f"  Val Loss: {val_loss:.4f} | Val Acc: {val_acc:.4f} | {val_ips:.1f} img/s")
+        print(f"  Learning Rate: {optimizer.param_groups[-1]['lr']:.6f}")
+
+        if val_acc > best_val_acc:
+            print(f"  ✓ Validation accuracy improved from {best_val_acc:.4f} to {val_acc:.4f}")
+            print(f"  ✓ Saving best model to {out}")
+            best_val_acc = val_acc
+            epochs_no_improve = 0
+            out.parent.mkdir(parents=True, exist_ok=True)
+            # Same keys as the notebook checkpoints that app.py loads
+            torch.save({'epoch': epoch, 'model_state_dict': model.state_dict(), 'val_acc': val_acc,
+                        'val_loss': val_loss}, out)
+        else:
+            epochs_no_improve += 1
+            print(f"  No improvement for {epochs_no_improve} epoch(s)")
+
+        # Everything needed to continue this run exactly where it stopped
+        tmp = last.with_suffix(".tmp")
+        torch.save({'epoch': epoch, 'model_state_dict': model.state_dict(), 'val_acc': val_acc,
+                    'optimizer_state_dict': optimizer.state_dict(),
+                    'scheduler_state_dict': scheduler.state_dict() if scheduler else None,
+                    'best_val_acc': best_val_acc, 'epochs_no_improve': epochs_no_improve,
+                    'rng_state': torch.get_rng_state(), 'loader_rng_state': train_loader.generator.get_state(),
+                    'aug_rng_state': aug_gen.get_state(), 'args': vars(args)}, tmp)
+        os.replace(tmp, last)
+        print("-" * 80)
+
+        if epochs_no_improve >= args.patience:
+            print(f"\n⚠ Early stopping triggered after {epoch + 1} epochs")
+            break
+
+    print(f"\n✅ Training finished in {(time.time() - start_time) / 60:.1f} min. Best val_acc: {best_val_acc:.4f}")
+    print(f"   Best model: {out}")
+    print(f"   Resume state: {last}")
+
+if __name__ == "__main__":
+    main()
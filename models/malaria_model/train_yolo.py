@@ -1,6 +1,8 @@
 import argparse
-from ultralytics import YOLO
-import torch
+import json
+import os
+import time
+from pathlib import Path
 
 def parse_args():
     ap = argparse.ArgumentParser()
@@ -9,26 +11,185 @@ def parse_args():
     ap.add_argument("--epochs", type=int, default=80)
     ap.add_argument("--imgsz", type=int, default=640)
     ap.add_argument("--batch", type=int, default=16)
+    ap.add_argument("--workers", type=int, default=8, help="Dataloader workers (Ultralytics default: 8)")
+    ap.add_argument("--cache", choices=["none", "ram", "disk"], default="none", help="Ultralytics image caching")
     ap.add_argument("--name", type=str, default="malaria_yolov8")
+    ap.add_argument("--autotune", action="store_true",
+                    help="Run short trials over workers/batch/cache first, then train with the fastest config that fits in memory")
+    ap.add_argument("--tune_batches", type=int, default=30, help="Batches timed per trial (after --tune_warmup)")
+    ap.add_argument("--tune_warmup", type=int, default=5, help="Batches skipped at the start of every trial")
+    ap.add_argument("--tune_workers", type=int, nargs="+", default=None, help="Worker counts to try (default: 0, 2, 4, 8 up to the CPU count)")
+    ap.add_argument("--tune_batch_sizes", type=int, nargs="+", default=[8, 16, 32], help="Batch sizes to try")
+    ap.add_argument("--tune_mem_frac", type=float, default=0.85, help="A config 'fits' if its peak memory stays below this fraction of RAM/VRAM")
     return ap.parse_args()
 
+def train_kwargs(args, device):
+    """Arguments shared by the trials and the real run"""
+    return dict(data=args.data, imgsz=args.imgsz, lr0=0.01, cos_lr=True, patience=20, device=device,
+                pretrained=True, optimizer="SGD")
+
+# --- Auto-tune -----------------------------------------------------------------
+
+class _TrialDone(Exception):
+    """Raised from a batch callback to end a trial without validation/saving"""
+
+def _memory_bytes():
+    """RSS of this process + its dataloader workers"""
+    import psutil
+    proc = psutil.Process()
+    total = proc.memory_info().rss
+    for child in proc.children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except psutil.Error:
+            pass
+    return total
+
+def run_trial(args, device, workers, batch, cache, trial_dir):
+    """
+    Trains for tune_warmup + tune_batches batches with one config and times
+    the loop: data wait = batch_end -> next batch_start (the loader), compute
+    = batch_start -> batch_end. Returns a dict of measurements.
+    """
+    import psutil
+    import torch
+    from ultralytics import YOLO
+
+    n_total = args.tune_warmup + args.tune_batches
+    t = {"last_end": None, "start": None, "wait": 0.0, "compute": 0.0, "images": 0, "seen": 0, "peak": 0,
+         "first_batch": None}
+    t0 = time.perf_counter()
+
+    def on_batch_start(trainer):
+        now = time.perf_counter()
+        if t["first_batch"] is None:
+            t["first_batch"] = now - t0  # model + dataset setup, incl. building the image cache
+        if t["seen"] >= args.tune_warmup and t["last_end"] is not None:
+            t["wait"] += now - t["last_end"]
+        t["start"] = now
+
+    def on_batch_end(trainer):
+        now = time.perf_counter()
+        t["seen"] += 1
+        if t["seen"] > args.tune_warmup:
+            t["compute"] += now - t["start"]
+            t["images"] += trainer.batch_size
+        t["last_end"] = now
+        t["peak"] = max(t["peak"], _memory_bytes())
+        if t["seen"] >= n_total:
+            raise _TrialDone()
+
+    model = YOLO(args.model)
+    model.add_callback("on_train_batch_start", on_batch_start)
+    model.add_callback("on_train_batch_end", on_batch_end)
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+    result = {"workers": workers, "batch": batch, "cache": cache, "ok": True, "error": None}
+    try:
+        model.train(**train_kwargs(args, device), epochs=1, batch=batch, workers=workers,
+                    cache=False if cache == "none" else cache, project=str(trial_dir.parent), name=trial_dir.name,
+                    exist_ok=True, val=False, plots=False, save=False, verbose=False)
+        result["ok"] = False
+        result["error"] = "epoch ended before the trial finished (dataset too small for --tune_batches?)"
+    except _TrialDone:
+        pass
+    except (RuntimeError, MemoryError) as e:
+        result.update(ok=False, error=str(e).splitlines()[0][:200])
+
+    timed = t["wait"] + t["compute"]
+    result.update(
+        images_per_sec=t["images"] / timed if timed > 0 else 0.0,
+        data_wait_frac=t["wait"] / timed if timed > 0 else 0.0,
+        setup_sec=t["first_batch"],
+        peak_ram_gb=t["peak"] / 1e9,
+        peak_vram_gb=torch.cuda.max_memory_reserved() / 1e9 if torch.cuda.is_available() else None,
+    )
+    ram_total = psutil.virtual_memory().total / 1e9
+    fits = result["peak_ram_gb"] < args.tune_mem_frac * ram_total
+    if torch.cuda.is_available():
+        fits &= result["peak_vram_gb"] < args.tune_mem_frac * torch.cuda.get_device_properties(0).total_memory / 1e9
+    result["fits"] = bool(result["ok"] and fits)
+    del model
+    return result
+
+def autotune(args, device):
+    """
+    Staged search (each stage keeps the best value of the previous ones):
+    workers -> cache mode -> batch size. Returns (best config, all trials).
+    """
+    cpus = os.cpu_count() or 1
+    worker_grid = args.tune_workers or sorted({w for w in (0, 2, 4, 8) if w <= cpus} | {min(cpus, 8)})
+    trial_root = Path("runs") / "detect" / f"{args.name}_autotune"
+    trials = []
+
+    def best(cands):
+        ok = [r for r in cands if r["fits"]]
+        return max(ok, key=lambda r: r["images_per_sec"]) if ok else None
+
+    def trial(workers, batch, cache):
+        for r in trials:
+            if (r["workers"], r["batch"], r["cache"]) == (workers, batch, cache):
+                return r
+        print(f"\n[AUTOTUNE] trial {len(trials) + 1}: workers={workers} batch={batch} cache={cache}")
+        r = run_trial(args, device, workers, batch, cache, trial_root / f"trial{len(trials) + 1}")
+        trials.append(r)
+        status = "ok" if r["fits"] else (r["error"] or "exceeds memory limit")
+        print(f"[AUTOTUNE]   {r['images_per_sec']:.1f} img/s, data wait {r['data_wait_frac']:.0%}, "
+              f"peak RAM {r['peak_ram_gb']:.1f} GB -> {status}")
+        return r
+
+    cur = {"workers": args.workers, "batch": args.batch, "cache": args.cache}
+    for key, grid in (("workers", worker_grid), ("cache", ["none", "ram", "disk"]), ("batch", args.tune_batch_sizes)):
+        stage = [trial(**{**cur, key: v}) for v in grid]
+        winner = best(stage)
+        if winner:
+            cur[key] = winner[key]
+    winner = best(trials)
+    return (winner or {"workers": args.workers, "batch": args.batch, "cache": args.cache}), trials
+
+def save_report(path, args, best, trials):
+    report = {"data": args.data, "model": args.model, "imgsz": args.imgsz, "cpu_count": os.cpu_count(),
+              "best": {k: best[k] for k in ("workers", "batch", "cache")}, "trials": trials}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print("\n" + "="*72)
+    print("--- TRAINING THROUGHPUT AUTO-TUNE ---")
+    print("="*72)
+    print(f"  {'workers':>7}{'batch':>7}{'cache':>7}{'img/s':>10}{'wait':>8}{'setup s':>9}{'RAM GB':>8}  status")
+    for r in sorted(trials, key=lambda r: -r["images_per_sec"]):
+        mark = " <- best" if all(r[k] == best[k] for k in ("workers", "batch", "cache")) else ""
+        status = "ok" if r["fits"] else ("error" if r["error"] else "too big")
+        setup = f"{r['setup_sec']:.1f}" if r["setup_sec"] is not None else "-"
+        print(f"  {r['workers']:>7}{r['batch']:>7}{r['cache']:>7}{r['images_per_sec']:>10.1f}"
+              f"{r['data_wait_frac']:>8.0%}{setup:>9}{r['peak_ram_gb']:>8.1f}  {status}{mark}")
+    print(f"\nReport: {path}")
+
+# --- Main ----------------------------------------------------------------------
+
 def main():
     args = parse_args()
-    model = YOLO(args.model)
+    # Heavy imports are deferred so `--help` and argument errors return instantly
+    from ultralytics import YOLO
+    import torch
+
     device = 0 if torch.cuda.is_available() else "cpu"
+    if args.autotune:
+        best, trials = autotune(args, device)
+        save_report(Path("runs") / "detect" / f"{args.name}_autotune.json", args, best, trials)
+        args.workers, args.batch, args.cache = best["workers"], best["batch"], best["cache"]
+        print(f"Training with workers={args.workers} batch={args.batch} cache={args.cache}")
+
+    model = YOLO(args.model)
     results = model.train(
-        data=args.data,
-        imgsz=args.imgsz,
+        **train_kwargs(args, device),
         epochs=args.epochs,
         batch=args.batch,
+        workers=args.workers,
+        cache=False if args.cache == "none" else args.cache,
         name=args.name,
-        lr0=0.01,
-        cos_lr=True,
-        patience=20,
-        device=device,
-        pretrained=True,
         plots=True,
-        optimizer="SGD"
     )
     print(results)
 
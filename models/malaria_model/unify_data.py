@@ -1,10 +1,17 @@
-import cv2
-import math
 import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 from tqdm import tqdm
 import sys
 
+import numpy as np
+
+from ann_index import load_index
+from blob_store import BlobStore, _reflink
+from ann_parser import SHAPE_CIRCLE, SHAPE_POINT, YOLO_FMT, Annotations
+
 DB1_ROOT = Path(r"C:\Ankit\Reposetories\honors-final-project\models\malaria_model\dataset\Infected_1\NIH-NLM-ThickBloodSmearsPV")
 DB2_ROOT = Path(r"C:\Ankit\Reposetories\honors-final-project\models\malaria_model\dataset\Infected_2")
 DB3_ROOT = Path(r"C:\Ankit\Reposetories\honors-final-project\models\malaria_model\dataset\Uninfected\NIH-NLM-ThickBloodSmearsU")
@@ -12,120 +19,242 @@ OUTPUT_ROOT = Path(r"C:\Ankit\Reposetories\honors-final-project\models\malaria_m
 
 CLASS_MAP = {"parasite": 0, "white_blood_cell": 1}
 
+# Exact annotation label -> class id for each source dataset
+DB1_LABELS = {"Parasitized": CLASS_MAP["parasite"]}
+DB2_LABELS = {"Parasite": CLASS_MAP["parasite"], "White_Blood_Cell": CLASS_MAP["white_blood_cell"]}
+DB3_LABELS = {"White_Blood_Cell": CLASS_MAP["white_blood_cell"]}
+
 # --- NEW DATA-DRIVEN BOX SIZES ---
 # Use 57x57 for any "Point" parasite annotations (basedp on 56.67 avg diameter)
 PARASITE_POINT_BOX_SIZE = 57
 # Use 80x80 for all "Point" WBC annotations (educated guess)
 WBC_POINT_BOX_SIZE = 80
 
+# Optional content-addressed image store (blob_store.py): images are registered
+# by hash and linked from there, so every dataset view shares one copy
+STORE_ROOT = None  # e.g. Path(r"C:\...\malaria_model\image_store")
+
+# Worker processes used for the per-annotation loops (1 = sequential)
+NUM_WORKERS = os.cpu_count() or 1
+
 # --- Helper Functions (Updated & Robust) ---
 
-def clip_yolo_coords(x_center, y_center, w, h):
-    """Clips YOLO coordinates to be safely within [0.0, 1.0]."""
-    w = min(w, 1.0)
-    h = min(h, 1.0)
+def clip_yolo_boxes(x_center, y_center, w, h):
+    """
+    Clips YOLO coordinates (arrays) to be safely within [0.0, 1.0].
+    Returns the clipped columns and a mask of the boxes to keep.
+    """
+    w = np.minimum(w, 1.0)
+    h = np.minimum(h, 1.0)
     
-    x_min = max(0.0, x_center - w / 2.0)
-    y_min = max(0.0, y_center - h / 2.0)
-    x_max = min(1.0, x_center + w / 2.0)
-    y_max = min(1.0, y_center + h / 2.0)
+    x_min = np.maximum(0.0, x_center - w / 2.0)
+    y_min = np.maximum(0.0, y_center - h / 2.0)
+    x_max = np.minimum(1.0, x_center + w / 2.0)
+    y_max = np.minimum(1.0, y_center + h / 2.0)
     
-    final_x_center = (x_min + x_max) / 2.0
-    final_y_center = (y_min + y_max) / 2.0
     final_w = x_max - x_min
     final_h = y_max - y_min
     
-    # Add a check for zero-area boxes, which can crash training
-    if final_w <= 0.0 or final_h <= 0.0:
-        return None
-        
-    return final_x_center, final_y_center, final_w, final_h
+    # Drop zero-area boxes, which can crash training
+    keep = (final_w > 0.0) & (final_h > 0.0)
+    return (x_min + x_max) / 2.0, (y_min + y_max) / 2.0, final_w, final_h, keep
 
-def convert_circle_to_yolo(cx, cy, px, py, img_w, img_h):
-    """Calculates the YOLO bounding box for a 'Circle' annotation."""
-    radius = math.sqrt((cx - px)**2 + (cy - py)**2)
-    box_w = 2 * radius
-    box_h = 2 * radius
-    
-    x_center_norm = cx / img_w
-    y_center_norm = cy / img_h
-    w_norm = box_w / img_w
-    h_norm = box_h / img_w
+def annotations_to_yolo(anns, img_w, img_h):
+    """
+    YOLO label lines for a whole file of columnar annotations (see ann_parser).
+    Circles use their own radius, points the fixed box sizes above.
+    """
+    if len(anns) == 0:
+        return []
+    cx, cy, px, py = anns.coords.T
+    is_circle = anns.shape == SHAPE_CIRCLE
+    point_size = np.where(anns.label == CLASS_MAP["parasite"], PARASITE_POINT_BOX_SIZE, WBC_POINT_BOX_SIZE)
+    box = np.where(is_circle, 2 * np.sqrt((cx - px)**2 + (cy - py)**2), point_size)
     
-    return clip_yolo_coords(x_center_norm, y_center_norm, w_norm, h_norm)
-
-def convert_point_to_yolo(cx, cy, box_size, img_w, img_h):
-    """Calculates the YOLO bounding box for a 'Point' annotation."""
-    x_center_norm = cx / img_w
-    y_center_norm = cy / img_h
-    w_norm = box_size / img_w
-    h_norm = box_size / img_h
+    # Circles are normalized by the image width in both directions (as before)
+    w_norm = box / img_w
+    h_norm = np.where(is_circle, box / img_w, box / img_h)
     
-    return clip_yolo_coords(x_center_norm, y_center_norm, w_norm, h_norm)
+    x, y, w, h, keep = clip_yolo_boxes(cx / img_w, cy / img_h, w_norm, h_norm)
+    return [YOLO_FMT % row for row in zip(anns.label[keep].tolist(), x[keep].tolist(), y[keep].tolist(),
+                                          w[keep].tolist(), h[keep].tolist())]
+
+def annotation_file_to_yolo(af, shape, img_w, img_h):
+    """
+    YOLO lines of one indexed annotation file (already restricted to this
+    dataset's exact labels), or None if the file is empty.
+    shape restricts the rows to SHAPE_CIRCLE / SHAPE_POINT (None = both).
+    """
+    if af.n_lines == 0:
+        return None
+    anns = af.anns
+    if shape is not None:
+        keep = anns.shape == shape
+        anns = Annotations(anns.label[keep], anns.shape[keep], anns.coords[keep])
+    return annotations_to_yolo(anns, img_w, img_h)
+
+def indexed_files(ann_root, label_map):
+    """
+    [(ann_path, AnnotationFile or None)] for every annotation file under
+    ann_root, served from the persistent annotation index (ann_index.py) with
+    the exact-label/strict-column rules this script always used.
+    """
+    index = load_index(ann_root)
+    return [(path, index.file(i, label_map, strict=True)) for i, path in enumerate(index.paths())]
+
+# EXIF orientations that swap width and height (cv2.imread applies them)
+_EXIF_TRANSPOSED = {5, 6, 7, 8}
+
+def probe_image_size(path):
+    """
+    Returns (width, height) from the image header without decoding pixels.
+    Matches cv2.imread's shape, which honours the EXIF orientation tag.
+    """
+    from PIL import Image
+    with Image.open(path) as im:
+        w, h = im.size
+        try:
+            if im.getexif().get(0x0112) in _EXIF_TRANSPOSED:
+                w, h = h, w
+        except Exception:
+            pass
+    return w, h
+
+_store = None
+
+def image_store():
+    """BlobStore of STORE_ROOT, one per process so its digest cache is only loaded once"""
+    global _store
+    if _store is None:
+        _store = BlobStore(STORE_ROOT)
+    return _store
+
+def place_image(src, dst):
+    """
+    Place src at dst without re-encoding: hardlink, else reflink, else copy.
+    With STORE_ROOT set, dst links to src's blob; returns the blob key (or None).
+    """
+    if STORE_ROOT:
+        return image_store().add(src, dst)
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+    try:
+        _reflink(src, dst)
+        return
+    except (OSError, ImportError):
+        if os.path.lexists(dst):
+            os.remove(dst)
+    shutil.copyfile(src, dst)
+
+def run_files(worker, ann_files, desc):
+    """
+    Runs worker((ann_path, annotations)) over all annotation files, in parallel
+    if NUM_WORKERS > 1. Returns the non-None worker results.
+    """
+    if NUM_WORKERS <= 1 or len(ann_files) < 2:
+        results = [worker(item) for item in tqdm(ann_files, desc=desc)]
+    else:
+        chunksize = max(1, min(32, len(ann_files) // (NUM_WORKERS * 4)))
+        with ProcessPoolExecutor(max_workers=NUM_WORKERS) as pool:
+            results = list(tqdm(pool.map(worker, ann_files, chunksize=chunksize), total=len(ann_files), desc=desc))
+    return [r for r in results if r is not None]
 
 # --- Main Processing Functions (Corrected) ---
 
+def _db1_file(item, img_root, dest_img_dir, dest_lab_dir):
+    """Converts one DB 1 annotation file (runs in a worker process)"""
+    ann_path, af = item
+    patient_name = ann_path.parent.name
+    file_stem = ann_path.stem
+    
+    src_img_path = img_root / patient_name / f"{file_stem}.jpg"
+    new_name_base = f"db1_{patient_name}_{file_stem}"
+    dest_img_path = dest_img_dir / f"{new_name_base}.jpg"
+    dest_lab_path = dest_lab_dir / f"{new_name_base}.txt"
+    
+    if not src_img_path.exists():
+        print(f"    [Warning] Missing image for annotation: {ann_path}", file=sys.stderr)
+        return
+        
+    try:
+        try:
+            actual_w, actual_h = probe_image_size(src_img_path)
+        except Exception:
+            print(f"    [Warning] Failed to read image: {src_img_path}", file=sys.stderr)
+            return
+        
+        if af is None:
+            print(f"  [Error] Failed to process {ann_path}: annotation file could not be parsed", file=sys.stderr)
+            return
+        yolo_lines = annotation_file_to_yolo(af, SHAPE_CIRCLE, actual_w, actual_h)
+        if yolo_lines is None:
+            print(f"    [Warning] Annotation file is empty, skipping: {ann_path}", file=sys.stderr)
+            return
+        
+        key = place_image(src_img_path, dest_img_path)
+        with open(dest_lab_path, 'w') as f:
+            f.write("\n".join(yolo_lines))
+        return dest_img_path.name, key, image_store().take_new_digests() if STORE_ROOT else None
+            
+    except Exception as e:
+        print(f"  [Error] Failed to process {ann_path}: {e}", file=sys.stderr)
+
 def process_db1(src_root, dest_img_dir, dest_lab_dir):
     """Processes DB 1 (Corrected Dimension Handling + Sane Sizes)"""
     print("Processing DB 1...")
     img_root = src_root / "All_PvTk"
     ann_root = src_root / "All_annotations"
     
-    ann_files = list(ann_root.glob("**/*.txt"))
+    ann_files = indexed_files(ann_root, DB1_LABELS)
     if not ann_files:
         print(f"  [Error] No annotation files found in {ann_root}", file=sys.stderr)
-        return
+        return []
 
-    for ann_path in tqdm(ann_files, desc="DB 1"):
-        patient_name = ann_path.parent.name
-        file_stem = ann_path.stem
-        
-        src_img_path = img_root / patient_name / f"{file_stem}.jpg"
-        new_name_base = f"db1_{patient_name}_{file_stem}"
-        dest_img_path = dest_img_dir / f"{new_name_base}.jpg"
-        dest_lab_path = dest_lab_dir / f"{new_name_base}.txt"
+    worker = partial(_db1_file, img_root=img_root, dest_img_dir=dest_img_dir, dest_lab_dir=dest_lab_dir)
+    return run_files(worker, ann_files, "DB 1")
+
+def _db2_file(item, img_root, dest_img_dir, dest_lab_dir):
+    """Converts one DB 2 annotation file (runs in a worker process)"""
+    ann_path, af = item
+    patient_name = ann_path.parent.name
+    file_stem = ann_path.stem
+    
+    src_img_path = img_root / patient_name / f"{file_stem}.jpg"
+    new_name_base = f"db2_{patient_name}_{file_stem}"
+    dest_img_path = dest_img_dir / f"{new_name_base}.jpg"
+    dest_lab_path = dest_lab_dir / f"{new_name_base}.txt"
+    
+    if not src_img_path.exists():
+        print(f"    [Warning] Missing image for annotation: {ann_path}", file=sys.stderr)
+        return
         
-        if not src_img_path.exists():
-            print(f"    [Warning] Missing image for annotation: {ann_path}", file=sys.stderr)
-            continue
-            
+    try:
         try:
-            image = cv2.imread(str(src_img_path))
-            if image is None:
-                print(f"    [Warning] Failed to read image: {src_img_path}", file=sys.stderr)
-                continue
-            
-            actual_h, actual_w, _ = image.shape
-            
-            with open(ann_path, 'r') as f:
-                lines = f.read().splitlines()
-            
-            if not lines:
-                print(f"    [Warning] Annotation file is empty, skipping: {ann_path}", file=sys.stderr)
-                continue
-            
-            yolo_lines = []
-            for line in lines[1:]:
-                parts = line.split(',')
-                if not parts or len(parts) < 9: continue
-                
-                obj_type, ann_type = parts[1], parts[3]
-                
-                if obj_type == "Parasitized" and ann_type == "Circle":
-                    class_id = CLASS_MAP["parasite"]
-                    cx, cy = float(parts[5]), float(parts[6])
-                    px, py = float(parts[7]), float(parts[8])
-                    
-                    yolo_data = convert_circle_to_yolo(cx, cy, px, py, actual_w, actual_h)
-                    if yolo_data:
-                        yolo_lines.append(f"{class_id} {yolo_data[0]:.6f} {yolo_data[1]:.6f} {yolo_data[2]:.6f} {yolo_data[3]:.6f}")
+            actual_w, actual_h = probe_image_size(src_img_path)
+        except Exception:
+            print(f"    [Warning] Failed to read image: {src_img_path}", file=sys.stderr)
+            return
+        
+        if af is None:
+            print(f"  [Error] Failed to process {ann_path}: annotation file could not be parsed", file=sys.stderr)
+            return
+        yolo_lines = annotation_file_to_yolo(af, None, actual_w, actual_h)
+        if yolo_lines is None:
+            print(f"    [Warning] Annotation file is empty, skipping: {ann_path}", file=sys.stderr)
+            return
+
+        key = place_image(src_img_path, dest_img_path)
+        with open(dest_lab_path, 'w') as f:
+            f.write("\n".join(yolo_lines))
+        return dest_img_path.name, key, image_store().take_new_digests() if STORE_ROOT else None
             
-            cv2.imwrite(str(dest_img_path), image)
-            with open(dest_lab_path, 'w') as f:
-                f.write("\n".join(yolo_lines))
-                
-        except Exception as e:
-            print(f"  [Error] Failed to process {ann_path}: {e}", file=sys.stderr)
+    except Exception as e:
+        print(f"  [Error] Failed to process {ann_path}: {e}", file=sys.stderr)
 
 def process_db2(src_root, dest_img_dir, dest_lab_dir):
     """Processes DB 2 (Corrected Dimension Handling + Sane Sizes)"""
@@ -133,76 +262,56 @@ def process_db2(src_root, dest_img_dir, dest_lab_dir):
     img_root = src_root / "Thick_Smears_150"
     ann_root = src_root / "GT_updated"
     
-    ann_files = list(ann_root.glob("**/*.txt"))
+    ann_files = indexed_files(ann_root, DB2_LABELS)
     if not ann_files:
         print(f"  [Error] No annotation files found in {ann_root}", file=sys.stderr)
-        return
+        return []
+
+    worker = partial(_db2_file, img_root=img_root, dest_img_dir=dest_img_dir, dest_lab_dir=dest_lab_dir)
+    return run_files(worker, ann_files, "DB 2")
 
-    for ann_path in tqdm(ann_files, desc="DB 2"):
-        patient_name = ann_path.parent.name
-        file_stem = ann_path.stem
+def _db3_file(item, img_root, dest_img_dir, dest_lab_dir):
+    """Converts one DB 3 annotation file (runs in a worker process)"""
+    import cv2
+
+    ann_path, af = item
+    patient_name = ann_path.parent.name
+    file_stem = ann_path.stem
+    
+    src_img_path = img_root / patient_name / "tiled" / f"{file_stem}.tiff"
+    new_name_base = f"db3_{patient_name}_{file_stem}"
+    dest_img_path = dest_img_dir / f"{new_name_base}.jpg"
+    dest_lab_path = dest_lab_dir / f"{new_name_base}.txt"
+    
+    if not src_img_path.exists():
+        print(f"    [Warning] Missing image for annotation: {ann_path}", file=sys.stderr)
+        return
         
-        src_img_path = img_root / patient_name / f"{file_stem}.jpg"
-        new_name_base = f"db2_{patient_name}_{file_stem}"
-        dest_img_path = dest_img_dir / f"{new_name_base}.jpg"
-        dest_lab_path = dest_lab_dir / f"{new_name_base}.txt"
+    try:
+        # TIFF -> JPEG is a real format change, so DB 3 still decodes and re-encodes
+        image = cv2.imread(str(src_img_path))
+        if image is None:
+            print(f"    [Warning] Failed to read image: {src_img_path}", file=sys.stderr)
+            return
         
-        if not src_img_path.exists():
-            print(f"    [Warning] Missing image for annotation: {ann_path}", file=sys.stderr)
-            continue
-            
-        try:
-            image = cv2.imread(str(src_img_path))
-            if image is None:
-                print(f"    [Warning] Failed to read image: {src_img_path}", file=sys.stderr)
-                continue
-            
-            actual_h, actual_w, _ = image.shape
-            
-            with open(ann_path, 'r') as f:
-                lines = f.read().splitlines()
+        actual_h, actual_w, _ = image.shape
+
+        if af is None:
+            print(f"  [Error] Failed to process {ann_path}: annotation file could not be parsed", file=sys.stderr)
+            return
+        yolo_lines = annotation_file_to_yolo(af, SHAPE_POINT, actual_w, actual_h)
+        if yolo_lines is None:
+            print(f"    [Warning] Annotation file is empty, skipping: {ann_path}", file=sys.stderr)
+            return
+
+        cv2.imwrite(str(dest_img_path), image)
+        key = image_store().adopt(dest_img_path) if STORE_ROOT else None
+        with open(dest_lab_path, 'w') as f:
+            f.write("\n".join(yolo_lines))
+        return dest_img_path.name, key, image_store().take_new_digests() if STORE_ROOT else None
             
-            if not lines:
-                print(f"    [Warning] Annotation file is empty, skipping: {ann_path}", file=sys.stderr)
-                continue
-                
-            yolo_lines = []
-            for line in lines[1:]:
-                parts = line.split(',')
-                if not parts or len(parts) < 4: continue
-                
-                obj_type, ann_type = parts[1], parts[3]
-                
-                class_id = -1
-                if obj_type == "Parasite":
-                    class_id = CLASS_MAP["parasite"]
-                elif obj_type == "White_Blood_Cell":
-                    class_id = CLASS_MAP["white_blood_cell"]
-                else:
-                    continue 
-                
-                yolo_data = None
-                if ann_type == "Circle" and len(parts) >= 9:
-                    cx, cy = float(parts[5]), float(parts[6])
-                    px, py = float(parts[7]), float(parts[8])
-                    yolo_data = convert_circle_to_yolo(cx, cy, px, py, actual_w, actual_h)
-                
-                elif ann_type == "Point" and len(parts) >= 7:
-                    cx, cy = float(parts[5]), float(parts[6])
-                    if class_id == CLASS_MAP["parasite"]:
-                        yolo_data = convert_point_to_yolo(cx, cy, PARASITE_POINT_BOX_SIZE, actual_w, actual_h)
-                    elif class_id == CLASS_MAP["white_blood_cell"]:
-                        yolo_data = convert_point_to_yolo(cx, cy, WBC_POINT_BOX_SIZE, actual_w, actual_h)
-                
-                if yolo_data:
-                    yolo_lines.append(f"{class_id} {yolo_data[0]:.6f} {yolo_data[1]:.6f} {yolo_data[2]:.6f} {yolo_data[3]:.6f}")
-
-            cv2.imwrite(str(dest_img_path), image)
-            with open(dest_lab_path, 'w') as f:
-                f.write("\n".join(yolo_lines))
-                
-        except Exception as e:
-            print(f"  [Error] Failed to process {ann_path}: {e}", file=sys.stderr)
+    except Exception as e:
+        print(f"  [Error] Failed to process {ann_path}: {e}", file=sys.stderr)
 
 def process_db3(src_root, dest_img_dir, dest_lab_dir):
     """Processes DB 3 (Corrected Dimension Handling + Sane Sizes)"""
@@ -210,60 +319,13 @@ def process_db3(src_root, dest_img_dir, dest_lab_dir):
     img_root = src_root / "Uninfected patients"
     ann_root = src_root / "Annotations"
     
-    ann_files = list(ann_root.glob("**/*.txt"))
+    ann_files = indexed_files(ann_root, DB3_LABELS)
     if not ann_files:
         print(f"  [Error] No annotation files found in {ann_root}", file=sys.stderr)
-        return
+        return []
 
-    for ann_path in tqdm(ann_files, desc="DB 3"):
-        patient_name = ann_path.parent.name
-        file_stem = ann_path.stem
-        
-        src_img_path = img_root / patient_name / "tiled" / f"{file_stem}.tiff"
-        new_name_base = f"db3_{patient_name}_{file_stem}"
-        dest_img_path = dest_img_dir / f"{new_name_base}.jpg"
-        dest_lab_path = dest_lab_dir / f"{new_name_base}.txt"
-        
-        if not src_img_path.exists():
-            print(f"    [Warning] Missing image for annotation: {ann_path}", file=sys.stderr)
-            continue
-            
-        try:
-            image = cv2.imread(str(src_img_path))
-            if image is None:
-                print(f"    [Warning] Failed to read image: {src_img_path}", file=sys.stderr)
-                continue
-            
-            actual_h, actual_w, _ = image.shape
-
-            with open(ann_path, 'r') as f:
-                lines = f.read().splitlines()
-            
-            if not lines:
-                print(f"    [Warning] Annotation file is empty, skipping: {ann_path}", file=sys.stderr)
-                continue
-                
-            yolo_lines = []
-            for line in lines[1:]:
-                parts = line.split(',')
-                if not parts or len(parts) < 7: continue
-
-                obj_type, ann_type = parts[1], parts[3]
-                
-                if obj_type == "White_Blood_Cell" and ann_type == "Point":
-                    class_id = CLASS_MAP["white_blood_cell"]
-                    cx, cy = float(parts[5]), float(parts[6])
-                    
-                    yolo_data = convert_point_to_yolo(cx, cy, WBC_POINT_BOX_SIZE, actual_w, actual_h)
-                    if yolo_data:
-                        yolo_lines.append(f"{class_id} {yolo_data[0]:.6f} {yolo_data[1]:.6f} {yolo_data[2]:.6f} {yolo_data[3]:.6f}")
-
-            cv2.imwrite(str(dest_img_path), image)
-            with open(dest_lab_path, 'w') as f:
-                f.write("\n".join(yolo_lines))
-                
-        except Exception as e:
-            print(f"  [Error] Failed to process {ann_path}: {e}", file=sys.stderr)
+    worker = partial(_db3_file, img_root=img_root, dest_img_dir=dest_img_dir, dest_lab_dir=dest_lab_dir)
+    return run_files(worker, ann_files, "DB 3")
 
 # --- Main Execution ---
 def main():
@@ -275,9 +337,17 @@ def main():
     
     print(f"Unified dataset will be created in: {OUTPUT_ROOT}\n")
     
-    process_db1(DB1_ROOT, output_images_dir, output_labels_dir)
-    process_db2(DB2_ROOT, output_images_dir, output_labels_dir)
-    process_db3(DB3_ROOT, output_images_dir, output_labels_dir)
+    placed = process_db1(DB1_ROOT, output_images_dir, output_labels_dir)
+    placed += process_db2(DB2_ROOT, output_images_dir, output_labels_dir)
+    placed += process_db3(DB3_ROOT, output_images_dir, output_labels_dir)
+
+    if STORE_ROOT:
+        refs = {f"images/{name}": key for name, key, _ in placed if key}
+        store = image_store()
+        store.write_view(f"unified_{OUTPUT_ROOT.name}", OUTPUT_ROOT.resolve(), refs)
+        # digests hashed in the worker processes come back with their results
+        store.save_digests({path: entry for _, _, new in placed if new for path, entry in new.items()})
+        print(f"\n✓ {len(refs)} images registered in store {STORE_ROOT}")
     
     print(f"\n✅ All datasets processed and unified in {OUTPUT_ROOT}")
     print("Your next step is to run a script for Step 2: Patient-Based Train/Validation Split.")
@@ -0,0 +1,478 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import NamedTuple
+
+import numpy as np
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+# Predictions are stored down to this confidence; any higher threshold is a
+# cheap filter on the cached scores (the kept boxes above it are exactly what
+# predict(conf=...) returns, since NMS visits boxes in score order)
+CONF_FLOOR = 0.001
+NMS_IOU = 0.7    # Ultralytics predict default
+MAX_DET = 300    # Ultralytics predict default
+BATCH_SIZE = 16
+PREFETCH_BATCHES = 2
+CACHE_DIR_NAME = "pred_cache"
+FLUSH_IMAGES = 1024  # new predictions are appended to disk in parts of this many images
+CACHE_FORMAT = 2     # files of another layout are ignored (and replaced on the next save)
+
+# ============================================================================
+# PER-IMAGE PREDICTION CACHE
+# ============================================================================
+
+# One index .npz per (weights sha256, NMS IoU, imgsz, max_det), e.g.
+#
+#   <weights dir>/pred_cache/3f2a9c0d1e4b5a67_iou0.7_imgszdefault_det300.npz
+#
+# holding per-image columns
+#
+#   image (N,)  size, mtime_ns (N,)  shape (N, 2) = (h, w)  offset (N + 1,)  meta (JSON string)
+#
+# and, next to it, the detections of all images as one (M, 6) float32 .npy
+# (x1, y1, x2, y2 in pixels, score, class) named in meta["dets"]. Only the
+# index is read into memory; the detections are memory-mapped and image i
+# (rows offset[i]:offset[i + 1]) is copied out when it is asked for. An
+# entry is reused while the image file keeps its size and mtime. New
+# predictions are first appended as part files with the same layout
+# (<name>.part<time_ns>.npz, later parts win); save() merges the main file
+# and all parts into a new main file.
+
+class Detections(NamedTuple):
+    boxes: np.ndarray    # (n, 4) float32 xyxy, original image pixels
+    scores: np.ndarray   # (n,) float32, descending
+    classes: np.ndarray  # (n,) int16
+    shape: tuple         # (h, w) of the original image
+
+    def above(self, conf):
+        """Detections with score > conf (same comparison as Ultralytics NMS)"""
+        keep = self.scores > conf
+        return Detections(self.boxes[keep], self.scores[keep], self.classes[keep], self.shape)
+
+    def counts(self, num_classes, conf=None):
+        """Per-class detection counts as an int array"""
+        classes = self.classes if conf is None else self.classes[self.scores > conf]
+        return np.bincount(classes.astype(np.int64), minlength=num_classes)[:num_classes]
+
+    def to_results(self, image, path, names):
+        """Ultralytics Results for drawing/saving (image: the BGR array that was predicted)"""
+        import torch
+        from ultralytics.engine.results import Results
+
+        data = np.concatenate([self.boxes, self.scores[:, None], self.classes[:, None].astype(np.float32)], axis=1)
+        return Results(orig_img=image, path=str(path), names=names, boxes=torch.from_numpy(data))
+
+def file_sha256(path, chunk=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def read_image(path):
+    """BGR image like Ultralytics' own loader (imdecode, so non-ASCII Windows paths work); None on failure"""
+    import cv2
+    try:
+        return cv2.imdecode(np.fromfile(path, np.uint8), cv2.IMREAD_COLOR)
+    except (OSError, ValueError):
+        return None
+
+def prefetch_images(image_paths, batch_size=BATCH_SIZE, depth=PREFETCH_BATCHES):
+    """
+    Yields (image_paths, decoded BGR images) batches. A background thread
+    decodes images while the detector works on the previous batch; at most
+    `depth` batches wait in memory. Images that fail to decode are skipped.
+    A batch is cut early when the image size changes, so every batch is
+    letterboxed exactly like a single-image call.
+    """
+    q = queue.Queue(maxsize=depth)
+    done = object()
+
+    def producer():
+        try:
+            batch = ([], [])
+            for image_path in image_paths:
+                image = read_image(image_path)
+                if image is None:
+                    print(f"[Warning] Could not read {image_path}, skipped")
+                    continue
+                if batch[0] and (len(batch[0]) == batch_size or image.shape != batch[1][0].shape):
+                    q.put(batch)
+                    batch = ([], [])
+                batch[0].append(image_path); batch[1].append(image)
+            if batch[0]:
+                q.put(batch)
+            q.put(done)
+        except BaseException as e:  # surface reader errors in the main thread
+            q.put(e)
+
+    threading.Thread(target=producer, daemon=True).start()
+    while True:
+        item = q.get()
+        if item is done:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+class _NmsTimeLimitWatch(logging.Handler):
+    """Notices Ultralytics' "NMS time limit exceeded" warning while active"""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.hit = False
+
+    def emit(self, record):
+        self.hit |= "NMS time limit" in record.getMessage()
+
+    def __enter__(self):
+        from ultralytics.utils import LOGGER
+        self.logger, self.logger_level = LOGGER, LOGGER.level
+        self.logger.addHandler(self)
+        self.logger.setLevel(min(self.logger_level, logging.WARNING))  # also when YOLO_VERBOSE=False
+        return self
+
+    def __exit__(self, *exc):
+        self.logger.removeHandler(self)
+        self.logger.setLevel(self.logger_level)
+
+def predict_batch(model, images, kwargs):
+    """
+    model(images, **kwargs), except that a batch cut short by Ultralytics'
+    NMS time limit (2 s + 0.05 s per image, after which the remaining
+    images come back with no detections) is predicted again image by
+    image instead of being cached as empty. A single image is never cut:
+    NMS stores its output before checking the limit.
+    """
+    if len(images) == 1:
+        return model(images, **kwargs)
+    with _NmsTimeLimitWatch() as watch:
+        results = model(images, **kwargs)
+    if watch.hit:
+        print(f"[Warning] NMS time limit hit in a batch of {len(images)}, predicting it image by image")
+        results = [model(image, **kwargs)[0] for image in images]
+    return results
+
+class PredictionCache:
+    """
+    Raw detector output per image, persisted once per model weights.
+
+        cache = PredictionCache(weights, iou=0.5)
+        missing = cache.missing(paths)
+        if missing:
+            cache.update(YOLO(weights), missing)   # inference only for these
+        det = cache.get(path).above(0.25)
+
+    cache_dir=None keeps everything in memory (nothing is written); `conf`
+    is then the threshold actually needed instead of the low floor.
+    """
+
+    def __init__(self, weights, cache_dir=CACHE_DIR_NAME, conf=CONF_FLOOR, iou=NMS_IOU, imgsz=None, max_det=MAX_DET):
+        self.conf, self.iou, self.imgsz, self.max_det = conf, iou, imgsz, max_det
+        self.names = None
+        self._files = []  # per file read: index columns + memory-mapped detections
+        self._index = {}  # abs path -> (file number, row) of its latest entry on disk
+        self._new = {}    # abs path -> (size, mtime_ns, Detections) not yet on disk
+        self._parts = []  # part files next to the main file
+        self.path = None
+        if cache_dir is not None:
+            if not os.path.isabs(cache_dir):
+                cache_dir = os.path.join(os.path.dirname(os.path.abspath(weights)), cache_dir)
+            self.sha = file_sha256(weights)
+            name = f"{self.sha[:16]}_iou{iou:g}_imgsz{imgsz or 'default'}_det{max_det}.npz"
+            self.path = os.path.join(cache_dir, name)
+            self._load()
+
+    def __len__(self):
+        return len(self._index) + sum(key not in self._index for key in self._new)
+
+    @staticmethod
+    def _key(image_path):
+        return os.path.abspath(image_path)
+
+    def _load(self):
+        self._parts = sorted(p for p in glob.glob(glob.escape(self.path[:-len(".npz")]) + ".part*.npz")
+                             if not p.endswith(".tmp.npz"))  # a write killed halfway
+        for path in ([self.path] if os.path.exists(self.path) else []) + self._parts:
+            self._read(path)
+
+    def _read(self, path):
+        """Adds the index of one cache file (main or part) and maps its detections"""
+        try:
+            with np.load(path, allow_pickle=False) as z:
+                cols = {k: z[k] for k in ("image", "size", "mtime_ns", "shape", "offset", "meta")}
+            meta = json.loads(str(cols["meta"]))
+            if (meta.get("format") != CACHE_FORMAT or meta.get("weights_sha256") != self.sha
+                    or meta.get("conf") > self.conf):
+                return
+            dets = np.load(os.path.join(os.path.dirname(path), meta["dets"]), mmap_mode="r", allow_pickle=False)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[Warning] Ignoring unreadable prediction cache {path}: {e}")
+            return
+        self.names = {int(k): v for k, v in meta["names"].items()}
+        n = len(self._files)
+        self._files.append({"path": path, "dets_name": meta["dets"], "dets": dets, "size": cols["size"],
+                            "mtime_ns": cols["mtime_ns"], "shape": cols["shape"], "offset": cols["offset"]})
+        for row, image in enumerate(cols["image"].tolist()):
+            self._index[image] = (n, row)
+
+    def _stored(self, key):
+        """(file columns, row) of a key on disk, or None"""
+        hit = self._index.get(key)
+        return None if hit is None else (self._files[hit[0]], hit[1])
+
+    def get(self, image_path):
+        """Cached Detections of an image, or None if missing or the file changed"""
+        key = self._key(image_path)
+        new, stored = self._new.get(key), None
+        if new is None:
+            stored = self._stored(key)
+            if stored is None:
+                return None
+        try:
+            st = os.stat(image_path)
+        except OSError:
+            return None
+        if new is not None:
+            return new[2] if (st.st_size, st.st_mtime_ns) == new[:2] else None
+        f, i = stored
+        if (st.st_size, st.st_mtime_ns) != (int(f["size"][i]), int(f["mtime_ns"][i])):
+            return None
+        data = np.array(f["dets"][f["offset"][i]:f["offset"][i + 1]])  # copied out of the mapping
+        return Detections(np.ascontiguousarray(data[:, :4]), np.ascontiguousarray(data[:, 4]),
+                          data[:, 5].astype(np.int16), tuple(f["shape"][i].tolist()))
+
+    def missing(self, image_paths):
+        """The paths that still need inference"""
+        return [p for p in image_paths if self.get(p) is None]
+
+    def put(self, image_path, result):
+        """Stores one Ultralytics Results object; returns its Detections"""
+        return self.put_data(image_path, result.boxes.data.cpu().numpy(), tuple(result.orig_shape))
+
+    def put_data(self, image_path, data, shape):
+        """Stores raw (n, 6) [x1, y1, x2, y2, score, class] detections of one image; returns its Detections"""
+        det = Detections(np.ascontiguousarray(data[:, :4], dtype=np.float32), data[:, 4].astype(np.float32),
+                         data[:, 5].astype(np.int16), tuple(shape))
+        st = os.stat(image_path)
+        self._new[self._key(image_path)] = (st.st_size, st.st_mtime_ns, det)
+        return det
+
+    def predict_kwargs(self):
+        kw = dict(conf=self.conf, iou=self.iou, max_det=self.max_det, verbose=False)
+        if self.imgsz:
+            kw["imgsz"] = self.imgsz
+        return kw
+
+    def update(self, model, image_paths, batch_size=BATCH_SIZE, depth=PREFETCH_BATCHES, on_batch=None):
+        """
+        Runs the detector on image_paths in batches (decoding in a background
+        thread) and stores the results. on_batch(paths, images, detections)
+        is called after every batch. New predictions are appended to disk every
+        FLUSH_IMAGES images and the cache file is saved at the end, also when
+        interrupted, so finished batches are never predicted again.
+        """
+        self.names = dict(model.names)
+        kwargs = self.predict_kwargs()
+        try:
+            for paths, images in prefetch_images(image_paths, batch_size, depth):
+                # conf must be passed per call: predict() ignores model.overrides['conf']
+                results = predict_batch(model, images, kwargs)
+                dets = [self.put(p, r) for p, r in zip(paths, results)]
+                if on_batch:
+                    on_batch(paths, images, dets)
+                if len(self._new) >= FLUSH_IMAGES:
+                    self.flush()
+        finally:
+            self.save()
+
+    def stream(self, image_paths, weights, workers=1, threads=None, batch_size=BATCH_SIZE):
+        """
+        Yields (image_path, Detections or None if unreadable) for every path,
+        in input order. Cached images come straight from the cache; the rest
+        is predicted window by window, either by one model in this process
+        or, with workers > 1, by a pool of processes that each hold their own
+        model and at most `threads` torch threads (default: CPU count /
+        workers), on shards of a few batches. New predictions are appended to
+        disk every FLUSH_IMAGES images and then leave memory (memory-only
+        caches: once yielded), so memory does not grow with the number of
+        images and a killed run loses at most the last unsaved part. The
+        cache file is saved (merged) at the end, also when interrupted.
+        """
+        step = batch_size * 4
+        window = step * max(workers, 1) * 2
+        threads = threads or max(1, (os.cpu_count() or 1) // max(workers, 1))
+        kwargs = self.predict_kwargs()
+        model = pool = None
+        try:
+            for i in range(0, len(image_paths), window):
+                chunk = image_paths[i:i + window]
+                missing = self.missing(chunk)
+                if missing and workers > 1:
+                    if pool is None:
+                        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                   initargs=(str(weights), threads))
+                    shards = [(missing[j:j + step], kwargs, batch_size) for j in range(0, len(missing), step)]
+                    # map() returns shards in input order, whichever worker finishes first
+                    for names, rows in pool.map(_predict_shard, shards):
+                        self.names = names
+                        for path, data, shape in rows:
+                            self.put_data(path, data, shape)
+                elif missing:
+                    if model is None:
+                        from ultralytics import YOLO
+                        model = YOLO(weights)
+                        self.names = dict(model.names)
+                    for paths, images in prefetch_images(missing, batch_size):
+                        for path, result in zip(paths, predict_batch(model, images, kwargs)):
+                            self.put(path, result)
+                for path in chunk:
+                    yield path, self.get(path)
+                    if self.path is None:
+                        self._new.pop(self._key(path), None)
+                if len(self._new) >= FLUSH_IMAGES:
+                    self.flush()
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+            self.save()
+
+    def flush(self):
+        """Appends the entries not yet on disk as a new part file, which then replaces them in memory"""
+        if self.path is None or not self._new:
+            return
+        part = f"{self.path[:-len('.npz')]}.part{time.time_ns():020d}.npz"
+        self._write(part, [(key, size, mtime_ns, det.shape, len(det.scores), partial(_det_rows, det))
+                           for key, (size, mtime_ns, det) in self._new.items()])
+        self._parts.append(part)
+        self._new = {}
+        self._read(part)
+
+    def save(self):
+        """
+        Merges the main file, all part files and the entries not yet on disk
+        into a new main file (no-op for memory-only caches). Detections are
+        copied image by image from the mapped files, never all loaded at once.
+        """
+        if self.path is None or not (self._new or self._parts):
+            return
+        self._write(self.path, self._merged_items())
+        merged = self._parts
+        # Unmap everything before deleting (Windows cannot delete mapped files)
+        self._files, self._index, self._new, self._parts = [], {}, {}, []
+        self._read(self.path)
+        self._remove_stale_files(merged)
+
+    def _merged_items(self):
+        """_write() items of every entry, sorted by key, the latest one per key"""
+        items = {}
+        for key, (n, row) in self._index.items():
+            f = self._files[n]
+            s, e = int(f["offset"][row]), int(f["offset"][row + 1])
+            items[key] = (key, int(f["size"][row]), int(f["mtime_ns"][row]), tuple(f["shape"][row].tolist()),
+                          e - s, partial(_mapped_rows, f["dets"], s, e))
+        for key, (size, mtime_ns, det) in self._new.items():
+            items[key] = (key, size, mtime_ns, det.shape, len(det.scores), partial(_det_rows, det))
+        return [items[k] for k in sorted(items)]
+
+    def _remove_stale_files(self, merged_parts):
+        """
+        After a merge: the merged parts and every detections file but the
+        main one's. Parts that appeared meanwhile (another process) and
+        temporary files stay.
+        """
+        stem = self.path[:-len(".npz")]
+        current = os.path.join(os.path.dirname(self.path), self._files[0]["dets_name"]) if self._files else None
+        merged = {p[:-len(".npz")] for p in merged_parts}
+        for path in glob.glob(glob.escape(stem) + ".*"):
+            rest = path[len(stem):]
+            if path in (self.path, current) or rest.endswith((".tmp.npy", ".tmp.npz")):
+                continue
+            if rest.startswith(".part"):
+                # <stem>.part<t>.npz and its <stem>.part<t>.<t2>.dets.npy
+                if (path[:-len(".npz")] if path.endswith(".npz") else path.rsplit(".", 3)[0]) not in merged:
+                    continue
+            elif not rest.endswith(".dets.npy"):
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _write(self, path, items):
+        """
+        Writes an index file plus its detections file from
+        (key, size, mtime_ns, shape, n_dets, load) items, load() returning
+        the (n_dets, 6) rows of that image
+        """
+        lengths = np.array([it[4] for it in items], dtype=np.int64)
+        offset = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        cache_dir = os.path.dirname(path)
+        os.makedirs(cache_dir, exist_ok=True)
+        dets_name = f"{os.path.basename(path)[:-len('.npz')]}.{time.time_ns():020d}.dets.npy"
+        tmp = os.path.join(cache_dir, dets_name[:-len(".npy")] + ".tmp.npy")
+        out = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32, shape=(int(offset[-1]), 6))
+        for it, s, e in zip(items, offset[:-1], offset[1:]):
+            if e > s:
+                out[s:e] = it[5]()
+        out.flush()
+        del out
+        os.replace(tmp, os.path.join(cache_dir, dets_name))
+
+        meta = {"format": CACHE_FORMAT, "dets": dets_name, "weights_sha256": self.sha, "conf": self.conf,
+                "iou": self.iou, "imgsz": self.imgsz, "max_det": self.max_det,
+                "names": {str(k): v for k, v in (self.names or {}).items()}}
+        cols = dict(
+            image=np.array([it[0] for it in items], dtype=str),
+            size=np.array([it[1] for it in items], dtype=np.int64),
+            mtime_ns=np.array([it[2] for it in items], dtype=np.int64),
+            shape=np.array([it[3] for it in items], dtype=np.int32).reshape(-1, 2),
+            offset=offset,
+            meta=np.array(json.dumps(meta)),
+        )
+        tmp = path[:-len(".npz")] + ".tmp.npz"
+        np.savez(tmp, **cols)
+        os.replace(tmp, path)
+
+def _det_rows(det):
+    return np.concatenate([det.boxes, det.scores[:, None], det.classes[:, None].astype(np.float32)], axis=1)
+
+def _mapped_rows(dets, s, e):
+    return dets[s:e]
+
+# --- Worker processes (stream with workers > 1) -----------------------------
+
+_worker_model = None
+
+def _init_worker(weights, threads):
+    """Loads one model per worker process with a limited number of compute threads"""
+    global _worker_model
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    import cv2
+    import torch
+    from ultralytics import YOLO
+
+    cv2.setNumThreads(1)
+    torch.set_num_threads(threads)
+    _worker_model = YOLO(weights)
+
+def _predict_shard(task):
+    """Returns (class names, [(path, raw (n, 6) detections, (h, w)), ...]) of one shard"""
+    paths, kwargs, batch_size = task
+    rows = []
+    for batch_paths, images in prefetch_images(paths, batch_size):
+        for path, r in zip(batch_paths, predict_batch(_worker_model, images, kwargs)):
+            rows.append((path, r.boxes.data.cpu().numpy(), tuple(r.orig_shape)))
+    return dict(_worker_model.names), rows
@@ -0,0 +1,243 @@
+import argparse
+import json
+import math
+import shutil
+import time
+from pathlib import Path
+
+# --- Configuration -----------------------------------------------------------
+
+IMG_EXTS = {".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp"}
+
+# --- Arguments ---------------------------------------------------------------
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Structured channel pruning + fine-tuning for the YOLOv8 detectors")
+    ap.add_argument("--weights", type=str, required=True, help="Trained detector, e.g. bccd_model/best_bccd.pt")
+    ap.add_argument("--data", type=str, required=True, help="Dataset YAML used for fine-tuning/eval (bccd.yaml / malaria.yaml)")
+    ap.add_argument("--ratio", type=float, default=0.4, help="Fraction of prunable channels to remove (global BN-gamma ranking)")
+    ap.add_argument("--min-keep", type=float, default=0.25, help="Never keep fewer than this fraction of a layer's channels")
+    ap.add_argument("--round-to", type=int, default=8, help="Round kept channel counts up to a multiple of this")
+    ap.add_argument("--epochs", type=int, default=10, help="Fine-tuning epochs after pruning (0 = no fine-tune)")
+    ap.add_argument("--imgsz", type=int, default=640)
+    ap.add_argument("--batch", type=int, default=16)
+    ap.add_argument("--split", type=str, default="test", help="Dataset split for count MAE (falls back to val)")
+    ap.add_argument("--conf", type=float, default=0.25)
+    ap.add_argument("--out", type=str, default=None, help="Pruned checkpoint path (default: <weights>_pruned.pt)")
+    ap.add_argument("--export", type=str, default=None, help="Optional export format for the pruned model, e.g. onnx")
+    ap.add_argument("--name", type=str, default="pruned_finetune")
+    return ap.parse_args()
+
+# --- Pruning -----------------------------------------------------------------
+
+def _local_pairs(det_model):
+    """
+    Yields (producer Conv, consumer nn.Conv2d, repeats) whose channels are
+    private to the pair, so they can be removed without touching concats or
+    residual additions elsewhere in the graph:
+      - Bottleneck.cv1 -> Bottleneck.cv2 inside every C2f/C3
+      - SPPF.cv1 -> SPPF.cv2 (consumer sees the channels 4x via the concat)
+      - Detect box/cls branches: seq[0] -> seq[1] -> final 1x1 conv
+    """
+    from ultralytics.nn.modules import Conv, Bottleneck, SPPF, Detect
+
+    for m in det_model.modules():
+        if isinstance(m, Bottleneck):
+            yield m.cv1, m.cv2.conv, 1
+        elif isinstance(m, SPPF):
+            yield m.cv1, m.cv2.conv, 4
+        elif isinstance(m, Detect):
+            for seq in list(m.cv2) + list(m.cv3):
+                if isinstance(seq[0], Conv) and isinstance(seq[1], Conv):
+                    yield seq[0], seq[1].conv, 1
+                    yield seq[1], seq[2], 1
+
+def _slice_conv(conv, out_idx=None, in_idx=None):
+    import torch.nn as nn
+    w = conv.weight.data
+    if out_idx is not None:
+        w = w[out_idx]
+    if in_idx is not None:
+        w = w[:, in_idx]
+    new = nn.Conv2d(w.shape[1], w.shape[0], conv.kernel_size, conv.stride, conv.padding,
+                    conv.dilation, conv.groups, bias=conv.bias is not None).to(w.device)
+    new.weight.data = w.clone()
+    if conv.bias is not None:
+        b = conv.bias.data
+        new.bias.data = (b[out_idx] if out_idx is not None else b).clone()
+    return new
+
+def _slice_bn(bn, idx):
+    import torch.nn as nn
+    new = nn.BatchNorm2d(len(idx), eps=bn.eps, momentum=bn.momentum).to(bn.weight.device)
+    new.weight.data = bn.weight.data[idx].clone()
+    new.bias.data = bn.bias.data[idx].clone()
+    new.running_mean = bn.running_mean[idx].clone()
+    new.running_var = bn.running_var[idx].clone()
+    return new
+
+def _replace_conv(root, old, new):
+    """Swap a bare nn.Conv2d held directly by a parent module"""
+    for parent in root.modules():
+        for name, child in parent.named_children():
+            if child is old:
+                setattr(parent, name, new)
+                return
+    raise RuntimeError("consumer conv not found in model")
+
+def prune_detector(det_model, ratio, min_keep, round_to):
+    """
+    Removes the lowest-|gamma| channels of every local producer/consumer pair
+    (network-slimming criterion, ranked globally across layers). Returns a list of
+    (layer, before, after) for the report.
+    """
+    import torch
+
+    pairs = [(p, c, r) for p, c, r in _local_pairs(det_model) if p.conv.groups == 1 and c.groups == 1]
+    if not pairs:
+        raise RuntimeError("No prunable layers found - is this a YOLOv8 detection model?")
+
+    # Global ranking (ties broken by position) so exactly `ratio` of all
+    # channels are candidates for removal, even when many gammas are equal
+    gammas = torch.cat([p.bn.weight.detach().abs().flatten().float() for p, _, _ in pairs])
+    removed = torch.zeros_like(gammas, dtype=torch.bool)
+    removed[torch.argsort(gammas, stable=True)[:int(len(gammas) * ratio)]] = True
+    removed = removed.split([p.bn.weight.numel() for p, _, _ in pairs])
+
+    changes = []
+    for (producer, consumer, repeats), layer_removed in zip(pairs, removed):
+        gamma = producer.bn.weight.detach().abs()
+        n = gamma.numel()
+        keep_n = int((~layer_removed).sum().item())
+        keep_n = max(keep_n, math.ceil(n * min_keep))
+        keep_n = min(n, int(math.ceil(keep_n / round_to) * round_to))
+        if keep_n == n:
+            continue
+        keep = torch.argsort(gamma, descending=True)[:keep_n].sort().values
+
+        producer.conv = _slice_conv(producer.conv, out_idx=keep)
+        producer.bn = _slice_bn(producer.bn, keep)
+        in_idx = torch.cat([keep + k * n for k in range(repeats)])
+        _replace_conv(det_model, consumer, _slice_conv(consumer, in_idx=in_idx))
+        changes.append((producer.conv, n, keep_n))
+    return changes
+
+# --- Metrics -----------------------------------------------------------------
+
+def model_stats(det_model, imgsz, runs=20):
+    """params, GFLOPs and median single-image CPU latency (ms)"""
+    import copy
+    import torch
+    from ultralytics.utils.torch_utils import get_flops
+
+    m = copy.deepcopy(det_model).float().cpu().eval()
+    params = sum(p.numel() for p in m.parameters())
+    gflops = get_flops(m, imgsz)
+    x = torch.zeros(1, 3, imgsz, imgsz)
+    times = []
+    with torch.no_grad():
+        for _ in range(3):
+            m(x)
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            m(x)
+            times.append((time.perf_counter() - t0) * 1000.0)
+    times.sort()
+    return {"params": params, "gflops": gflops, "cpu_latency_ms": times[len(times) // 2]}
+
+def count_mae(yolo, data, split, imgsz, conf):
+    """Per-class mean absolute error of object counts vs. YOLO label files"""
+    import numpy as np
+    from ultralytics.data.utils import check_det_dataset, img2label_paths
+
+    info = check_det_dataset(data)
+    img_dir = info.get(split) or info["val"]
+    images = sorted(str(p) for p in Path(img_dir).rglob("*") if p.suffix.lower() in IMG_EXTS)
+    nc = len(info["names"])
+    pred = np.zeros((len(images), nc), dtype=np.int64)
+    truth = np.zeros((len(images), nc), dtype=np.int64)
+
+    for i, (img, lbl) in enumerate(zip(images, img2label_paths(images))):
+        if Path(lbl).exists():
+            cls = np.loadtxt(lbl, ndmin=2, usecols=0).astype(int).ravel() if Path(lbl).stat().st_size else []
+            truth[i] = np.bincount(cls, minlength=nc)[:nc]
+        res = yolo.predict(img, imgsz=imgsz, conf=conf, device="cpu", verbose=False)[0]
+        pred[i] = np.bincount(res.boxes.cls.cpu().numpy().astype(int), minlength=nc)[:nc]
+
+    mae = np.abs(pred - truth).mean(axis=0) if len(images) else np.zeros(nc)
+    return {info["names"][c]: float(mae[c]) for c in range(nc)}
+
+# --- Fine-tuning -------------------------------------------------------------
+
+def finetune(yolo, args):
+    """
+    Ultralytics rebuilds the network from its YAML before training, which
+    would undo the pruning. The trainer below hands back the pruned module.
+    """
+    from ultralytics.models.yolo.detect import DetectionTrainer
+
+    pruned = yolo.model
+
+    class PrunedDetectionTrainer(DetectionTrainer):
+        def get_model(self, cfg=None, weights=None, verbose=True):
+            for p in pruned.parameters():
+                p.requires_grad = True
+            return pruned
+
+    yolo.train(trainer=PrunedDetectionTrainer, data=args.data, epochs=args.epochs, imgsz=args.imgsz,
+               batch=args.batch, name=args.name, lr0=0.002, warmup_epochs=0, plots=False)
+    return Path(yolo.trainer.best)
+
+# --- Main --------------------------------------------------------------------
+
+def main():
+    args = parse_args()
+    import torch
+    from ultralytics import YOLO
+
+    out = Path(args.out) if args.out else Path(args.weights).with_name(Path(args.weights).stem + "_pruned.pt")
+
+    print(f"Loading {args.weights}...")
+    yolo = YOLO(args.weights)
+    report = {"weights": args.weights, "data": args.data, "ratio": args.ratio}
+    report["before"] = model_stats(yolo.model, args.imgsz)
+    report["before"]["count_mae"] = count_mae(yolo, args.data, args.split, args.imgsz, args.conf)
+
+    changes = prune_detector(yolo.model, args.ratio, args.min_keep, args.round_to)
+    print(f"Pruned {len(changes)} layers, {sum(b - a for _, b, a in changes)} channels removed")
+    with torch.no_grad():
+        yolo.model.eval()(torch.zeros(1, 3, args.imgsz, args.imgsz))  # sanity: graph still consistent
+
+    if args.epochs > 0:
+        best = finetune(yolo, args)
+        yolo = YOLO(best)
+        shutil.copy2(best, out)
+    else:
+        yolo.save(out)
+    yolo = YOLO(out)
+
+    report["after"] = model_stats(yolo.model, args.imgsz)
+    report["after"]["count_mae"] = count_mae(yolo, args.data, args.split, args.imgsz, args.conf)
+    report["pruned_checkpoint"] = str(out)
+    if args.export:
+        report["export"] = str(yolo.export(format=args.export, imgsz=args.imgsz))
+
+    report_path = out.with_suffix(".prune_report.json")
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    b, a = report["before"], report["after"]
+    print("\n" + "="*60)
+    print("--- PRUNING REPORT ---")
+    print("="*60)
+    print(f"  {'':<18}{'before':>14}{'after':>14}")
+    print(f"  {'Params':<18}{b['params']:>14,}{a['params']:>14,}")
+    print(f"  {'GFLOPs':<18}{b['gflops']:>14.2f}{a['gflops']:>14.2f}")
+    print(f"  {'CPU latency (ms)':<18}{b['cpu_latency_ms']:>14.1f}{a['cpu_latency_ms']:>14.1f}")
+    for name in b["count_mae"]:
+        print(f"  {'MAE ' + name:<18}{b['count_mae'][name]:>14.2f}{a['count_mae'][name]:>14.2f}")
+    print(f"\n✅ Pruned detector: {out}")
+    print(f"   Report: {report_path}")
+
+if __name__ == "__main__":
+    main()
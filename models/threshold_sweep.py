@@ -0,0 +1,195 @@
+"""
+Confidence / NMS-IoU sweep for count accuracy.
+
+Runs the detector ONCE per image with NMS effectively off (iou=1.0) and a
+low confidence floor; the raw candidates go to the prediction cache. Every
+(conf, iou) pair of the grid is then evaluated from those candidates:
+
+  - NMS is re-applied for each IoU value (one torchvision call per image,
+    classes offset apart) with the per-image max_det cut, as Ultralytics does
+  - counts for ALL confidence thresholds come from one histogram of the
+    kept scores (reverse cumulative sum over the threshold bins)
+
+so the result for a grid point equals predict(conf=c, iou=t) (up to boxes
+clipped at the image border) without running the model again. Reports the
+per-class count MAE / bias and recommends a threshold per class.
+
+    python threshold_sweep.py --weights runs/detect/train4/weights/best.pt --images bccd_model/dataset/test/images
+"""
+import argparse
+import csv
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from detection_eval import label_path
+from pred_cache import CACHE_DIR_NAME, MAX_DET, PredictionCache
+
+IMG_EXTS = {".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp"}
+MAX_CANDIDATES = 30000  # Ultralytics max_nms: no more boxes than this ever enter NMS
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Sweep confidence and NMS IoU thresholds for per-class count accuracy")
+    ap.add_argument("--weights", type=str, required=True)
+    ap.add_argument("--images", type=str, required=True, help="Folder of images (recursive) with YOLO labels")
+    ap.add_argument("--labels", type=str, default=None,
+                    help="Folder of <image stem>.txt labels (default: Ultralytics rule, last /images/ -> /labels/)")
+    ap.add_argument("--conf_range", type=float, nargs=3, default=[0.05, 0.95, 0.05], metavar=("START", "STOP", "STEP"))
+    ap.add_argument("--iou_range", type=float, nargs=3, default=[0.3, 0.8, 0.05], metavar=("START", "STOP", "STEP"))
+    ap.add_argument("--floor", type=float, default=0.01, help="Confidence floor of the cached candidates (< smallest conf)")
+    ap.add_argument("--conf", type=float, default=0.25, help="Current confidence threshold, reported for comparison")
+    ap.add_argument("--iou", type=float, default=0.7, help="Current NMS IoU, reported for comparison")
+    ap.add_argument("--max_det", type=int, default=MAX_DET, help="Detections kept per image after NMS")
+    ap.add_argument("--batch", type=int, default=1,
+                    help="Images per detector call; candidates are kept without NMS, which is slow to post-process "
+                         "in batches and can hit Ultralytics' NMS time limit (such batches are re-run image by image)")
+    ap.add_argument("--pred_cache", type=str, default=CACHE_DIR_NAME,
+                    help="Prediction cache dir (relative paths: next to the weights)")
+    ap.add_argument("--out", type=str, default=None, help="CSV with every grid point (class, conf, iou, mae, bias, ...)")
+    return ap.parse_args()
+
+def grid(start, stop, step):
+    """Inclusive float range, rounded so 0.1 + 0.2 prints as 0.3"""
+    return np.round(np.arange(start, stop + step / 2, step), 6)
+
+def read_truth_counts(path, num_classes):
+    """Per-class object counts of a YOLO label file (no file = no objects); None if corrupt"""
+    if not os.path.exists(path):
+        return np.zeros(num_classes, dtype=np.int64)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            class_ids = [int(line.split(maxsplit=1)[0]) for line in f if line.strip()]
+    except (OSError, ValueError) as e:
+        print(f"[Warning] Corrupt label file {path}: {e}")
+        return None
+    return np.bincount(np.asarray(class_ids, dtype=np.int64), minlength=num_classes)[:num_classes]
+
+def flatten(dets):
+    """Concatenates per-image Detections into columns plus the image index of every box"""
+    lengths = [len(d.scores) for d in dets]
+    image_idx = np.repeat(np.arange(len(dets)), lengths)
+    if not dets:
+        return image_idx, np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.int64)
+    return (image_idx, np.concatenate([d.boxes for d in dets]), np.concatenate([d.scores for d in dets]),
+            np.concatenate([d.classes for d in dets]).astype(np.int64))
+
+def nms_keep(image_idx, boxes, scores, classes, iou, max_det):
+    """
+    Indices of the boxes class-wise NMS keeps, at most max_det per image
+    (the highest scoring ones), like Ultralytics' non_max_suppression.
+    image_idx must be sorted (as flatten() returns it). NMS cost grows with
+    boxes x kept boxes per call, so it runs per image, with classes shifted
+    apart the way Ultralytics does it instead of per class.
+    """
+    import torch
+    import torchvision
+
+    starts = np.searchsorted(image_idx, np.arange(image_idx[-1] + 2 if len(image_idx) else 1))
+    shifted = torch.from_numpy(boxes + (classes * (float(boxes.max(initial=0)) + 1.0)).astype(np.float32)[:, None])
+    scores_t = torch.from_numpy(scores)
+    keep = [torchvision.ops.nms(shifted[s:e], scores_t[s:e], iou)[:max_det] + s
+            for s, e in zip(starts[:-1], starts[1:]) if e > s]
+    return torch.cat(keep).numpy() if keep else np.zeros(0, dtype=np.int64)
+
+def count_grid(image_idx, scores, classes, confs, n_images, num_classes):
+    """
+    Detection counts for every confidence threshold at once: (K, N, C) with
+    counts[k, i, c] = #boxes of class c in image i with score > confs[k].
+    """
+    K = len(confs)
+    # bin b = number of thresholds below the score -> counted for thresholds k < b
+    bins = np.searchsorted(confs, scores, side="left")
+    flat = (image_idx * num_classes + classes) * (K + 1) + bins
+    hist = np.bincount(flat, minlength=n_images * num_classes * (K + 1)).reshape(n_images, num_classes, K + 1)
+    above = np.cumsum(hist[..., ::-1], axis=-1)[..., ::-1]  # above[..., k] = boxes in bins >= k
+    return np.moveaxis(above[..., 1:], -1, 0)
+
+def sweep(dets, truth, confs, ious, num_classes, max_det):
+    """MAE and bias (mean pred - truth) per (iou, class, conf) as (I, C, K) arrays"""
+    image_idx, boxes, scores, classes = flatten(dets)
+    mae = np.zeros((len(ious), num_classes, len(confs)))
+    bias = np.zeros_like(mae)
+    for i, iou in enumerate(ious):
+        keep = nms_keep(image_idx, boxes, scores, classes, float(iou), max_det)
+        counts = count_grid(image_idx[keep], scores[keep], classes[keep], confs, len(dets), num_classes)
+        err = counts - truth[None]                    # (K, N, C)
+        mae[i] = np.abs(err).mean(axis=1).T
+        bias[i] = err.mean(axis=1).T
+    return mae, bias
+
+def main():
+    args = parse_args()
+    confs, ious = grid(*args.conf_range), grid(*args.iou_range)
+    if args.floor >= confs.min():
+        raise SystemExit(f"[Error] --floor {args.floor} must be below the smallest confidence {confs.min()}")
+
+    images = sorted(p for p in Path(args.images).rglob("*") if p.suffix.lower() in IMG_EXTS)
+    if not images:
+        print(f"[Error] No images found in {args.images}", file=sys.stderr)
+        return 1
+
+    # Candidates before NMS: iou=1.0 suppresses nothing, max_det high enough to keep every candidate
+    cache = PredictionCache(args.weights, args.pred_cache, conf=args.floor, iou=1.0, max_det=MAX_CANDIDATES)
+    missing = cache.missing(images)
+    print(f"[INFO] {len(images) - len(missing)}/{len(images)} images in prediction cache {cache.path}")
+    if missing:
+        from ultralytics import YOLO
+        cache.update(YOLO(args.weights), missing, batch_size=args.batch)
+    names = cache.names or {}
+    num_classes = max(names) + 1 if names else 1
+
+    dets, truth = [], []
+    for img in images:
+        det = cache.get(img)
+        counts = read_truth_counts(label_path(str(img), args.labels), num_classes)
+        if det is None or counts is None:
+            continue
+        dets.append(det)
+        truth.append(counts)
+    if not dets:
+        print("[Error] No images with predictions and readable labels", file=sys.stderr)
+        return 1
+    truth = np.stack(truth)
+
+    # The current setting goes through the same code, so it is directly comparable
+    base_mae, base_bias = sweep(dets, truth, np.array([args.conf]), np.array([args.iou]), num_classes, args.max_det)
+    mae, bias = sweep(dets, truth, confs, ious, num_classes, args.max_det)
+
+    print("\n" + "="*72)
+    print(f"--- COUNT MAE OVER THE THRESHOLD GRID ({len(dets)} images) ---")
+    print("="*72)
+    show = confs[::max(1, len(confs) // 10)]
+    cols = [int(np.argmin(np.abs(confs - c))) for c in show]
+    for c in range(num_classes):
+        print(f"\n📊 {names.get(c, f'ID {c}')} (truth {truth[:, c].mean():.2f} per image)")
+        print(f"  {'iou/conf':<11}" + "".join(f"{confs[k]:>7g}" for k in cols))
+        for i, iou in enumerate(ious):
+            print(f"  {iou:<11.2f}" + "".join(f"{mae[i, c, k]:>7.2f}" for k in cols))
+
+    print("\n" + "="*72)
+    print("--- RECOMMENDED THRESHOLDS (lowest count MAE) ---")
+    print("="*72)
+    print(f"  {'class':<12}{'conf':>6}{'iou':>6}{'MAE':>8}{'bias':>8}   current (conf {args.conf:g}, iou {args.iou:g}): MAE / bias")
+    for c in range(num_classes):
+        i, k = np.unravel_index(np.argmin(mae[:, c, :]), mae[:, c, :].shape)
+        print(f"  {names.get(c, f'ID {c}'):<12}{confs[k]:>6g}{ious[i]:>6g}{mae[i, c, k]:>8.2f}{bias[i, c, k]:>+8.2f}"
+              f"   {base_mae[0, c, 0]:.2f} / {base_bias[0, c, 0]:+.2f}")
+    print("\n  bias > 0: over-counting, bias < 0: missed objects")
+
+    if args.out:
+        out = Path(args.out)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        with open(out, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["class", "conf", "iou", "mae", "bias"])
+            for c in range(num_classes):
+                for i, iou in enumerate(ious):
+                    for k, conf in enumerate(confs):
+                        w.writerow([names.get(c, c), f"{conf:g}", f"{iou:g}", f"{mae[i, c, k]:.4f}", f"{bias[i, c, k]:.4f}"])
+        print(f"\n[OK] Wrote full grid: {out}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+import argparse
+import time
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Train the tiny screening CNN used by the malaria cascade")
+    ap.add_argument("--data", type=str, required=True,
+                    help="Folder with train/ and val/ subfolders, each holding Parasitized/ and Uninfected/")
+    ap.add_argument("--out", type=str, default="malaria_model/malaria_screen_tiny.pt")
+    ap.add_argument("--width", type=int, default=16, help="Base channel width of TinyCellNet")
+    ap.add_argument("--epochs", type=int, default=15)
+    ap.add_argument("--batch", type=int, default=128)
+    ap.add_argument("--lr", type=float, default=3e-3)
+    ap.add_argument("--workers", type=int, default=4)
+    return ap.parse_args()
+
+def evaluate(model, loader, device):
+    import torch
+    model.eval()
+    correct = 0
+    total = 0
+    with torch.no_grad():
+        for x, y in loader:
+            prob = model(x.to(device)).squeeze(1)
+            correct += ((prob > 0.5).long().cpu() == y).sum().item()
+            total += y.numel()
+    return correct / max(1, total)
+
+def main():
+    args = parse_args()
+    import torch
+    import torch.nn as nn
+    from torch.utils.data import DataLoader
+    from torchvision import datasets, transforms
+    from malaria_cascade import TinyCellNet, SCREEN_IMG_SIZE, screen_transform
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    torch.manual_seed(42)
+
+    train_tf = transforms.Compose([
+        transforms.Resize((SCREEN_IMG_SIZE, SCREEN_IMG_SIZE)),
+        transforms.RandomHorizontalFlip(),
+        transforms.RandomVerticalFlip(),
+        transforms.RandomRotation(20),
+        transforms.ToTensor(),
+        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+    ])
+    train_ds = datasets.ImageFolder(f"{args.data}/train", transform=train_tf)
+    val_ds = datasets.ImageFolder(f"{args.data}/val", transform=screen_transform())
+    # ImageFolder sorts classes: Parasitized=0, Uninfected=1 -> sigmoid is P(Uninfected)
+    print(f"Classes: {train_ds.class_to_idx}")
+
+    train_loader = DataLoader(train_ds, batch_size=args.batch, shuffle=True, num_workers=args.workers)
+    val_loader = DataLoader(val_ds, batch_size=args.batch, shuffle=False, num_workers=args.workers)
+
+    model = TinyCellNet(width=args.width).to(device)
+    n_params = sum(p.numel() for p in model.parameters())
+    print(f"TinyCellNet: {n_params:,} parameters, device {device}")
+
+    criterion = nn.BCELoss()
+    optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr, weight_decay=1e-4)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=args.epochs)
+
+    best_acc = -1.0
+    for epoch in range(args.epochs):
+        model.train()
+        t0 = time.perf_counter()
+        running = 0.0
+        for x, y in train_loader:
+            x, y = x.to(device), y.float().to(device)
+            optimizer.zero_grad()
+            loss = criterion(model(x).squeeze(1), y)
+            loss.backward()
+            optimizer.step()
+            running += loss.item() * y.numel()
+        scheduler.step()
+
+        val_acc = evaluate(model, val_loader, device)
+        print(f"Epoch {epoch+1}/{args.epochs}  loss {running/len(train_ds):.4f}  "
+              f"val_acc {val_acc:.4f}  ({time.perf_counter()-t0:.1f}s)")
+        if val_acc > best_acc:
+            best_acc = val_acc
+            torch.save({'model_state_dict': model.state_dict(), 'val_acc': val_acc, 'width': args.width}, args.out)
+
+    print(f"\n✅ Best val_acc {best_acc:.4f}, saved to {args.out}")
+
+if __name__ == "__main__":
+    main()